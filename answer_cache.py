@@ -0,0 +1,237 @@
+"""
+Кэш готовых ответов перед generate_answer
+
+Два уровня:
+- точный: ключ - хеш (нормализованный запрос, упорядоченные id и text_hash
+  элементов контекста, модель, температура, шаблон промпта);
+- семантический: при промахе точного уровня ищутся прежние запросы с тем же
+  набором элементов контекста (порядок не важен) и теми же параметрами
+  генерации, эмбеддинг которых близок к эмбеддингу нового запроса.
+
+text_hash элементов входит в оба ключа, поэтому ответ, построенный на старой
+версии текста, не совпадет ни с одним новым запросом. Кроме того, записи,
+использовавшие измененные элементы, удаляются сразу (invalidate_items,
+вызывается из db.bulk_upsert_items). Эмбеддинги запросов считаются лениво -
+только когда в кэше есть ответ с тем же набором контекста.
+"""
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from config import ANSWER_CACHE_SETTINGS
+from rerank_cache import normalize_query
+
+logger = logging.getLogger(__name__)
+
+EXACT = 'exact'
+SEMANTIC = 'semantic'
+
+def context_fingerprint(context_items: List[Dict[str, Any]]) -> List[Tuple[Any, str]]:
+    """Упорядоченные пары (id, text_hash) элементов контекста"""
+    from embeddings import get_text_hash
+    return [(item.get('id'), get_text_hash(item['text'])) for item in context_items]
+
+def _digest(*parts: Any) -> str:
+    return hashlib.sha256(repr(parts).encode('utf-8')).hexdigest()
+
+def exact_key(query: str, fingerprint: List[Tuple[Any, str]], model: str, temperature: float, template: str) -> str:
+    """Ключ точного уровня"""
+    return _digest(normalize_query(query), tuple(fingerprint), model, float(temperature), template)
+
+def context_key(fingerprint: List[Tuple[Any, str]], model: str, temperature: float, template: str) -> str:
+    """Ключ набора контекста для семантического уровня (порядок элементов не важен)"""
+    return _digest(tuple(sorted(fingerprint, key=repr)), model, float(temperature), template)
+
+class AnswerCache:
+    """Потокобезопасный LRU-кэш ответов с точным и семантическим уровнями"""
+    def __init__(self, max_size: int = None, semantic: bool = None, threshold: float = None,
+                 embed: Callable[[str], List[float]] = None):
+        """
+        Args:
+            max_size: Максимальное количество ответов в памяти
+            semantic: Включить семантический уровень
+            threshold: Минимальное косинусное сходство запросов для семантического попадания
+            embed: Функция эмбеддинга запроса (по умолчанию embeddings.get_embedding)
+        """
+        self.max_size = max_size if max_size is not None else ANSWER_CACHE_SETTINGS.get('size', 1000)
+        self.semantic = semantic if semantic is not None else ANSWER_CACHE_SETTINGS.get('semantic', True)
+        self.threshold = threshold if threshold is not None else ANSWER_CACHE_SETTINGS.get('similarity_threshold', 0.95)
+        self._embed = embed
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        # Ключ набора контекста -> ключи ответов; id элемента -> ключи ответов
+        self._by_context: Dict[str, set] = {}
+        self._by_item: Dict[Any, set] = {}
+        self._lock = threading.Lock()
+        self.hits = {EXACT: 0, SEMANTIC: 0}
+        self.misses = 0
+        self.saved_seconds = 0.0
+
+    def get(self, query: str, context_items: List[Dict[str, Any]], model: str, temperature: float,
+            template: str) -> Optional[Tuple[str, str]]:
+        """
+        Ищет ответ сначала на точном, затем на семантическом уровне
+
+        Returns:
+            (ответ, уровень) или None
+        """
+        fingerprint = context_fingerprint(context_items)
+        key = exact_key(query, fingerprint, model, temperature, template)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return self._hit(entry, EXACT)
+            # Эмбеддинги записей читаются под блокировкой; недостающие считаются вне ее
+            candidates = [(self._entries[k], self._entries[k]['embedding'])
+                          for k in self._by_context.get(context_key(fingerprint, model, temperature, template), ())]
+
+        if candidates and self.semantic:
+            entry = self._semantic_match(query, candidates)
+            if entry is not None:
+                with self._lock:
+                    if entry['key'] in self._entries:
+                        self._entries.move_to_end(entry['key'])
+                        return self._hit(entry, SEMANTIC)
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, query: str, context_items: List[Dict[str, Any]], model: str, temperature: float,
+            template: str, answer: str, elapsed: float):
+        """Сохраняет ответ; elapsed - сколько секунд заняла генерация (экономия при попадании)"""
+        fingerprint = context_fingerprint(context_items)
+        key = exact_key(query, fingerprint, model, temperature, template)
+        entry = {
+            'key': key,
+            'query': query,
+            'answer': answer,
+            'elapsed': elapsed,
+            'context': context_key(fingerprint, model, temperature, template),
+            'items': {item_id for item_id, _ in fingerprint},
+            'embedding': None,
+        }
+        with self._lock:
+            if key in self._entries:
+                self._forget(key)
+            self._entries[key] = entry
+            self._by_context.setdefault(entry['context'], set()).add(key)
+            for item_id in entry['items']:
+                self._by_item.setdefault(item_id, set()).add(key)
+            while len(self._entries) > self.max_size:
+                self._forget(next(iter(self._entries)))
+
+    def invalidate_items(self, item_ids: Iterable[Any]) -> int:
+        """Удаляет ответы, в контексте которых были указанные элементы; возвращает их число"""
+        with self._lock:
+            keys = set()
+            for item_id in item_ids:
+                keys.update(self._by_item.get(item_id, ()))
+            for key in keys:
+                self._forget(key)
+        if keys:
+            logger.debug(f"Из кэша ответов удалено {len(keys)} записей после изменения элементов")
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_context.clear()
+            self._by_item.clear()
+            self.hits = {EXACT: 0, SEMANTIC: 0}
+            self.misses = 0
+            self.saved_seconds = 0.0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def report(self) -> Dict[str, Any]:
+        """Статистика: попадания по уровням, промахи, доля попаданий, сэкономленное время"""
+        with self._lock:
+            hits = sum(self.hits.values())
+            lookups = hits + self.misses
+            return {
+                'hits_exact': self.hits[EXACT],
+                'hits_semantic': self.hits[SEMANTIC],
+                'misses': self.misses,
+                'hit_rate': hits / lookups if lookups else 0.0,
+                'saved_seconds': self.saved_seconds,
+                'size': len(self._entries),
+            }
+
+    def _hit(self, entry: Dict[str, Any], level: str) -> Tuple[str, str]:
+        self.hits[level] += 1
+        self.saved_seconds += entry['elapsed']
+        return entry['answer'], level
+
+    def _forget(self, key: str):
+        entry = self._entries.pop(key)
+        for index, index_key in ((self._by_context, entry['context']),
+                                 *((self._by_item, item_id) for item_id in entry['items'])):
+            keys = index.get(index_key)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del index[index_key]
+
+    def _embedding(self, text: str) -> Optional[np.ndarray]:
+        embed = self._embed
+        if embed is None:
+            from embeddings import get_embedding as embed
+        try:
+            vector = np.asarray(embed(text), dtype=np.float64)
+        except Exception as e:
+            logger.warning(f"Не удалось получить эмбеддинг запроса для кэша ответов: {str(e)}")
+            return None
+        norm = np.linalg.norm(vector)
+        return vector / norm if vector.size and norm > 0 else None
+
+    def _semantic_match(self, query: str,
+                        candidates: List[Tuple[Dict[str, Any], Optional[np.ndarray]]]) -> Optional[Dict[str, Any]]:
+        """
+        Ближайший по эмбеддингу прежний запрос с тем же контекстом, если сходство не ниже порога
+
+        candidates - пары (запись, ее эмбеддинг на момент выборки под блокировкой).
+        Эмбеддинг прежнего запроса считается один раз, при первом сравнении, без
+        блокировки, и сохраняется в запись под блокировкой, если она еще в кэше.
+        """
+        vector = self._embedding(query)
+        if vector is None:
+            return None
+        best, best_similarity = None, self.threshold
+        computed = []
+        for entry, embedding in candidates:
+            if embedding is None:
+                embedding = self._embedding(entry['query'])
+                if embedding is None:
+                    continue
+                computed.append((entry, embedding))
+            if embedding.shape != vector.shape:
+                continue
+            similarity = float(embedding @ vector)
+            if similarity >= best_similarity:
+                best, best_similarity = entry, similarity
+        if computed:
+            with self._lock:
+                for entry, embedding in computed:
+                    if self._entries.get(entry['key']) is entry and entry['embedding'] is None:
+                        entry['embedding'] = embedding
+        return best
+
+_cache: Optional[AnswerCache] = None
+_cache_lock = threading.Lock()
+
+def get_answer_cache() -> AnswerCache:
+    """Возвращает общий кэш ответов, создавая его при первом вызове"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                from db import on_items_changed
+                _cache = AnswerCache()
+                on_items_changed(_cache.invalidate_items)
+    return _cache
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк поиска top-k по индексу BM25: полный перебор против MaxScore
+
+Проверяет, что результаты совпадают, и сообщает долю пропущенных вхождений.
+
+Использование:
+    python bench_bm25.py [-k 5] [-q 200] [--queries queries.txt]
+    python bench_bm25.py --synthetic 100000   # на синтетическом корпусе во временном каталоге
+"""
+import argparse
+import logging
+import random
+import tempfile
+import time
+
+from bm25_index import BM25Index, get_index
+from tokenization import tokenize
+
+def _synthetic_corpus(count: int, vocab_size: int = 20000, seed: int = 1):
+    """Корпус с распределением слов по закону Ципфа"""
+    rng = random.Random(seed)
+    letters = 'абвгдежзиклмнопрстуфхцчшэюя'
+    vocab = [''.join(rng.choice(letters) for _ in range(rng.randint(4, 10))) for _ in range(vocab_size)]
+    cumulative = []
+    total = 0.0
+    for rank in range(vocab_size):
+        total += 1.0 / (rank + 1)
+        cumulative.append(total)
+    return [
+        (f"doc{i}", ' '.join(rng.choices(vocab, cum_weights=cumulative, k=rng.randint(20, 120))))
+        for i in range(count)
+    ]
+
+def _sample_queries(index: BM25Index, count: int, seed: int = 2):
+    """Запросы из 3-5 слов, как у generate_keywords_for_query, взятые из словаря индекса"""
+    rng = random.Random(seed)
+    terms = sorted({term for segment in index.segments for term in segment.terms})
+    return [' '.join(rng.sample(terms, rng.randint(3, 5))) for _ in range(count)]
+
+def bench(index: BM25Index, queries, top_k: int):
+    timings = {True: 0.0, False: 0.0}
+    postings = scored = 0
+    mismatches = 0
+    for query in queries:
+        results = {}
+        for exhaustive in (True, False):
+            stats = {}
+            start = time.perf_counter()
+            results[exhaustive] = index.search(query, top_k, exhaustive=exhaustive, stats=stats)
+            timings[exhaustive] += time.perf_counter() - start
+            if not exhaustive:
+                postings += stats.get('postings', 0)
+                scored += stats.get('scored', 0)
+        if results[True] != results[False]:
+            mismatches += 1
+
+    count = len(queries)
+    print(f"Документов: {index.live_count}, запросов: {count}, top_k: {top_k}")
+    print(f"{'способ':<16} {'мс/запрос':>10}")
+    print(f"{'полный перебор':<16} {timings[True] * 1000 / count:>10.3f}")
+    print(f"{'MaxScore':<16} {timings[False] * 1000 / count:>10.3f}")
+    skipped = (postings - scored) / postings if postings else 0.0
+    print(f"Вхождений всего: {postings}, оценено: {scored}, пропущено: {skipped:.1%}")
+    print(f"Расхождений с полным перебором: {mismatches}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк отсечения MaxScore для BM25')
+    parser.add_argument('-k', '--top-k', type=int, default=5, help='Количество результатов')
+    parser.add_argument('-q', '--num-queries', type=int, default=200, help='Количество случайных запросов')
+    parser.add_argument('--queries', help='Файл с запросами, по одному на строку')
+    parser.add_argument('--synthetic', type=int, help='Построить синтетический корпус из N документов')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    if args.synthetic:
+        index = BM25Index(tempfile.mkdtemp(prefix='bm25_bench_')).build(_synthetic_corpus(args.synthetic))
+    else:
+        index = get_index()
+
+    if args.queries:
+        with open(args.queries, encoding='utf-8') as f:
+            queries = [line.strip() for line in f if tokenize(line)]
+    else:
+        queries = _sample_queries(index, args.num_queries)
+    bench(index, queries, args.top_k)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Микро-бенчмарки слоя доступа к базе данных
+
+Использование:
+    python bench_db.py prepared [-n 200]
+    python bench_db.py copy [-n 5000] [-d 3072]
+"""
+import argparse
+import json
+import logging
+import random
+import time
+from psycopg2.extras import execute_values
+from db import (get_connection, execute_prepared, PREPARED_STATEMENTS,
+                format_vector, _copy_rows, _upsert_embeddings, EMBEDDING_COLUMNS)
+
+logger = logging.getLogger('bench_db')
+
+def _sample_params(cur, keywords):
+    """Подбирает реальные параметры для горячих запросов из текущей базы"""
+    cur.execute("SELECT id, id_parent FROM items WHERE id_parent IS NOT NULL LIMIT 1")
+    row = cur.fetchone()
+    if not row:
+        raise RuntimeError("В таблице items нет элементов с родителем")
+    item_id, parent_id = row
+    patterns = [f"%{keyword}%" for keyword in keywords]
+    return {
+        'item_by_id': (item_id,),
+        'items_by_ids': ([item_id, parent_id],),
+        'child_blocks': (parent_id,),
+        'keyword_search': (patterns, 20),
+        'keyword_search_in_tree': (parent_id, patterns, 20),
+        'parent_items': (item_id,),
+        'child_items': (parent_id,),
+        'context_parents': ([item_id], 3),
+        'context_children': ([parent_id], 3),
+    }
+
+def _planning_time(cur, sql, params):
+    """Возвращает время планирования (мс) из EXPLAIN (ANALYZE, FORMAT JSON)"""
+    cur.execute(f"EXPLAIN (ANALYZE, FORMAT JSON) {sql}", params)
+    plan = cur.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0].get('Planning Time', 0.0)
+
+def bench_prepared(iterations: int, keywords):
+    """Сравнивает обычное выполнение горячих запросов с PREPARE/EXECUTE"""
+    print(f"{'оператор':<24} {'обычный, мс':>12} {'prepared, мс':>13} {'план обычн.':>12} {'план prep.':>11} {'экономия, мс':>13}")
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cases = _sample_params(cur, keywords)
+            for name, params in cases.items():
+                param_types, query = PREPARED_STATEMENTS[name]
+
+                start = time.perf_counter()
+                for _ in range(iterations):
+                    cur.execute(query, params)
+                    cur.fetchall()
+                plain_ms = (time.perf_counter() - start) * 1000 / iterations
+
+                # Первое выполнение подготавливает оператор, его не учитываем
+                execute_prepared(cur, name, params)
+                cur.fetchall()
+                start = time.perf_counter()
+                for _ in range(iterations):
+                    execute_prepared(cur, name, params)
+                    cur.fetchall()
+                prepared_ms = (time.perf_counter() - start) * 1000 / iterations
+
+                placeholders = ', '.join(['%s'] * len(param_types))
+                plan_plain = _planning_time(cur, query, params)
+                plan_prepared = _planning_time(cur, f"EXECUTE {name} ({placeholders})", params)
+
+                print(f"{name:<24} {plain_ms:>12.3f} {prepared_ms:>13.3f} {plan_plain:>12.3f} "
+                      f"{plan_prepared:>11.3f} {plain_ms - prepared_ms:>13.3f}")
+            # Бенчмарк только читает данные
+            conn.rollback()
+
+def _synthetic_embeddings(count: int, dimensions: int):
+    """Генерирует строки эмбеддингов с отдельной моделью, чтобы не задеть реальные данные"""
+    return [
+        (f"bench-{i}", f"текст {i}", f"hash-{i}", [random.random() for _ in range(dimensions)],
+         'bench-copy', '0')
+        for i in range(count)
+    ]
+
+def bench_copy(count: int, dimensions: int):
+    """Сравнивает построчную запись эмбеддингов с execute_values и COPY"""
+    rows = _synthetic_embeddings(count, dimensions)
+    upsert_sql = """
+        INSERT INTO embeddings (item_id, text, text_hash, embedding, dimensions, model, model_version)
+        VALUES %s
+        ON CONFLICT (item_id, model, model_version) DO UPDATE SET
+            text = EXCLUDED.text, text_hash = EXCLUDED.text_hash,
+            embedding = EXCLUDED.embedding, dimensions = EXCLUDED.dimensions
+    """
+    plain_rows = [(r[0], r[1], r[2], format_vector(r[3]), dimensions, r[4], r[5]) for r in rows]
+    copy_rows = [(r[0], r[1], r[2], r[3], dimensions, r[4], r[5]) for r in rows]
+
+    def row_by_row(cur):
+        for row in plain_rows:
+            cur.execute(upsert_sql.replace('VALUES %s', 'VALUES (%s, %s, %s, %s::vector, %s, %s, %s)'), row)
+
+    def values(cur):
+        execute_values(cur, upsert_sql, plain_rows, template="(%s, %s, %s, %s::vector, %s, %s, %s)", page_size=1000)
+
+    def copy_text(cur):
+        cur.execute("CREATE TEMP TABLE bench_staging (LIKE embeddings INCLUDING DEFAULTS) ON COMMIT DROP")
+        _copy_rows(cur, 'bench_staging', EMBEDDING_COLUMNS, copy_rows, binary=False)
+
+    def copy_merge(cur):
+        _upsert_embeddings(cur, rows)
+
+    cases = [
+        ('построчно', row_by_row),
+        ('execute_values', values),
+        ('COPY text (без слияния)', copy_text),
+        ('COPY binary + слияние', copy_merge),
+    ]
+    print(f"{'способ':<26} {'время, с':>10} {'строк/с':>12}")
+    with get_connection() as conn:
+        for name, func in cases:
+            with conn.cursor() as cur:
+                start = time.perf_counter()
+                func(cur)
+                elapsed = time.perf_counter() - start
+            # Каждый способ пишет в пустую таблицу: откатываем записанное
+            conn.rollback()
+            print(f"{name:<26} {elapsed:>10.3f} {count / elapsed:>12.0f}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Микро-бенчмарки доступа к БД')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    prepared = subparsers.add_parser('prepared', help='Обычные запросы против PREPARE/EXECUTE')
+    prepared.add_argument('-n', '--iterations', type=int, default=200, help='Количество повторов каждого запроса')
+    prepared.add_argument('-k', '--keywords', nargs='+', default=['знание', 'бытие'], help='Ключевые слова для поиска')
+
+    copy = subparsers.add_parser('copy', help='Построчная запись эмбеддингов против execute_values и COPY')
+    copy.add_argument('-n', '--count', type=int, default=5000, help='Количество строк')
+    copy.add_argument('-d', '--dimensions', type=int, default=3072, help='Размерность эмбеддинга')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    if args.command == 'prepared':
+        bench_prepared(args.iterations, args.keywords)
+    elif args.command == 'copy':
+        bench_copy(args.count, args.dimensions)
+
+if __name__ == '__main__':
+    main()
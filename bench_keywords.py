@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк локального извлечения ключевых слов (keyword_extractor)
+
+Сообщает среднее и худшее время извлечения на запрос; цель - меньше 1 мс.
+
+Использование:
+    python bench_keywords.py [-q 1000] [--queries queries.txt]
+    python bench_keywords.py --synthetic 100000   # статистика по синтетическому корпусу
+"""
+import argparse
+import logging
+import random
+import time
+
+from bench_bm25 import _synthetic_corpus
+from keyword_extractor import KeywordExtractor, TermStats, get_extractor
+
+def _sample_queries(texts, count: int, seed: int = 2):
+    """Запросы из 4-8 подряд идущих слов случайных текстов корпуса"""
+    rng = random.Random(seed)
+    queries = []
+    for text in rng.sample(texts, min(count, len(texts))):
+        words = text.split()
+        length = rng.randint(4, 8)
+        start = rng.randint(0, max(0, len(words) - length))
+        queries.append(' '.join(words[start:start + length]))
+    return queries
+
+def bench(extractor: KeywordExtractor, queries, max_keywords: int):
+    timings = []
+    for query in queries:
+        start = time.perf_counter()
+        extractor.extract(query, max_keywords)
+        timings.append(time.perf_counter() - start)
+
+    timings.sort()
+    print(f"Элементов: {extractor.stats.docs}, основ: {len(extractor.stats.df)}, "
+          f"пар: {len(extractor.stats.bigrams)}, запросов: {len(timings)}")
+    print(f"Среднее: {sum(timings) * 1000 / len(timings):.3f} мс, "
+          f"p99: {timings[int(len(timings) * 0.99)] * 1000:.3f} мс, "
+          f"максимум: {timings[-1] * 1000:.3f} мс")
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк локального извлечения ключевых слов')
+    parser.add_argument('-n', '--max-keywords', type=int, default=5, help='Максимум ключевых слов')
+    parser.add_argument('-q', '--num-queries', type=int, default=1000, help='Количество случайных запросов')
+    parser.add_argument('--queries', help='Файл с запросами, по одному на строку')
+    parser.add_argument('--synthetic', type=int, help='Построить статистику по синтетическому корпусу из N документов')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    texts = [text for _, text in _synthetic_corpus(args.synthetic)] if args.synthetic else None
+    extractor = KeywordExtractor(TermStats.build(texts)) if texts else get_extractor()
+
+    if args.queries:
+        with open(args.queries, encoding='utf-8') as f:
+            queries = [line.strip() for line in f if line.strip()]
+    elif texts:
+        queries = _sample_queries(texts, args.num_queries)
+    else:
+        parser.error("без --synthetic нужен файл запросов --queries")
+    bench(extractor, queries, args.max_keywords)
+
+if __name__ == '__main__':
+    main()
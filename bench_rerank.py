@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк бэкендов кросс-энкодера: FlagReranker против ONNX Runtime (int8)
+
+Сообщает пар в секунду для каждого бэкенда и отклонение оценок ONNX
+от оценок FlagReranker на тех же парах. С --concurrent сравнивает прямые
+вызовы модели из C потоков с сервисом микропакетов (rerank_service.py).
+С --buckets сравнивает пакеты в порядке поступления с пакетами по длине
+(length_batching.py): токены с учетом дополнения и пар в секунду.
+
+Использование:
+    python bench_rerank.py [-n 256] [-b 64] [--threads 4] [--model bge-reranker-base] [--onnx-path models/bge-reranker-base-onnx]
+    python bench_rerank.py --concurrent 8 [--pairs-per-query 20] [--backend onnx]
+    python bench_rerank.py --buckets [--synthetic] [--padding-only]
+"""
+import argparse
+import logging
+import random
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from config import RERANKER_SETTINGS
+
+def _sample_pairs(count: int, seed: int = 3):
+    """Пары (запрос, текст) из случайных элементов БД"""
+    from db import get_items_sample
+    rng = random.Random(seed)
+    sample = get_items_sample(sample_size=count, parent_depth=0, child_depth=0)
+    texts = [item['item'][2] for item in sample if item['item'][2]]
+    queries = [' '.join(rng.sample(text.split(), min(5, len(text.split())))) for text in texts]
+    rng.shuffle(queries)
+    return [[query, text] for query, text in zip(queries, texts)]
+
+def _synthetic_pairs(count: int, seed: int = 4):
+    """
+    Пары с длинами, как в дереве заметок: в основном короткие заголовки и
+    абзацы, меньшая часть - длинные многостраничные заметки (логнормальное)
+    """
+    rng = random.Random(seed)
+    words = ['заметка', 'проект', 'база', 'данных', 'запрос', 'индекс', 'реплика', 'поиск', 'модель', 'текст',
+             'настройка', 'сервер', 'ответ', 'вопрос', 'дерево', 'элемент', 'пакет', 'время', 'задача', 'план']
+    pairs = []
+    for _ in range(count):
+        length = max(2, min(2000, int(rng.lognormvariate(3.5, 1.2))))
+        pairs.append([' '.join(rng.sample(words, 4)), ' '.join(rng.choice(words) for _ in range(length))])
+    return pairs
+
+def _load_reranker(args):
+    if args.backend == 'onnx':
+        from onnx_reranker import OnnxReranker
+        return OnnxReranker(args.onnx_path, quantize=not args.no_quantize, intra_op_threads=args.threads)
+    from FlagEmbedding import FlagReranker
+    return FlagReranker(args.model, use_fp16=False)
+
+def bench_buckets(reranker, pairs, batch_size: int):
+    """Пакеты в порядке поступления против пакетов по длине"""
+    from length_batching import LengthBucketedReranker, length_buckets, padded_tokens
+    wrapper = LengthBucketedReranker(reranker)
+    prepared, lengths = wrapper.prepare(pairs)
+    arrival = [list(range(i, min(i + batch_size, len(lengths)))) for i in range(0, len(lengths), batch_size)]
+    buckets = length_buckets(lengths, batch_size, wrapper.max_batch_tokens)
+    print(f"Пар: {len(pairs)}, токенов: {sum(lengths)}, пакет: {batch_size}")
+    print(f"{'порядок':<12} {'пакетов':>8} {'токенов с доп.':>15} {'пар/с':>10}")
+    rows = [('поступления', arrival, lambda: reranker.compute_score(prepared, batch_size=batch_size)),
+            ('по длине', buckets, lambda: wrapper.compute_score(pairs, batch_size=batch_size))]
+    for name, batches, run in rows:
+        rate = ''
+        if reranker is not None:
+            run()
+            start = time.perf_counter()
+            run()
+            rate = f"{len(pairs) / (time.perf_counter() - start):.1f}"
+        print(f"{name:<12} {len(batches):>8} {padded_tokens(lengths, batches):>15} {rate:>10}")
+
+def _measure(reranker, pairs, batch_size: int):
+    # Прогрев: первый запуск включает инициализацию сессии и выделение памяти
+    reranker.compute_score(pairs[:batch_size], batch_size=batch_size)
+    start = time.perf_counter()
+    scores = reranker.compute_score(pairs, batch_size=batch_size)
+    return scores, time.perf_counter() - start
+
+def _load_test(score, queries, concurrency: int):
+    """Запускает запросы из concurrency потоков; возвращает (запросов/с, p50 мс, p95 мс)"""
+    def run(pairs):
+        start = time.perf_counter()
+        score(pairs)
+        return (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = sorted(executor.map(run, queries))
+    elapsed = time.perf_counter() - start
+    return len(queries) / elapsed, statistics.median(latencies), latencies[int(len(latencies) * 0.95) - 1]
+
+def bench_concurrent(reranker, pairs, concurrency: int, pairs_per_query: int, batch_size: int):
+    from rerank_service import RerankService
+    queries = [pairs[i:i + pairs_per_query] for i in range(0, len(pairs), pairs_per_query)]
+    service = RerankService(lambda: reranker, max_batch_size=batch_size)
+    modes = {
+        'прямой': lambda query_pairs: reranker.compute_score(query_pairs, batch_size=batch_size),
+        'сервис': service.score,
+    }
+    print(f"Запросов: {len(queries)} по {pairs_per_query} пар, потоков: {concurrency}")
+    print(f"{'режим':<8} {'запр/с':>8} {'p50 мс':>8} {'p95 мс':>8}")
+    try:
+        for name, score in modes.items():
+            score(queries[0])
+            throughput, p50, p95 = _load_test(score, queries, concurrency)
+            print(f"{name:<8} {throughput:>8.1f} {p50:>8.1f} {p95:>8.1f}")
+    finally:
+        service.close()
+    print(f"Пакетов сервиса: {service.batches}, пар: {service.pairs}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк бэкендов реранжировщика')
+    parser.add_argument('-n', '--num-pairs', type=int, default=256, help='Количество пар')
+    parser.add_argument('-b', '--batch-size', type=int, default=64, help='Размер пакета')
+    parser.add_argument('--threads', type=int, default=RERANKER_SETTINGS.get('intra_op_threads', 0),
+                        help='Потоков ONNX Runtime (0 = автоматически)')
+    parser.add_argument('--model', default='bge-reranker-base', help='Модель FlagReranker')
+    parser.add_argument('--onnx-path', default=RERANKER_SETTINGS.get('onnx_model_path'),
+                        help='Каталог с ONNX-экспортом модели')
+    parser.add_argument('--no-quantize', action='store_true', help='Запускать ONNX без квантования')
+    parser.add_argument('--concurrent', type=int, help='Нагрузочный тест из N потоков: прямые вызовы против сервиса')
+    parser.add_argument('--pairs-per-query', type=int, default=20, help='Пар в одном запросе нагрузочного теста')
+    parser.add_argument('--backend', choices=['flag', 'onnx'], default=RERANKER_SETTINGS.get('backend', 'flag'),
+                        help='Бэкенд для нагрузочного теста и --buckets')
+    parser.add_argument('--buckets', action='store_true', help='Сравнить пакеты в порядке поступления и по длине')
+    parser.add_argument('--synthetic', action='store_true', help='Синтетические пары вместо выборки из БД')
+    parser.add_argument('--padding-only', action='store_true',
+                        help='Для --buckets: только подсчет токенов, без модели (токены - слова)')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    pairs = _synthetic_pairs(args.num_pairs) if args.synthetic else _sample_pairs(args.num_pairs)
+    if args.buckets:
+        bench_buckets(None if args.padding_only else _load_reranker(args), pairs, args.batch_size)
+        return
+    if args.concurrent:
+        bench_concurrent(_load_reranker(args), pairs, args.concurrent, args.pairs_per_query, args.batch_size)
+        return
+    print(f"Пар: {len(pairs)}, пакет: {args.batch_size}, потоков ONNX: {args.threads or 'авто'}")
+
+    from FlagEmbedding import FlagReranker
+    from onnx_reranker import OnnxReranker
+    backends = {
+        'flag': FlagReranker(args.model, use_fp16=False),
+        'onnx': OnnxReranker(args.onnx_path, quantize=not args.no_quantize, intra_op_threads=args.threads),
+    }
+
+    results = {}
+    print(f"{'бэкенд':<8} {'пар/с':>10} {'с':>8}")
+    for name, reranker in backends.items():
+        scores, elapsed = _measure(reranker, pairs, args.batch_size)
+        results[name] = scores
+        print(f"{name:<8} {len(pairs) / elapsed:>10.1f} {elapsed:>8.2f}")
+
+    deviations = [abs(a - b) for a, b in zip(results['flag'], results['onnx'])]
+    print(f"Отклонение оценок ONNX: макс {max(deviations):.4f}, среднее {sum(deviations) / len(deviations):.4f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,580 @@
+#!/usr/bin/env python3
+"""
+Персистентный инвертированный индекс BM25 по items.txt
+
+Индекс хранится в каталоге BM25_SETTINGS['index_path']:
+    meta.json            - параметры BM25 и список сегментов
+    docs.json            - id элемента и хеш текста для каждого номера документа
+    doc_lengths.npy      - длины документов в токенах (int32)
+    live.npy             - маска действующих документов (bool)
+    seg_NNNN.terms.json  - словарь сегмента: термин -> [смещение, байт, df, max tf, min dl]
+    seg_NNNN.postings.bin - списки вхождений сегмента
+
+Список вхождений термина - это df varint-ов с разностями номеров документов
+(delta-кодирование), за которыми идут df varint-ов с частотами термина.
+Файлы вхождений и длин открываются через mmap, в память целиком не читаются.
+Максимальная частота термина и минимальная длина документа в его списке дают
+верхнюю границу вклада термина в оценку, по которой поиск top-k отсекает
+документы, не способные попасть в результат (MaxScore).
+
+Индекс обновляется инкрементально: новые и измененные элементы дописываются
+новым сегментом, старые версии помечаются удаленными в live.npy. Когда
+сегментов или удаленных документов становится много, индекс уплотняется.
+
+Использование:
+    python bm25_index.py build
+    python bm25_index.py update
+    python bm25_index.py search "запрос" [-k 10]
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+from typing import List, Dict, Tuple, Iterable, Optional
+
+import numpy as np
+
+from config import BM25_SETTINGS
+from tokenization import tokenize
+
+logger = logging.getLogger(__name__)
+
+INDEX_VERSION = 1
+
+def text_hash(text: str) -> str:
+    """Возвращает SHA-256 хеш текста (как embeddings.get_text_hash)"""
+    return hashlib.sha256((text or '').encode('utf-8')).hexdigest()
+
+def encode_varints(values) -> bytes:
+    """Кодирует неотрицательные целые в varint (7 бит на байт, старший бит - продолжение)"""
+    values = np.asarray(values, dtype=np.uint64)
+    if not len(values):
+        return b''
+    nbytes = np.ones(len(values), dtype=np.int64)
+    rest = values >> np.uint64(7)
+    while rest.any():
+        nbytes += rest > 0
+        rest >>= np.uint64(7)
+    starts = np.cumsum(nbytes) - nbytes
+    out = np.empty(int(nbytes.sum()), dtype=np.uint8)
+    for k in range(int(nbytes.max())):
+        mask = nbytes > k
+        low = ((values[mask] >> np.uint64(7 * k)) & np.uint64(0x7f)).astype(np.uint8)
+        more = (nbytes[mask] > k + 1).astype(np.uint8) << 7
+        out[starts[mask] + k] = low | more
+    return out.tobytes()
+
+def decode_varints(data) -> np.ndarray:
+    """Векторно декодирует последовательность varint в массив int64"""
+    data = np.frombuffer(data, dtype=np.uint8) if isinstance(data, (bytes, bytearray)) else data
+    if not len(data):
+        return np.zeros(0, dtype=np.int64)
+    is_last = (data & 0x80) == 0
+    # Номер значения, к которому относится каждый байт, и позиция байта внутри значения
+    value_index = np.concatenate(([0], np.cumsum(is_last)[:-1]))
+    ends = np.flatnonzero(is_last)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    shift = 7 * (np.arange(len(data)) - starts[value_index])
+    parts = (data & 0x7f).astype(np.int64) << shift
+    return np.bincount(value_index, weights=parts, minlength=len(ends)).astype(np.int64)
+
+def encode_postings(doc_ids: np.ndarray, tfs: np.ndarray) -> bytes:
+    """Кодирует список вхождений: разности номеров документов, затем частоты"""
+    deltas = np.diff(doc_ids, prepend=0)
+    return encode_varints(np.concatenate((deltas, tfs)))
+
+def decode_postings(data, df: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Декодирует список вхождений в (номера документов, частоты)"""
+    values = decode_varints(data)
+    return np.cumsum(values[:df]), values[df:2 * df]
+
+def _write_json(path: str, data):
+    """Атомарно записывает JSON (через временный файл)"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def _write_npy(path: str, array: np.ndarray):
+    """Атомарно записывает массив numpy"""
+    tmp_path = f"{path}.tmp.npy"
+    np.save(tmp_path, array)
+    os.replace(tmp_path, path)
+
+class Segment:
+    """Неизменяемый сегмент индекса: словарь терминов и mmap списков вхождений"""
+    def __init__(self, path: str, name: str):
+        self.name = name
+        with open(os.path.join(path, f"{name}.terms.json"), encoding='utf-8') as f:
+            self.terms: Dict[str, List[int]] = json.load(f)
+        postings_path = os.path.join(path, f"{name}.postings.bin")
+        if os.path.getsize(postings_path):
+            self.postings = np.memmap(postings_path, dtype=np.uint8, mode='r')
+        else:
+            self.postings = np.zeros(0, dtype=np.uint8)
+
+    def postings_for(self, term: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        entry = self.terms.get(term)
+        if entry is None:
+            return None
+        offset, size, df = entry[:3]
+        return decode_postings(self.postings[offset:offset + size], df)
+
+    def bound_stats(self, term: str, doc_lengths: np.ndarray) -> Optional[Tuple[int, int]]:
+        """Возвращает (max tf, min dl) по списку термина; для старых словарей - из самого списка"""
+        entry = self.terms.get(term)
+        if entry is None:
+            return None
+        if len(entry) >= 5:
+            return entry[3], entry[4]
+        doc_list, tf_list = self.postings_for(term)
+        return int(tf_list.max()), int(doc_lengths[doc_list].min())
+
+    @staticmethod
+    def write(path: str, name: str, docs: List[Tuple[int, List[str]]]):
+        """Записывает сегмент для документов [(номер документа, токены)] в порядке номеров"""
+        postings = defaultdict(lambda: ([], []))
+        lengths = {}
+        for doc_id, tokens in docs:
+            lengths[doc_id] = len(tokens)
+            for term, tf in Counter(tokens).items():
+                doc_list, tf_list = postings[term]
+                doc_list.append(doc_id)
+                tf_list.append(tf)
+
+        terms = {}
+        offset = 0
+        tmp_path = os.path.join(path, f"{name}.postings.bin.tmp")
+        with open(tmp_path, 'wb') as f:
+            for term in sorted(postings):
+                doc_list, tf_list = postings[term]
+                data = encode_postings(np.asarray(doc_list, dtype=np.int64), np.asarray(tf_list, dtype=np.int64))
+                f.write(data)
+                min_length = min(lengths[doc_id] for doc_id in doc_list)
+                terms[term] = [offset, len(data), len(doc_list), max(tf_list), min_length]
+                offset += len(data)
+        os.replace(tmp_path, os.path.join(path, f"{name}.postings.bin"))
+        _write_json(os.path.join(path, f"{name}.terms.json"), terms)
+
+class BM25Index:
+    """
+    Индекс BM25 с поиском top-k по всему корпусу
+
+    Вес термина: idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * dl / avgdl)),
+    где idf = ln(1 + (N - df + 0.5) / (df + 0.5)) всегда положителен.
+    N, df и avgdl считаются только по действующим документам.
+    """
+    def __init__(self, path: str = None):
+        self.path = path or BM25_SETTINGS['index_path']
+        self.k1 = BM25_SETTINGS.get('k1', 1.5)
+        self.b = BM25_SETTINGS.get('b', 0.75)
+        self.segments: List[Segment] = []
+        self.doc_ids: List[str] = []
+        self.doc_hashes: List[str] = []
+        self.doc_lengths = np.zeros(0, dtype=np.int32)
+        self.live = np.zeros(0, dtype=bool)
+        self._next_segment = 0
+        self._lock = threading.Lock()
+        if os.path.exists(os.path.join(self.path, 'meta.json')):
+            self._load()
+
+    # --- Загрузка и сохранение ---
+
+    def _load(self):
+        with open(os.path.join(self.path, 'meta.json'), encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get('version') != INDEX_VERSION:
+            raise ValueError(f"Неподдерживаемая версия индекса BM25: {meta.get('version')}")
+        self.k1, self.b = meta['k1'], meta['b']
+        self._next_segment = meta['next_segment']
+        with open(os.path.join(self.path, 'docs.json'), encoding='utf-8') as f:
+            docs = json.load(f)
+        self.doc_ids, self.doc_hashes = docs['ids'], docs['hashes']
+        self.doc_lengths = np.load(os.path.join(self.path, 'doc_lengths.npy'), mmap_mode='r')
+        self.live = np.load(os.path.join(self.path, 'live.npy'), mmap_mode='r')
+        self.segments = [Segment(self.path, name) for name in meta['segments']]
+        self._refresh_stats()
+        logger.debug(f"Загружен индекс BM25: {self.live_count} документов, {len(self.segments)} сегментов")
+
+    def _save_docs(self):
+        _write_json(os.path.join(self.path, 'docs.json'), {'ids': self.doc_ids, 'hashes': self.doc_hashes})
+        _write_npy(os.path.join(self.path, 'doc_lengths.npy'), np.asarray(self.doc_lengths, dtype=np.int32))
+        _write_npy(os.path.join(self.path, 'live.npy'), np.asarray(self.live, dtype=bool))
+
+    def _save_meta(self):
+        _write_json(os.path.join(self.path, 'meta.json'), {
+            'version': INDEX_VERSION,
+            'k1': self.k1,
+            'b': self.b,
+            'segments': [segment.name for segment in self.segments],
+            'next_segment': self._next_segment,
+        })
+
+    def _refresh_stats(self):
+        self._slot_by_id = {doc_id: slot for slot, doc_id in enumerate(self.doc_ids) if self.live[slot]}
+        self.live_count = int(np.count_nonzero(self.live))
+        self.avgdl = float(self.doc_lengths[self.live].mean()) if self.live_count else 0.0
+        self.avgdl = self.avgdl or 1.0
+
+    # --- Построение и обновление ---
+
+    def _add_segment(self, docs: List[Tuple[str, str]]):
+        """Дописывает документы [(id, текст)] новым сегментом (без сохранения docs/meta)"""
+        start = len(self.doc_ids)
+        tokenized = [tokenize(text) for _, text in docs]
+        name = f"seg_{self._next_segment:04d}"
+        self._next_segment += 1
+        Segment.write(self.path, name, [(start + i, tokens) for i, tokens in enumerate(tokenized)])
+
+        self.doc_ids.extend(doc_id for doc_id, _ in docs)
+        self.doc_hashes.extend(text_hash(text) for _, text in docs)
+        self.doc_lengths = np.concatenate((self.doc_lengths, [len(tokens) for tokens in tokenized])).astype(np.int32)
+        self.live = np.concatenate((self.live, np.ones(len(docs), dtype=bool)))
+        self.segments.append(Segment(self.path, name))
+
+    def build(self, docs: Iterable[Tuple[str, str]]) -> 'BM25Index':
+        """Строит индекс заново из документов [(id, текст)]"""
+        with self._lock:
+            os.makedirs(self.path, exist_ok=True)
+            old_segments = [segment.name for segment in self.segments]
+            self.segments, self.doc_ids, self.doc_hashes = [], [], []
+            self.doc_lengths = np.zeros(0, dtype=np.int32)
+            self.live = np.zeros(0, dtype=bool)
+            self._add_segment(list(docs))
+            self._save_docs()
+            self._save_meta()
+            self._remove_segment_files(old_segments)
+            self._refresh_stats()
+        logger.info(f"Индекс BM25 построен: {self.live_count} документов")
+        return self
+
+    def update(self, docs: Iterable[Tuple[str, str]], delete_missing: bool = True) -> Dict[str, int]:
+        """
+        Синхронизирует индекс с текущим набором документов [(id, текст)]
+
+        Новые и измененные (по хешу текста) документы дописываются новым
+        сегментом, старые версии и отсутствующие в docs (при delete_missing)
+        помечаются удаленными.
+
+        Returns:
+            Счетчики {'added', 'changed', 'deleted', 'unchanged'}
+        """
+        with self._lock:
+            os.makedirs(self.path, exist_ok=True)
+            live = np.array(self.live, dtype=bool)
+            seen = set()
+            fresh = []
+            stats = {'added': 0, 'changed': 0, 'deleted': 0, 'unchanged': 0}
+            for doc_id, text in docs:
+                seen.add(doc_id)
+                slot = self._slot_by_id.get(doc_id)
+                if slot is None:
+                    stats['added'] += 1
+                elif self.doc_hashes[slot] != text_hash(text):
+                    live[slot] = False
+                    stats['changed'] += 1
+                else:
+                    stats['unchanged'] += 1
+                    continue
+                fresh.append((doc_id, text))
+
+            if delete_missing:
+                for doc_id, slot in self._slot_by_id.items():
+                    if doc_id not in seen:
+                        live[slot] = False
+                        stats['deleted'] += 1
+
+            self.live = live
+            self.doc_lengths = np.array(self.doc_lengths, dtype=np.int32)
+            if fresh:
+                self._add_segment(fresh)
+            if fresh or stats['deleted'] or stats['changed']:
+                self._save_docs()
+                self._save_meta()
+            self._refresh_stats()
+
+            if self._needs_compaction():
+                self._compact()
+        logger.info(f"Индекс BM25 обновлен: {stats}")
+        return stats
+
+    def _needs_compaction(self) -> bool:
+        deleted = len(self.live) - self.live_count
+        return (len(self.segments) > BM25_SETTINGS.get('max_segments', 8) or
+                (len(self.live) and deleted / len(self.live) > BM25_SETTINGS.get('max_deleted_ratio', 0.2)))
+
+    def _compact(self):
+        """Перестраивает индекс в один сегмент только из действующих документов"""
+        postings = defaultdict(list)
+        for segment in self.segments:
+            for term in segment.terms:
+                doc_list, tf_list = segment.postings_for(term)
+                postings[term].append((doc_list, tf_list))
+
+        # Перенумеровываем действующие документы подряд
+        remap = np.full(len(self.live), -1, dtype=np.int64)
+        live_slots = np.flatnonzero(self.live)
+        remap[live_slots] = np.arange(len(live_slots))
+
+        name = f"seg_{self._next_segment:04d}"
+        self._next_segment += 1
+        terms = {}
+        offset = 0
+        tmp_path = os.path.join(self.path, f"{name}.postings.bin.tmp")
+        with open(tmp_path, 'wb') as f:
+            for term in sorted(postings):
+                doc_list = np.concatenate([docs_ for docs_, _ in postings[term]])
+                tf_list = np.concatenate([tfs for _, tfs in postings[term]])
+                keep = np.asarray(self.live)[doc_list]
+                if not keep.any():
+                    continue
+                new_docs = remap[doc_list[keep]]
+                order = np.argsort(new_docs, kind='stable')
+                data = encode_postings(new_docs[order], tf_list[keep][order])
+                f.write(data)
+                terms[term] = [offset, len(data), int(keep.sum()), int(tf_list[keep].max()),
+                               int(np.asarray(self.doc_lengths)[doc_list[keep]].min())]
+                offset += len(data)
+        os.replace(tmp_path, os.path.join(self.path, f"{name}.postings.bin"))
+        _write_json(os.path.join(self.path, f"{name}.terms.json"), terms)
+
+        old_segments = [segment.name for segment in self.segments]
+        self.doc_ids = [self.doc_ids[slot] for slot in live_slots]
+        self.doc_hashes = [self.doc_hashes[slot] for slot in live_slots]
+        self.doc_lengths = np.asarray(self.doc_lengths, dtype=np.int32)[live_slots]
+        self.live = np.ones(len(live_slots), dtype=bool)
+        self.segments = [Segment(self.path, name)]
+        self._save_docs()
+        self._save_meta()
+        self._remove_segment_files(old_segments)
+        self._refresh_stats()
+        logger.info(f"Индекс BM25 уплотнен: {self.live_count} документов")
+
+    def _remove_segment_files(self, names: List[str]):
+        for name in names:
+            for suffix in ('.terms.json', '.postings.bin'):
+                try:
+                    os.remove(os.path.join(self.path, name + suffix))
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    # В Windows файл, открытый через mmap, удалить нельзя - удалим при следующем уплотнении
+                    logger.warning(f"Не удалось удалить {name + suffix}: {str(e)}")
+
+    # --- Поиск ---
+
+    def postings(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Возвращает (номера документов, частоты) термина по всем сегментам, только действующие"""
+        parts = [p for p in (segment.postings_for(term) for segment in self.segments) if p is not None]
+        if not parts:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        doc_list = np.concatenate([p[0] for p in parts])
+        tf_list = np.concatenate([p[1] for p in parts])
+        keep = self.live[doc_list]
+        return doc_list[keep], tf_list[keep]
+
+    def idf(self, df: int) -> float:
+        return float(np.log(1.0 + (self.live_count - df + 0.5) / (df + 0.5)))
+
+    def term_scores(self, doc_list: np.ndarray, tf_list: np.ndarray, df: int = None) -> np.ndarray:
+        """Вклад термина в оценку каждого документа из списка вхождений (df - по всему списку)"""
+        tf = tf_list.astype(np.float64)
+        dl = self.doc_lengths[doc_list]
+        norm = self.k1 * (1.0 - self.b + self.b * dl / self.avgdl)
+        return self.idf(len(doc_list) if df is None else df) * tf * (self.k1 + 1.0) / (tf + norm)
+
+    def term_bound(self, term: str, df: int) -> float:
+        """Верхняя граница вклада термина: max tf при min dl по его спискам во всех сегментах"""
+        stats = [s for s in (segment.bound_stats(term, self.doc_lengths) for segment in self.segments) if s]
+        max_tf = float(max(tf for tf, _ in stats))
+        min_length = min(length for _, length in stats)
+        norm = self.k1 * (1.0 - self.b + self.b * min_length / self.avgdl)
+        return self.idf(df) * max_tf * (self.k1 + 1.0) / (max_tf + norm)
+
+    def search(self, query, top_k: int = 10, exhaustive: bool = None,
+               stats: Dict[str, int] = None) -> List[Tuple[str, float]]:
+        """
+        Находит top_k документов по BM25
+
+        Args:
+            query: Строка запроса или список ключевых слов
+            top_k: Количество результатов
+            exhaustive: Оценивать все вхождения без отсечения
+                        (None = not BM25_SETTINGS['dynamic_pruning'])
+            stats: Словарь, в который записываются счетчики вхождений
+                   'postings' (всего), 'scored' (оценено) и 'skipped'
+
+        Returns:
+            Список (id элемента, оценка) по убыванию оценки,
+            при равных оценках - по порядку документов в индексе
+        """
+        if isinstance(query, (list, tuple)):
+            query = ' '.join(query)
+        terms = Counter(tokenize(query))
+        if not terms or not self.live_count:
+            return []
+        if exhaustive is None:
+            exhaustive = not BM25_SETTINGS.get('dynamic_pruning', True)
+
+        # Списки вхождений в порядке терминов запроса: в этом же порядке суммируются оценки
+        lists = []
+        for term, query_tf in terms.items():
+            doc_list, tf_list = self.postings(term)
+            if len(doc_list):
+                lists.append((term, query_tf, doc_list, tf_list))
+        total = sum(len(entry[2]) for entry in lists)
+
+        if exhaustive:
+            scores = np.zeros(len(self.live), dtype=np.float64)
+            for _, query_tf, doc_list, tf_list in lists:
+                scores[doc_list] += query_tf * self.term_scores(doc_list, tf_list)
+            candidates = np.flatnonzero(scores > 0)
+            candidate_scores = scores[candidates]
+            scored = total
+        else:
+            candidates, candidate_scores, scored = self._max_score(lists, top_k)
+
+        if stats is not None:
+            stats.update({'postings': total, 'scored': scored, 'skipped': total - scored})
+
+        keep = candidate_scores > 0
+        candidates, candidate_scores = candidates[keep], candidate_scores[keep]
+        order = np.lexsort((candidates, -candidate_scores))[:top_k]
+        return [(self.doc_ids[candidates[i]], float(candidate_scores[i])) for i in order]
+
+    def _max_score(self, lists, top_k: int) -> Tuple[np.ndarray, np.ndarray, int]:
+        """
+        Поиск top-k с отсечением MaxScore
+
+        Термины обходятся по убыванию верхней границы вклада. Пока сумма
+        границ оставшихся терминов не меньше порога (k-й частичной оценки),
+        их списки оцениваются целиком. Остальные термины могут лишь добавить
+        баллы уже найденным документам: для них проверяются только кандидаты
+        (поиском в отсортированном списке), а кандидаты, которым не хватит
+        границ до порога, отбрасываются. Итоговые оценки пересчитываются
+        в порядке терминов запроса, поэтому совпадают с полным перебором
+        до последнего бита.
+
+        Returns:
+            (номера документов-кандидатов по возрастанию, их оценки, число оцененных вхождений)
+        """
+        def kth_best(scores: np.ndarray) -> float:
+            if len(scores) < top_k:
+                return 0.0
+            return float(np.partition(scores, len(scores) - top_k)[len(scores) - top_k])
+
+        def margin(value: float) -> float:
+            # Запас на погрешность округления при сравнении границ с порогом
+            return 1e-9 * max(1.0, abs(value))
+
+        bounds = [query_tf * self.term_bound(term, len(doc_list)) for term, query_tf, doc_list, _ in lists]
+        order = sorted(range(len(lists)), key=lambda i: -bounds[i])
+        remaining = [sum(bounds[j] for j in order[pos:]) for pos in range(len(order) + 1)]
+
+        contributions = {}
+        partial = np.zeros(len(self.live), dtype=np.float64)
+        touched = np.zeros(len(self.live), dtype=bool)
+        scored = 0
+        threshold = 0.0
+        essential = len(order)
+        for pos, i in enumerate(order):
+            _, query_tf, doc_list, tf_list = lists[i]
+            values = query_tf * self.term_scores(doc_list, tf_list)
+            contributions[i] = (doc_list, values)
+            partial[doc_list] += values
+            touched[doc_list] = True
+            scored += len(doc_list)
+            threshold = kth_best(partial[touched])
+            if remaining[pos + 1] + margin(threshold) < threshold:
+                essential = pos + 1
+                break
+
+        candidates = np.flatnonzero(touched)
+        candidate_partial = partial[candidates]
+        for pos in range(essential, len(order)):
+            # Документ, которому даже с границами оставшихся терминов не достичь порога, в top-k не попадет
+            keep = candidate_partial + remaining[pos] + margin(threshold) >= threshold
+            candidates, candidate_partial = candidates[keep], candidate_partial[keep]
+
+            i = order[pos]
+            _, query_tf, doc_list, tf_list = lists[i]
+            index = np.minimum(np.searchsorted(doc_list, candidates), len(doc_list) - 1)
+            found = doc_list[index] == candidates
+            values = query_tf * self.term_scores(candidates[found], tf_list[index[found]], df=len(doc_list))
+            contributions[i] = (candidates[found], values)
+            candidate_partial[found] += values
+            scored += int(found.sum())
+            threshold = max(threshold, kth_best(candidate_partial))
+
+        # Точные оценки кандидатов: суммирование в порядке терминов запроса, как при полном переборе
+        final = np.zeros(len(candidates), dtype=np.float64)
+        for i in range(len(lists)):
+            doc_list, values = contributions[i]
+            index = np.minimum(np.searchsorted(candidates, doc_list), max(len(candidates) - 1, 0))
+            found = candidates[index] == doc_list if len(candidates) else np.zeros(len(doc_list), dtype=bool)
+            final[index[found]] += values[found]
+        return candidates, final, scored
+
+_index: Optional[BM25Index] = None
+_index_lock = threading.Lock()
+
+def get_index() -> BM25Index:
+    """Возвращает индекс из BM25_SETTINGS['index_path'], загружая его при первом вызове"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = BM25Index()
+    return _index
+
+def search(query, top_k: int = None) -> List[Tuple[str, float]]:
+    """Ищет по персистентному индексу BM25 (top_k по умолчанию из SEARCH_SETTINGS)"""
+    if top_k is None:
+        from config import SEARCH_SETTINGS
+        top_k = SEARCH_SETTINGS.get('top_k', 5)
+    return get_index().search(query, top_k)
+
+def _iter_item_texts():
+    """Потоково читает (id, txt) всех элементов из БД"""
+    from db import iter_items
+    for item_id, _, txt in iter_items():
+        yield item_id, txt or ''
+
+def build_index_from_db() -> BM25Index:
+    """Строит индекс заново по всем элементам items"""
+    return get_index().build(_iter_item_texts())
+
+def update_index_from_db() -> Dict[str, int]:
+    """Инкрементально синхронизирует индекс с таблицей items"""
+    return get_index().update(_iter_item_texts())
+
+def main():
+    parser = argparse.ArgumentParser(description='Персистентный индекс BM25 по items')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('build', help='Построить индекс заново')
+    subparsers.add_parser('update', help='Инкрементально обновить индекс')
+    search_parser = subparsers.add_parser('search', help='Найти элементы по запросу')
+    search_parser.add_argument('query', help='Текст запроса')
+    search_parser.add_argument('-k', '--top-k', type=int, default=10, help='Количество результатов')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    if args.command == 'build':
+        build_index_from_db()
+    elif args.command == 'update':
+        print(update_index_from_db())
+    elif args.command == 'search':
+        start = time.perf_counter()
+        results = search(args.query, args.top_k)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        for item_id, score in results:
+            print(f"{score:8.4f}  {item_id}")
+        print(f"Найдено {len(results)} за {elapsed_ms:.1f} мс")
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,11 @@
 # config.py
+import os
 from settings import DB_CONFIG, OPENAI_API_KEY
+try:
+    # Необязательные реплики только для чтения: словари как DB_CONFIG или строки DSN
+    from settings import DB_REPLICAS
+except ImportError:
+    DB_REPLICAS = []
 from typing import Optional, Dict, Any
 
 # Модели OpenAI
@@ -42,6 +48,12 @@ RAG_SETTINGS = {
     'context_window': 0,  # Количество родительских/дочерних элементов для контекста
     'chunk_size': 1000,  # Размер чанка для разбиения длинных текстов
     'chunk_overlap': 100,  # Перекрытие между чанками
+    'stream': True,  # Выводить ответ потоком, по мере генерации
+    'context_packing': True,  # Выбирать контексты и их фрагменты по релевантности на токен (context_packer.py)
+    'context_budget': 1500,  # Бюджет токенов на контексты при упаковке (None - все, что осталось от лимита модели)
+    'pack_span_tokens': 200,  # Размер фрагмента длинного контекста при упаковке (токенов)
+    'compression_enabled': False,  # Оставлять в длинных контекстах только релевантные предложения (context_compressor.py)
+    'compression_target_tokens': 300,  # Целевой размер сжатого контекста (токенов)
     'keywords_prompt': """Выдели из запроса пользователя 3-5 ключевых слов или фраз для поиска информации.
 Ответ должен содержать только список ключевых слов через запятую без пояснений.
 Запрос пользователя: {query}"""
@@ -53,6 +65,89 @@ SEARCH_SETTINGS = {
     'top_k': 5,  # Количество возвращаемых документов
     'max_depth': 0,  # Максимальная глубина поиска в иерархии
     'similarity_threshold': 0.3,  # Порог сходства (документы с меньшим сходством игнорируются)
+    'hybrid_enabled': True,  # Искать кандидатов гибридным поиском (иначе - только по ключевым словам)
+    'pipeline_enabled': True,  # Генерировать ключевые слова параллельно с эмбеддингом и поиском по запросу (pipeline.py)
+    'hybrid_weights': {  # Веса ветвей гибридного поиска в RRF (0 - ветвь отключена)
+        'fulltext': 1.0,
+        'bm25': 1.0,
+        'vector': 1.0,
+        'keywords': 0.5,
+    },
+    'rrf_k': 60,  # Сглаживающая константа Reciprocal Rank Fusion
+    'hybrid_branch_limit': 50,  # Сколько результатов берется из каждой ветви
+    'hybrid_candidates': 30,  # Сколько объединенных кандидатов передается на реранжирование
+    'hybrid_timeout': 10,  # Максимальное время ожидания ветвей (сек.)
+    'cascade_enabled': True,  # Отдавать кросс-энкодеру только лучших по первому этапу кандидатов
+    'rerank_budget_ms': 300,  # Бюджет времени кросс-энкодера на один запрос (мс, 0 - без ограничения)
+    'cascade_min': 10,  # Минимум кандидатов для кросс-энкодера (но не меньше top_k)
+    'cascade_max': 50,  # Максимум кандидатов для кросс-энкодера
+    'cascade_score_gap': 0.15,  # Разрыв оценок первого этапа (доля размаха), на котором список обрезается
+    'cascade_pair_ms': 20,  # Начальная оценка времени одной пары кросс-энкодера (мс), дальше измеряется
+    'mmr_enabled': True,  # Выбирать итоговый контекст методом MMR (mmr.py), убирая повторы
+    'mmr_lambda': 0.7,  # Баланс MMR: 1.0 - только релевантность, 0.0 - только разнообразие
+    'mmr_pool_factor': 3,  # Из скольких кандидатов (top_k * множитель) MMR выбирает top_k
+    'mmr_use_embeddings': True,  # Сравнивать кандидатов по сохраненным эмбеддингам (иначе - по словам)
+}
+
+# Настройки реранжирования кросс-энкодером
+RERANKER_SETTINGS = {
+    'cache_enabled': True,  # Кэшировать оценки по (запрос, text_hash, модель)
+    'cache_size': 20000,  # Максимальное количество оценок в памяти (LRU)
+    'cache_persist': False,  # Дополнительно хранить оценки в таблице rerank_scores
+    'backend': 'flag',  # Бэкенд кросс-энкодера: flag (FlagEmbedding) или onnx (ONNX Runtime, onnx_reranker.py)
+    'onnx_model_path': os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models', 'bge-reranker-base-onnx'),  # Каталог с model.onnx и tokenizer.json
+    'onnx_quantize': True,  # Динамически квантовать модель в int8 (model.int8.onnx)
+    'intra_op_threads': 0,  # Потоков ONNX Runtime на один запуск (0 = автоматически)
+    'max_length': 512,  # Максимальная длина пары (запрос, текст) в токенах
+    'service_enabled': True,  # Объединять пары конкурентных запросов в общие пакеты (rerank_service.py)
+    'service_max_batch_size': 64,  # Максимум пар в одном пакете сервиса
+    'service_max_wait_ms': 5,  # Сколько сервис ждет пополнения пакета после первого запроса (мс)
+    'length_bucketing': True,  # Собирать пакеты из пар близкой длины (length_batching.py)
+    'max_batch_tokens': 16384,  # Максимум токенов в пакете с учетом дополнения до самой длинной пары
+    'truncate_head_ratio': 0.75,  # Доля начала текста при обрезке до max_length (остальное - конец)
+}
+
+# Кэш готовых ответов перед generate_answer (answer_cache.py)
+ANSWER_CACHE_SETTINGS = {
+    'enabled': True,  # Возвращать сохраненный ответ на тот же вопрос по тому же контексту
+    'size': 1000,  # Максимальное количество ответов в памяти (LRU)
+    'semantic': True,  # Искать перефразированные запросы по эмбеддингу при том же наборе контекста
+    'similarity_threshold': 0.95,  # Минимальное косинусное сходство запросов для семантического попадания
+}
+
+# Фоновый прогрев при запуске диалога (warmup.py)
+WARMUP_SETTINGS = {
+    'enabled': True,  # Прогревать модели и подключения, пока пользователь вводит первый вопрос
+    'tasks': ['db', 'reranker', 'tokenizer', 'openai', 'bm25', 'keywords'],  # Задачи прогрева
+    'wait_timeout': 120,  # Сколько первый запрос ждет незавершенного прогрева (сек.)
+}
+
+# Настройки доступа к базе данных
+DB_SETTINGS = {
+    'sample_method': 'BERNOULLI',  # Метод TABLESAMPLE для выборки без root_id (BERNOULLI или SYSTEM)
+    'sample_oversample': 4,  # Во сколько раз завышать долю TABLESAMPLE относительно размера выборки
+    'subtree_cache_ttl': 300,  # Время жизни кэша id поддерева для выборки с root_id (сек.)
+    'cursor_itersize': 2000,  # Количество строк, получаемых серверным курсором за один FETCH
+    'pool_min_size': 1,  # Минимальное количество подключений в пуле
+    'pool_max_size': 20,  # Максимальное количество подключений в пуле (ветви гибридного поиска и задачи графа поиска берут их одновременно, некоторые - вложенно)
+    'pool_timeout': 30,  # Сколько секунд ждать свободного подключения, когда пул исчерпан
+    'async_pool_max_size': 20,  # Максимальное количество подключений в пуле asyncpg (db_async)
+    'use_prepared_statements': True,  # Выполнять горячие запросы через PREPARE/EXECUTE
+    'bulk_copy_threshold': 500,  # С какого размера пакета массовая запись идет через COPY (меньше - execute_values)
+    'bulk_batch_size': 10000,  # Количество строк в одной порции COPY
+    'bulk_copy_binary': True,  # Использовать бинарный формат COPY (False - текстовый)
+    'replica_retry_interval': 30,  # На сколько секунд исключать недоступную реплику (сек.)
+    'read_your_writes_window': 5,  # Сколько секунд после записи поток читает с основного сервера (сек.)
+}
+
+# Настройки лексического индекса BM25
+BM25_SETTINGS = {
+    'index_path': os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'bm25_index'),  # Каталог индекса
+    'k1': 1.5,  # Насыщение частоты термина
+    'b': 0.75,  # Нормализация по длине документа
+    'max_segments': 8,  # После скольких сегментов индекс уплотняется в один
+    'max_deleted_ratio': 0.2,  # Доля удаленных документов, после которой индекс уплотняется
+    'dynamic_pruning': True,  # Отсекать документы, не способные попасть в top-k (MaxScore)
 }
 
 # Настройки для интерактивного режима
@@ -95,7 +190,12 @@ KEYWORDS_SETTINGS = {
     'prompt': "Подбери пять ключевых слов, по которым лучше всего можно найти ответ в тексте, на этот запрос. В ответе перечисли их через запятую. Текст запроса: {query}",
     'model': 'gpt-4o-mini',
     'temperature': 0.3,
-    'max_tokens': 100
+    'max_tokens': 100,
+    'method': 'local',  # Способ выделения ключевых слов: 'local' (статистика корпуса) или 'llm'
+    'stats_path': os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'keyword_stats.json'),  # Файл статистики корпуса
+    'max_df_ratio': 0.5,  # Слова, встречающиеся в большей доле элементов, не считаются ключевыми
+    'min_collocation_count': 3,  # Минимум элементов, в которых пара слов идет подряд, чтобы стать фразой
+    'min_pmi': 1.0,  # Минимальная взаимная информация (PMI) пары слов для фразы
 }
 
 def get_embedding_from_db(item_id: str, model: str) -> Optional[Dict[str, Any]]:
@@ -4,7 +4,7 @@
 """
 import logging
 import json
-from db import get_connection
+from db import get_connection, execute_prepared
 
 logger = logging.getLogger(__name__)
 
@@ -44,7 +44,7 @@ def save_config_to_db(config_name, config_value):
 def get_config_from_db(config_name, default_value=None):
     """Загружает параметр конфигурации из базы данных"""
     try:
-        with get_connection() as conn:
+        with get_connection(readonly=True) as conn:
             with conn.cursor() as cur:
                 # Проверяем, существует ли таблица
                 cur.execute("""
@@ -58,7 +58,7 @@ def get_config_from_db(config_name, default_value=None):
                     return default_value
                 
                 # Получаем значение
-                cur.execute("SELECT value FROM config WHERE name = %s", (config_name,))
+                execute_prepared(cur, 'config_value', (config_name,))
                 result = cur.fetchone()
                 
                 if result:
@@ -0,0 +1,232 @@
+"""
+Экстрактивное сжатие контекстов перед сборкой промпта
+
+Длинный элемент обычно релевантен запросу двумя-тремя предложениями, а в
+промпт попадает целиком (до chunk_size). Здесь каждый контекст длиннее
+целевого размера режется на предложения, предложения всех контекстов
+оцениваются по запросу одним векторным BM25 (матрица предложения x термины
+запроса), и из каждого контекста остаются лучшие предложения вместе с
+соседями - в исходном порядке, пока не набран целевой размер в токенах.
+Несмежные участки разделяются многоточием.
+
+Каждый контекст кодируется один раз - по предложениям и промежуткам между
+ними: длина контекста - сумма их длин, токены сжатого текста - склейка
+токенов выбранных предложений. Эти токены возвращаются в поле 'tokens' и
+передаются в PromptBuilder, который поэтому не кодирует контексты заново.
+"""
+import logging
+import re
+import time
+from collections import Counter
+from typing import Any, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from config import RAG_SETTINGS, BM25_SETTINGS
+
+logger = logging.getLogger(__name__)
+
+# Конец предложения: знак препинания и пробел, или перевод строки (списки, заголовки)
+_SENTENCE_END_RE = re.compile(r'(?<=[.!?…])\s+|\n+')
+
+# Разделитель несмежных участков сжатого контекста
+GAP = ' ... '
+
+def split_sentences(text: str) -> List[Tuple[int, int]]:
+    """Границы предложений (начало, конец) в символах, без пустых"""
+    spans = []
+    start = 0
+    for match in _SENTENCE_END_RE.finditer(text):
+        if text[start:match.start()].strip():
+            spans.append((start, match.start()))
+        start = match.end()
+    if text[start:].strip():
+        spans.append((start, len(text)))
+    return spans
+
+def bm25_scores(query_terms: Sequence[str], documents: Sequence[List[str]],
+                k1: float = None, b: float = None) -> np.ndarray:
+    """
+    Оценки BM25 коротких документов (предложений) по терминам запроса
+
+    IDF считается по самим документам; формула та же, что в bm25_index.
+    """
+    k1 = BM25_SETTINGS.get('k1', 1.5) if k1 is None else k1
+    b = BM25_SETTINGS.get('b', 0.75) if b is None else b
+    terms = list(dict.fromkeys(query_terms))
+    if not terms or not documents:
+        return np.zeros(len(documents))
+    column = {term: i for i, term in enumerate(terms)}
+    tf = np.zeros((len(documents), len(terms)))
+    for row, document in enumerate(documents):
+        for term, count in Counter(term for term in document if term in column).items():
+            tf[row, column[term]] = count
+    lengths = np.array([len(document) for document in documents], dtype=np.float64)
+    avgdl = lengths.mean() or 1.0
+    df = (tf > 0).sum(axis=0)
+    idf = np.log(1.0 + (len(documents) - df + 0.5) / (df + 0.5))
+    norm = k1 * (1.0 - b + b * lengths / avgdl)
+    return (idf * tf * (k1 + 1.0) / (tf + norm[:, None])).sum(axis=1)
+
+def select_sentences(scores: Sequence[float], lengths: Sequence[int], target: int) -> List[int]:
+    """
+    Индексы оставляемых предложений в исходном порядке
+
+    Предложения берутся по убыванию оценки, каждое - вместе с соседями, пока
+    хватает target токенов. Если ни одно предложение не совпало с запросом,
+    остается начало контекста. Пустой список - ни одно предложение не
+    помещается целиком (см. head_sentence).
+    """
+    kept = set()
+    used = 0
+
+    def take(index: int) -> bool:
+        nonlocal used
+        if index in kept or not 0 <= index < len(lengths) or used + lengths[index] > target:
+            return False
+        kept.add(index)
+        used += lengths[index]
+        return True
+
+    ranked = [i for i in sorted(range(len(scores)), key=lambda i: (-scores[i], i)) if scores[i] > 0]
+    for index in ranked:
+        if take(index):
+            take(index - 1)
+            take(index + 1)
+    if not kept:
+        for index in range(len(lengths)):
+            if not take(index):
+                break
+    return sorted(kept)
+
+def head_sentence(scores: Sequence[float], sentence_tokens: Sequence[List[int]], target: int) -> Tuple[int, List[int]]:
+    """
+    Лучшее предложение и начало его токенов длиной не больше target
+
+    Для контекстов, в которых ни одно предложение не помещается целиком
+    (например, текст без разрывов предложений). Без совпадений с запросом
+    берется первое предложение.
+    """
+    best = max(range(len(sentence_tokens)), key=lambda i: (scores[i], -i))
+    return best, list(sentence_tokens[best][:target])
+
+def join_sentences(text: str, spans: Sequence[Tuple[int, int]], kept: Sequence[int]) -> str:
+    """Текст выбранных предложений: смежные - с исходными разделителями, несмежные - через GAP"""
+    parts = []
+    for position, index in enumerate(kept):
+        if position and kept[position - 1] == index - 1:
+            # Продолжение участка вместе с исходным разделителем
+            parts[-1] += text[spans[index - 1][1]:spans[index][1]]
+        else:
+            parts.append(text[spans[index][0]:spans[index][1]])
+    return GAP.join(parts)
+
+def encode_sentences(text: str, spans: Sequence[Tuple[int, int]], encoder,
+                     separators: Dict[str, List[int]]) -> Tuple[List[List[int]], List[List[int]]]:
+    """
+    Токены предложений и промежутков между ними
+
+    Returns:
+        (токены предложений, токены промежутков): промежутков на один больше -
+        перед первым предложением, между соседними и после последнего.
+        Склейка промежутков и предложений по очереди декодируется в text.
+        Промежутки (пробелы, переводы строк) повторяются и кодируются один
+        раз через словарь separators.
+    """
+    def encode_separator(separator: str) -> List[int]:
+        tokens = separators.get(separator)
+        if tokens is None:
+            tokens = separators[separator] = encoder.encode(separator) if separator else []
+        return tokens
+
+    bounds = [0] + [position for span in spans for position in span] + [len(text)]
+    gaps = [encode_separator(text[bounds[i]:bounds[i + 1]]) for i in range(0, len(bounds), 2)]
+    return [encoder.encode(text[start:end]) for start, end in spans], gaps
+
+def full_tokens(sentences: Sequence[List[int]], gaps: Sequence[List[int]]) -> List[int]:
+    """Токены всего текста: промежутки и предложения по очереди"""
+    tokens = list(gaps[0])
+    for sentence, gap in zip(sentences, gaps[1:]):
+        tokens += sentence
+        tokens += gap
+    return tokens
+
+def join_tokens(sentences: Sequence[List[int]], gaps: Sequence[List[int]], kept: Sequence[int],
+                gap_tokens: List[int]) -> List[int]:
+    """Токены текста join_sentences из уже закодированных предложений и промежутков"""
+    tokens: List[int] = []
+    for position, index in enumerate(kept):
+        if position and kept[position - 1] == index - 1:
+            tokens += gaps[index]
+        elif position:
+            tokens += gap_tokens
+        tokens += sentences[index]
+    return tokens
+
+def compress_contexts(query: str, context_items: List[Dict[str, Any]], target_tokens: int = None,
+                      encoder=None, stats: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+    """
+    Сжимает контексты длиннее target_tokens до предложений, релевантных запросу
+
+    Args:
+        query: Вопрос пользователя
+        context_items: Контексты ('text' и прочие поля сохраняются)
+        target_tokens: Целевой размер контекста (None = RAG_SETTINGS['compression_target_tokens'])
+        encoder: Энкодер для подсчета токенов (по умолчанию prompt_builder.get_encoder(),
+                 тот же, что у PromptBuilder)
+        stats: Словарь, в который записываются токены до и после сжатия,
+               степень сжатия ('ratio' = после / до) и затраченное время ('elapsed_ms')
+
+    Returns:
+        Копии элементов с сокращенным 'text' (короткие элементы - без изменений)
+        и его токенами в 'tokens'
+    """
+    from prompt_builder import get_encoder
+    from tokenization import tokenize
+    start = time.perf_counter()
+    target = target_tokens or RAG_SETTINGS.get('compression_target_tokens', 300)
+    encoder = encoder or get_encoder()
+
+    # Каждый контекст кодируется один раз, по предложениям и промежуткам
+    separators: Dict[str, List[int]] = {}
+    sentences = [split_sentences(item['text']) for item in context_items]
+    encoded = [encode_sentences(item['text'], spans, encoder, separators)
+               for item, spans in zip(context_items, sentences)]
+    lengths = [sum(map(len, sentence_tokens)) + sum(map(len, gaps)) for sentence_tokens, gaps in encoded]
+    long_items = [i for i, length in enumerate(lengths) if length > target]
+
+    # Предложения всех длинных контекстов оцениваются одной матрицей
+    flat = [(i, s) for i in long_items for s in sentences[i]]
+    scores = bm25_scores(tokenize(query), [tokenize(context_items[i]['text'][s:e]) for i, (s, e) in flat])
+
+    result = [dict(item, tokens=full_tokens(*encoded[i])) for i, item in enumerate(context_items)]
+    gap_tokens = encoder.encode(GAP)
+    offset = 0
+    for i in long_items:
+        spans = sentences[i]
+        sentence_tokens, gaps = encoded[i]
+        item_scores = scores[offset:offset + len(spans)]
+        offset += len(spans)
+        kept = select_sentences(item_scores, [len(tokens) for tokens in sentence_tokens], target)
+        if not kept:
+            # Остается начало лучшего предложения; если и оно пусто - элемент без изменений
+            _, head = head_sentence(item_scores, sentence_tokens, target)
+            if head:
+                result[i]['text'] = encoder.decode(head)
+                result[i]['tokens'] = head
+        elif len(kept) < len(spans):
+            result[i]['text'] = join_sentences(context_items[i]['text'], spans, kept)
+            result[i]['tokens'] = join_tokens(sentence_tokens, gaps, kept, gap_tokens)
+
+    if stats is not None:
+        before = sum(lengths)
+        after = sum(len(item['tokens']) for item in result)
+        stats.update({
+            'contexts': len(context_items),
+            'compressed': sum(1 for i in long_items if result[i]['text'] != context_items[i]['text']),
+            'tokens_before': before,
+            'tokens_after': after,
+            'ratio': after / before if before else 1.0,
+            'elapsed_ms': (time.perf_counter() - start) * 1000,
+        })
+    return result
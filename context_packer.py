@@ -0,0 +1,104 @@
+"""
+Упаковка контекстов в бюджет токенов по плотности релевантности
+
+Вместо того чтобы обрезать каждый контекст до chunk_size и затем обрезать
+весь промпт (вместе с вопросом), контексты режутся на окна по span_tokens
+токенов, и окна выбираются жадным рюкзаком: по убыванию ценности на токен,
+пока хватает бюджета. Ценность окна - релевантность контекста
+(оценка реранжировщика, см. mmr.relevance_scores), умноженная на
+(1 + доля стемов запроса, встречающихся в окне), поэтому из длинного
+контекста берутся те участки, где есть слова запроса, а короткие
+релевантные контексты обходятся дешевле длинных. Заголовок контекста и
+разделители фрагментов учитываются в стоимости. Шаблон и вопрос в бюджет
+не входят и никогда не обрезаются.
+"""
+import logging
+from typing import Any, Dict, List, Sequence, Tuple
+
+from config import RAG_SETTINGS
+from prompt_builder import PromptBuilder, Spans
+
+logger = logging.getLogger(__name__)
+
+# Минимальная ценность окна (чтобы контекст с наименьшей оценкой не обнулялся)
+MIN_RELEVANCE = 0.05
+
+def window_bounds(length: int, span_tokens: int) -> Spans:
+    """Разбивает length токенов на последовательные окна не длиннее span_tokens"""
+    return [(start, min(start + span_tokens, length)) for start in range(0, length, span_tokens)] or [(0, 0)]
+
+def term_overlap(query_terms: set, text: str) -> float:
+    """Доля стемов запроса, встречающихся в тексте"""
+    if not query_terms:
+        return 0.0
+    from tokenization import tokenize
+    return len(query_terms.intersection(tokenize(text))) / len(query_terms)
+
+def merge_spans(spans: Spans) -> Spans:
+    """Сортирует фрагменты и склеивает соседние"""
+    merged: Spans = []
+    for start, end in sorted(spans):
+        if merged and merged[-1][1] == start:
+            merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+def pack_contexts(builder: PromptBuilder, relevance: Sequence[float], budget: int,
+                  span_tokens: int = None, stats: Dict[str, Any] = None) -> List[Tuple[int, Spans]]:
+    """
+    Выбирает контексты и их фрагменты в пределах бюджета токенов
+
+    Args:
+        builder: PromptBuilder с уже закодированными контекстами
+        relevance: Релевантность контекстов (чем больше, тем лучше)
+        budget: Сколько токенов можно отдать под контексты вместе с заголовками
+        span_tokens: Размер окна (None = RAG_SETTINGS['pack_span_tokens'])
+        stats: Словарь, в который записывается число контекстов и фрагментов,
+               токены до и после упаковки ('baseline_tokens', 'tokens')
+
+    Returns:
+        Пары (индекс контекста, фрагменты) в исходном порядке контекстов
+    """
+    span_tokens = span_tokens or RAG_SETTINGS.get('pack_span_tokens', 200)
+    limit = builder.max_context_tokens
+    from tokenization import tokenize
+    query_terms = set(tokenize(builder.query))
+
+    candidates = []
+    for index, tokens in enumerate(builder.context_tokens):
+        windows = window_bounds(len(tokens), span_tokens)
+        for start, end in windows:
+            text = builder.contexts[index] if len(windows) == 1 else builder.encoder.decode(tokens[start:end])
+            value = (max(relevance[index], 0.0) + MIN_RELEVANCE) * (1.0 + term_overlap(query_terms, text))
+            if end > start:
+                candidates.append((value / (end - start), index, start, end))
+    candidates.sort(key=lambda candidate: (-candidate[0], candidate[1], candidate[2]))
+
+    # Заголовок считается по самому длинному номеру - оценка с запасом
+    header_cost = builder.overhead(max(0, len(builder.contexts) - 1))
+    gap_cost = builder.span_separator_tokens()
+    chosen: Dict[int, Spans] = {}
+    used = 0
+    for _, index, start, end in candidates:
+        taken = sum(e - s for s, e in chosen.get(index, ()))
+        cost = gap_cost if index in chosen else header_cost
+        room = budget - used - cost
+        if limit is not None:
+            room = min(room, limit - taken)
+        length = min(end - start, room)
+        # Окно не помещается целиком: берем его начало, если остается заметная часть
+        if length <= 0 or (length < end - start and length < span_tokens // 4):
+            continue
+        chosen.setdefault(index, []).append((start, start + length))
+        used += cost + length
+
+    selected = [(index, merge_spans(chosen[index])) for index in sorted(chosen)]
+    if stats is not None:
+        stats.update({
+            'contexts': len(selected),
+            'spans': sum(len(spans) for _, spans in selected),
+            'baseline_tokens': sum(builder.context_lengths()),
+            'tokens': sum(end - start for _, spans in selected for start, end in spans),
+        })
+    return selected
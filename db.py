@@ -1,14 +1,281 @@
 import psycopg2
-from config import DB_CONFIG, ROOT_MARKERS, SEARCH_SETTINGS
-from typing import List, Dict, Any, Optional
+from psycopg2 import extensions, pool as pg_pool
+from psycopg2.extras import execute_values
+from config import DB_CONFIG, DB_REPLICAS, ROOT_MARKERS, SEARCH_SETTINGS, DB_SETTINGS, MODELS
+from contextlib import contextmanager
+from itertools import islice
+from typing import List, Dict, Any, Optional, Tuple, Sequence, Iterable, Callable
+import io
 import logging
+import random
+import re
+import struct
+import threading
+import time
+import uuid
 
 logger = logging.getLogger(__name__)
 
+# Кэш id поддеревьев для выборки с root_id: root_id -> (время загрузки, список id)
+_subtree_ids_cache: Dict[str, Tuple[float, List[str]]] = {}
+
+# Пулы подключений создаются лениво при первом обращении к БД:
+# None - основной сервер, номер - реплика из DB_REPLICAS
+_pools: Dict[Optional[int], Any] = {}
+_pool_lock = threading.Lock()
+
+# Маршрутизация чтения по репликам: очередь по кругу и исключенные до указанного времени реплики
+_replica_lock = threading.Lock()
+_replica_next = 0
+_replica_ejected: Dict[int, float] = {}
+
+# Время последней записи в текущем потоке (для чтения своих записей с основного сервера)
+_thread_state = threading.local()
+
+# Горячие запросы, выполняемые через именованные подготовленные операторы:
+# имя -> (типы параметров, SQL с параметрами %s в порядке их следования).
+# id элементов (uuid в items и embeddings) передаются строками и списками строк,
+# поэтому параметры объявлены как text/text[] и явно приводятся к uuid в SQL:
+# без приведения uuid = text не сравнивается, а text[] не присваивается uuid[]
+# (ни при EXECUTE, ни при обычном выполнении со списком Python).
+PREPARED_STATEMENTS = {
+    'item_by_id': (('text',), """
+        SELECT id, id_parent, txt, area, style
+        FROM items
+        WHERE id = %s::uuid
+    """),
+    'items_by_ids': (('text[]',), """
+        SELECT id, id_parent, txt
+        FROM items
+        WHERE id = ANY(%s::uuid[])
+    """),
+    'child_blocks': (('text',), """
+        SELECT id, txt, area, style
+        FROM items
+        WHERE id_parent = %s::uuid
+        ORDER BY area
+    """),
+    'keyword_search': (('text[]', 'bigint'), """
+        SELECT id, id_parent, txt
+        FROM items
+        WHERE txt ILIKE ANY(%s)
+        LIMIT %s
+    """),
+    'keyword_search_in_tree': (('text', 'text[]', 'bigint'), """
+        WITH RECURSIVE tree AS (
+            SELECT id FROM items WHERE id = %s::uuid
+            UNION ALL
+            SELECT i.id FROM items i JOIN tree t ON i.id_parent = t.id
+        )
+        SELECT id, id_parent, txt
+        FROM items
+        WHERE txt ILIKE ANY(%s)
+        AND id IN (SELECT id FROM tree)
+        LIMIT %s
+    """),
+    # Полнотекстовый поиск по GIN-индексу to_tsvector('russian', txt);
+    # слова запроса объединяются через ИЛИ, порядок - по ts_rank_cd
+    'fulltext_search': (('text', 'bigint'), """
+        SELECT id, id_parent, txt
+        FROM items, replace(plainto_tsquery('russian', %s)::text, '&', '|')::tsquery AS query
+        WHERE to_tsvector('russian', txt) @@ query
+        ORDER BY ts_rank_cd(to_tsvector('russian', txt), query) DESC, id
+        LIMIT %s
+    """),
+    'fulltext_search_in_tree': (('text', 'text', 'bigint'), """
+        WITH RECURSIVE tree AS (
+            SELECT id FROM items WHERE id = %s::uuid
+            UNION ALL
+            SELECT i.id FROM items i JOIN tree t ON i.id_parent = t.id
+        )
+        SELECT id, id_parent, txt
+        FROM items, replace(plainto_tsquery('russian', %s)::text, '&', '|')::tsquery AS query
+        WHERE to_tsvector('russian', txt) @@ query
+        AND id IN (SELECT id FROM tree)
+        ORDER BY ts_rank_cd(to_tsvector('russian', txt), query) DESC, id
+        LIMIT %s
+    """),
+    'parent_items': (('text',), """
+        WITH RECURSIVE parents AS (
+            -- Прямой родитель
+            SELECT i.id, i.id_parent, i.txt, 1 as level
+            FROM items i
+            JOIN items child ON child.id_parent = i.id
+            WHERE child.id = %s::uuid
+            
+            UNION ALL
+            
+            -- Рекурсивно поднимаемся вверх
+            SELECT i.id, i.id_parent, i.txt, p.level + 1
+            FROM items i
+            JOIN parents p ON p.id_parent = i.id
+            WHERE p.level < 3  -- Ограничиваем глубину
+        )
+        SELECT id, id_parent, txt
+        FROM parents
+        ORDER BY level DESC
+    """),
+    'child_items': (('text',), """
+        WITH RECURSIVE children AS (
+            -- Прямые потомки
+            SELECT id, id_parent, txt, 1 as level
+            FROM items
+            WHERE id_parent = %s::uuid
+            
+            UNION ALL
+            
+            -- Рекурсивно спускаемся вниз
+            SELECT i.id, i.id_parent, i.txt, c.level + 1
+            FROM items i
+            JOIN children c ON i.id_parent = c.id
+            WHERE c.level < 3  -- Ограничиваем глубину
+        )
+        SELECT id, id_parent, txt
+        FROM children
+        ORDER BY level
+    """),
+    'context_parents': (('text[]', 'int'), """
+        WITH RECURSIVE parents AS (
+            -- Прямые родители всех исходных элементов
+            SELECT child.id AS origin_id, i.id, i.id_parent, i.txt, 1 as level
+            FROM items child
+            JOIN items i ON i.id = child.id_parent
+            WHERE child.id = ANY(%s::uuid[])
+            
+            UNION ALL
+            
+            -- Рекурсивно поднимаемся вверх
+            SELECT p.origin_id, i.id, i.id_parent, i.txt, p.level + 1
+            FROM items i
+            JOIN parents p ON p.id_parent = i.id
+            WHERE p.level < %s
+        )
+        SELECT origin_id, id, id_parent, txt
+        FROM parents
+        ORDER BY origin_id, level
+    """),
+    'context_children': (('text[]', 'int'), """
+        WITH RECURSIVE children AS (
+            -- Прямые потомки всех исходных элементов
+            SELECT id_parent AS origin_id, id, id_parent, txt, 1 as level
+            FROM items
+            WHERE id_parent = ANY(%s::uuid[])
+            
+            UNION ALL
+            
+            -- Рекурсивно спускаемся вниз
+            SELECT c.origin_id, i.id, i.id_parent, i.txt, c.level + 1
+            FROM items i
+            JOIN children c ON i.id_parent = c.id
+            WHERE c.level < %s
+        )
+        SELECT origin_id, id, id_parent, txt
+        FROM children
+        ORDER BY origin_id, level
+    """),
+    'vector_top_k': (('vector', 'text', 'bigint'), """
+        SELECT e.item_id, i.id_parent, e.text, 1 - e.distance AS similarity
+        FROM (
+            SELECT item_id, text, embedding <=> %s::vector AS distance
+            FROM embeddings
+            WHERE model = %s
+            ORDER BY distance
+            LIMIT %s
+        ) e
+        LEFT JOIN items i ON i.id = e.item_id
+        ORDER BY e.distance
+    """),
+    'config_value': (('text',), """
+        SELECT value FROM config WHERE name = %s
+    """),
+    'upsert_embedding': (('text', 'text', 'text', 'text', 'int', 'text', 'text'), """
+        INSERT INTO embeddings (item_id, text, text_hash, embedding, dimensions, model, model_version)
+        VALUES (%s::uuid, %s, %s, %s::vector, %s, %s, %s)
+        ON CONFLICT (item_id, model, model_version)
+        DO UPDATE SET text = EXCLUDED.text,
+                      text_hash = EXCLUDED.text_hash,
+                      embedding = EXCLUDED.embedding,
+                      dimensions = EXCLUDED.dimensions,
+                      created_at = CURRENT_TIMESTAMP
+    """),
+}
+
+class PreparedConnection(extensions.connection):
+    """Подключение, которое помнит, какие операторы на нем уже подготовлены"""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared_statements = set()
+
+def numbered_sql(name: str) -> str:
+    """Возвращает SQL оператора из реестра с параметрами $1, $2, ... вместо %s"""
+    param_types, query = PREPARED_STATEMENTS[name]
+    counter = iter(range(1, len(param_types) + 1))
+    return re.sub(r'%s', lambda _: f"${next(counter)}", query)
+
+def _prepare_sql(name: str) -> str:
+    """Строит PREPARE для оператора из реестра, заменяя %s на $1, $2, ..."""
+    param_types, _ = PREPARED_STATEMENTS[name]
+    types = f" ({', '.join(param_types)})" if param_types else ""
+    return f"PREPARE {name}{types} AS {numbered_sql(name)}"
+
+# Операторы, которые сервер не смог подготовить: дальше выполняются обычным образом
+_unpreparable: set = set()
+
+def _prepare(cur, name: str) -> bool:
+    """
+    Подготавливает оператор; при ошибке возвращает False, не прерывая транзакцию
+
+    PREPARE выполняется внутри точки сохранения: ошибка (например, другая схема
+    таблиц) откатывается до нее, и запрос можно выполнить без подготовки.
+    """
+    savepoint = not cur.connection.autocommit
+    if savepoint:
+        cur.execute("SAVEPOINT prepare_statement")
+    try:
+        cur.execute(_prepare_sql(name))
+    except psycopg2.Error as e:
+        if savepoint:
+            cur.execute("ROLLBACK TO SAVEPOINT prepare_statement")
+        _unpreparable.add(name)
+        logger.warning(f"Не удалось подготовить оператор {name}, он будет выполняться без подготовки: {str(e)}")
+        return False
+    if savepoint:
+        cur.execute("RELEASE SAVEPOINT prepare_statement")
+    return True
+
+def execute_prepared(cur, name: str, params: Sequence = ()):
+    """
+    Выполняет оператор из PREPARED_STATEMENTS через PREPARE/EXECUTE
+    
+    Оператор подготавливается лениво, один раз на подключение из пула;
+    дальше сервер выполняет его без повторного разбора и планирования.
+    Если подготовка отключена (DB_SETTINGS['use_prepared_statements']),
+    подключение создано не пулом или PREPARE не удался, запрос выполняется
+    обычным образом.
+    """
+    param_types, query = PREPARED_STATEMENTS[name]
+    prepared = getattr(cur.connection, 'prepared_statements', None) if hasattr(cur, 'connection') else None
+    if (not isinstance(prepared, set) or not DB_SETTINGS.get('use_prepared_statements', True)
+            or name in _unpreparable):
+        cur.execute(query, params)
+        return
+    
+    if name not in prepared:
+        logger.debug(f"Подготовка оператора {name}")
+        if not _prepare(cur, name):
+            cur.execute(query, params)
+            return
+        prepared.add(name)
+    
+    if param_types:
+        cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(param_types))})", params)
+    else:
+        cur.execute(f"EXECUTE {name}")
+
 def get_tables():
     """Получает список таблиц в базе данных"""
     try:
-        with get_connection() as conn:
+        with get_connection(readonly=True) as conn:
             with conn.cursor() as cur:
                 cur.execute("""
                     SELECT table_name 
@@ -23,7 +290,7 @@ def get_tables():
 def get_table_info(table_name: str):
     """Получает информацию о структуре таблицы"""
     try:
-        with get_connection() as conn:
+        with get_connection(readonly=True) as conn:
             with conn.cursor() as cur:
                 # Получаем информацию о колонках
                 cur.execute("""
@@ -73,9 +340,6 @@ def get_root_items(root_markers: List[str] = None) -> List[Dict[str, Any]]:
         
     logger.debug(f"Поиск корневых элементов по маркерам: {root_markers}")
     
-    conn = psycopg2.connect(**DB_CONFIG)
-    cur = conn.cursor()
-    
     # Формируем условия для LIKE
     like_conditions = " OR ".join([f"txt LIKE '%{marker}%'" for marker in root_markers])
     
@@ -91,18 +355,13 @@ def get_root_items(root_markers: List[str] = None) -> List[Dict[str, Any]]:
     """
     
     logger.debug(f"SQL запрос: {query}")
-    cur.execute(query)
-    
-    items = cur.fetchall()
-    result = []
+    with get_connection(readonly=True) as conn:
+        with conn.cursor() as cur:
+            cur.execute(query)
+            items = cur.fetchall()
     
-    for item in items:
-        item_with_context = get_item_with_context(item[0])
-        if item_with_context:
-            result.append(item_with_context)
-    
-    cur.close()
-    conn.close()
+    contexts = get_items_with_context([item[0] for item in items])
+    result = [contexts[item[0]] for item in items if item[0] in contexts]
     
     logger.debug(f"Найдено {len(result)} корневых элементов")
     return result
@@ -117,198 +376,549 @@ def get_item_with_context(item_id, parent_depth=0, child_depth=0):
         child_depth: Глубина дочернего контекста (0 - без детей)
     """
     try:
-        with get_connection() as conn:
-            with conn.cursor() as cur:
-                # Получаем основной элемент
-                cur.execute("""
-                    SELECT id, title, content, parent_id
-                    FROM items
-                    WHERE id = %s
-                """, (item_id,))
-                
-                item = cur.fetchone()
-                if not item:
-                    return None
-                
-                # Инициализируем результат
-                result = {
-                    'item': item,
-                    'parents': [],
-                    'children': []
-                }
-                
-                # Получаем родителей, если нужно
-                if parent_depth > 0:
-                    parent_ids = []
-                    current_parent_id = item[3]  # parent_id текущего элемента
-                    depth = 0
-                    
-                    while current_parent_id and depth < parent_depth:
-                        cur.execute("""
-                            SELECT id, title, content, parent_id
-                            FROM items
-                            WHERE id = %s
-                        """, (current_parent_id,))
-                        
-                        parent = cur.fetchone()
-                        if parent:
-                            parent_ids.append(parent[0])
-                            result['parents'].append(parent)
-                            current_parent_id = parent[3]
-                            depth += 1
-                        else:
-                            break
-                
-                # Получаем детей, если нужно
-                if child_depth > 0:
-                    cur.execute("""
-                        WITH RECURSIVE item_tree AS (
-                            SELECT id, title, content, parent_id, 1 as depth
-                            FROM items
-                            WHERE parent_id = %s
-                            
-                            UNION ALL
-                            
-                            SELECT i.id, i.title, i.content, i.parent_id, it.depth + 1
-                            FROM items i
-                            JOIN item_tree it ON i.parent_id = it.id
-                            WHERE it.depth < %s
-                        )
-                        SELECT id, title, content, parent_id
-                        FROM item_tree
-                        ORDER BY depth
-                    """, (item_id, child_depth))
-                    
-                    result['children'] = cur.fetchall()
-                
-                return result
+        return get_items_with_context([item_id], parent_depth, child_depth).get(item_id)
     except Exception as e:
         logger.error(f"Ошибка при получении элемента с контекстом: {str(e)}")
         return None
 
-def get_connection():
-    """Создает подключение к базе данных"""
-    return psycopg2.connect(**DB_CONFIG)
+def get_items_with_context(item_ids: List[str], parent_depth: int = 0, child_depth: int = 0) -> Dict[str, Dict[str, Any]]:
+    """
+    Получает элементы с контекстом для списка ID за постоянное число запросов
+    
+    Один запрос забирает сами элементы и по одному рекурсивному запросу
+    строят родителей и детей сразу для всех ID, независимо от их количества.
+    
+    Args:
+        item_ids: Список ID элементов
+        parent_depth: Глубина родительского контекста (0 - без родителей)
+        child_depth: Глубина дочернего контекста (0 - без детей)
+    
+    Returns:
+        Словарь {id: {'item': (id, id_parent, txt), 'parents': [...], 'children': [...]}}.
+        Родители упорядочены от ближайшего, дети - по уровню. Отсутствующие ID пропускаются.
+    """
+    # Убираем повторы, сохраняя порядок
+    item_ids = list(dict.fromkeys(item_ids))
+    if not item_ids:
+        return {}
+    
+    with get_connection(readonly=True) as conn:
+        with conn.cursor() as cur:
+            execute_prepared(cur, 'items_by_ids', (item_ids,))
+            result = {
+                row[0]: {'item': row, 'parents': [], 'children': []}
+                for row in cur.fetchall()
+            }
+            
+            contexts = _fetch_contexts(cur, list(result), parent_depth, child_depth)
+            for item_id, (parents, children) in contexts.items():
+                result[item_id]['parents'] = parents
+                result[item_id]['children'] = children
+            
+            return result
+
+def _fetch_contexts(cur, item_ids: List[str], parent_depth: int, child_depth: int) -> Dict[str, Tuple[List[tuple], List[tuple]]]:
+    """
+    Получает родителей и детей для всех item_ids двумя рекурсивными запросами
+    
+    Каждая строка рекурсии несет origin_id - ID исходного элемента,
+    поэтому результаты для всех элементов разбираются из одного ответа.
+    
+    Returns:
+        Словарь {id: (родители от ближайшего, дети по уровням)} для каждого из item_ids
+    """
+    contexts = {item_id: ([], []) for item_id in item_ids}
+    if not item_ids:
+        return contexts
+    
+    if parent_depth > 0:
+        execute_prepared(cur, 'context_parents', (item_ids, parent_depth))
+        for origin_id, *parent in cur.fetchall():
+            contexts[origin_id][0].append(tuple(parent))
+    
+    if child_depth > 0:
+        execute_prepared(cur, 'context_children', (item_ids, child_depth))
+        for origin_id, *child in cur.fetchall():
+            contexts[origin_id][1].append(tuple(child))
+    
+    return contexts
+
+def _attach_contexts(cur, rows: List[tuple], parent_depth: int = 3, child_depth: int = 3) -> List[Dict[str, Any]]:
+    """
+    Оборачивает строки items в словари с контекстом, получая его пакетно
+    
+    Родители возвращаются от самого дальнего к ближайшему, как в get_parent_items.
+    """
+    contexts = _fetch_contexts(cur, list(dict.fromkeys(row[0] for row in rows)), parent_depth, child_depth)
+    return [
+        {
+            'item': row,
+            'parents': contexts[row[0]][0][::-1],
+            'children': contexts[row[0]][1]
+        }
+        for row in rows
+    ]
+
+class BoundedConnectionPool(pg_pool.ThreadedConnectionPool):
+    """
+    ThreadedConnectionPool, который при исчерпании ждет освободившееся подключение
+
+    ThreadedConnectionPool.getconn сразу выдает PoolError, если заняты все
+    maxconn подключений, а ветви гибридного поиска и задачи графа поиска
+    берут подключения одновременно. Здесь занятые подключения считает
+    семафор на maxconn мест, и getconn ждет свободного места до timeout
+    секунд; PoolError - только если оно так и не освободилось.
+    """
+    def __init__(self, minconn: int, maxconn: int, *args, timeout: float = None, **kwargs):
+        super().__init__(minconn, maxconn, *args, **kwargs)
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self.timeout = timeout
+
+    def getconn(self, key=None, timeout: float = None):
+        """Берет подключение, ожидая до timeout секунд (None = self.timeout, 0 - без ожидания)"""
+        timeout = self.timeout if timeout is None else timeout
+        if not self._slots.acquire(timeout=timeout):
+            raise pg_pool.PoolError(f"connection pool exhausted: нет свободного подключения за {timeout} с")
+        try:
+            return super().getconn(key)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn=None, key=None, close=False):
+        super().putconn(conn, key, close)
+        self._slots.release()
+
+def _get_pool(replica: Optional[int] = None):
+    """Возвращает пул подключений к основному серверу или реплике, создавая его при первом вызове"""
+    pool = _pools.get(replica)
+    if pool is None:
+        with _pool_lock:
+            pool = _pools.get(replica)
+            if pool is None:
+                if replica is None:
+                    params = DB_CONFIG
+                else:
+                    # Реплика задается словарем как DB_CONFIG или строкой DSN
+                    dsn = DB_REPLICAS[replica]
+                    params = dsn if isinstance(dsn, dict) else {'dsn': dsn}
+                pool = BoundedConnectionPool(
+                    DB_SETTINGS.get('pool_min_size', 1),
+                    DB_SETTINGS.get('pool_max_size', 20),
+                    timeout=DB_SETTINGS.get('pool_timeout', 30),
+                    connection_factory=PreparedConnection,
+                    **params
+                )
+                _pools[replica] = pool
+    return pool
+
+def _next_replica() -> Optional[int]:
+    """Возвращает номер следующей по кругу доступной реплики или None"""
+    global _replica_next
+    now = time.monotonic()
+    with _replica_lock:
+        for _ in range(len(DB_REPLICAS)):
+            replica = _replica_next % len(DB_REPLICAS)
+            _replica_next += 1
+            if _replica_ejected.get(replica, 0) <= now:
+                return replica
+    return None
+
+def _eject_replica(replica: int, error: Exception):
+    """Исключает реплику из маршрутизации на DB_SETTINGS['replica_retry_interval'] секунд"""
+    retry_interval = DB_SETTINGS.get('replica_retry_interval', 30)
+    with _replica_lock:
+        _replica_ejected[replica] = time.monotonic() + retry_interval
+    # Разорванные подключения пула отбрасываются по одному при возврате (putconn с close)
+    logger.warning(f"Реплика {replica} исключена на {retry_interval} с: {str(error)}")
+
+def _recent_write() -> bool:
+    """Была ли в текущем потоке запись за последние DB_SETTINGS['read_your_writes_window'] секунд"""
+    last_write = getattr(_thread_state, 'last_write', None)
+    return (last_write is not None and
+            time.monotonic() - last_write < DB_SETTINGS.get('read_your_writes_window', 5))
+
+def mark_write():
+    """Отмечает запись в текущем потоке: ближайшие чтения пойдут на основной сервер"""
+    _thread_state.last_write = time.monotonic()
+
+def carry_write_state(fn: Callable) -> Callable:
+    """
+    Переносит отметку последней записи текущего потока в fn, выполняемую в другом потоке
+
+    Без этого рабочие потоки (ветви hybrid_search, задачи pipeline) не знают
+    о записях вызывающего потока и могут прочитать устаревшие данные с реплики.
+    """
+    last_write = getattr(_thread_state, 'last_write', None)
+
+    def wrapper(*args, **kwargs):
+        previous = getattr(_thread_state, 'last_write', None)
+        _thread_state.last_write = last_write
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _thread_state.last_write = previous
+    return wrapper
+
+def _acquire_connection(readonly: bool):
+    """Берет подключение: для чтения - с реплики (если есть здоровая), иначе - с основного сервера"""
+    if readonly and DB_REPLICAS and not _recent_write():
+        for _ in range(len(DB_REPLICAS)):
+            replica = _next_replica()
+            if replica is None:
+                break
+            try:
+                pool = _get_pool(replica)
+                # Реплика не ждет освобождения подключений: есть следующая и основной сервер
+                return replica, pool, pool.getconn(timeout=0)
+            except psycopg2.OperationalError as e:
+                _eject_replica(replica, e)
+            except pg_pool.PoolError as e:
+                # Пул реплики исчерпан - пробуем следующую, не исключая эту
+                logger.debug(f"Пул реплики {replica} исчерпан: {str(e)}")
+    pool = _get_pool()
+    return None, pool, pool.getconn()
+
+@contextmanager
+def get_connection(readonly: bool = False, write: bool = None):
+    """
+    Выдает подключение к базе данных из пула
+    
+    Используется как контекстный менеджер: при выходе транзакция фиксируется
+    (или откатывается при ошибке), а подключение возвращается в пул вместе
+    с подготовленными на нем операторами.
+    
+    Args:
+        readonly: Запрос только читает данные. Такие подключения берутся
+                  с реплик из DB_REPLICAS по кругу; недоступные реплики
+                  временно исключаются. Если реплик нет, все они недоступны
+                  или поток недавно писал в базу, используется основной сервер.
+        write: Транзакция изменяет данные (по умолчанию - если не readonly).
+               После ее фиксации поток читает с основного сервера (mark_write).
+    """
+    if write is None:
+        write = not readonly
+    replica, pool, conn = _acquire_connection(readonly)
+    try:
+        yield conn
+        conn.commit()
+        if replica is None and write:
+            mark_write()
+    except BaseException as e:
+        if replica is not None and isinstance(e, psycopg2.OperationalError):
+            _eject_replica(replica, e)
+        # BaseException - чтобы откатить транзакцию и при закрытии генератора (GeneratorExit)
+        if not conn.closed:
+            conn.rollback()
+        raise
+    finally:
+        pool.putconn(conn, close=bool(conn.closed))
+
+def close_pool():
+    """Закрывает все подключения пулов основного сервера и реплик"""
+    with _pool_lock:
+        for pool in _pools.values():
+            pool.closeall()
+        _pools.clear()
+
+def _iter_server_cursor(conn, query: str, params=None, itersize: int = None, as_dict: bool = False):
+    """
+    Выполняет запрос через именованный (серверный) курсор на переданном подключении
+    
+    Строки забираются с сервера порциями по itersize, поэтому в памяти Python
+    одновременно находится не больше одной порции.
+    """
+    if itersize is None:
+        itersize = DB_SETTINGS.get('cursor_itersize', 2000)
+    
+    with conn.cursor(name=f"stream_{uuid.uuid4().hex}") as cur:
+        cur.itersize = itersize
+        cur.execute(query, params)
+        columns = None
+        for row in cur:
+            if as_dict:
+                # У серверного курсора description появляется только после первого FETCH
+                if columns is None:
+                    columns = [desc[0] for desc in cur.description]
+                yield dict(zip(columns, row))
+            else:
+                yield row
 
-def get_items_sample(min_id: int = 1, sample_size: int = 20, root_id: str = None) -> List[Dict[str, Any]]:
+def iter_query(query: str, params=None, itersize: int = None, as_dict: bool = False, readonly: bool = True):
     """
-    Получает выборку элементов из базы данных
+    Генератор строк результата запроса через серверный курсор
+    
+    Args:
+        query: SQL запрос
+        params: Параметры запроса
+        itersize: Размер порции FETCH (None = DB_SETTINGS['cursor_itersize'])
+        as_dict: Возвращать строки как словари {колонка: значение}
+        readonly: Выполнять на реплике (см. get_connection)
+    """
+    with get_connection(readonly=readonly) as conn:
+        yield from _iter_server_cursor(conn, query, params, itersize, as_dict)
+
+def iter_items(itersize: int = None):
+    """Потоково возвращает все элементы items (id, id_parent, txt) для выгрузок и пересчетов"""
+    return iter_query("SELECT id, id_parent, txt FROM items", itersize=itersize)
+
+def iter_item_tree(root_id: str, max_level: int = 3, itersize: int = None):
+    """Потоково возвращает дерево элементов (id, id_parent, txt, area, level) от root_id"""
+    query = """
+    WITH RECURSIVE tree AS (
+        -- Корневой элемент
+        SELECT id, id_parent, txt, area, 0 as level
+        FROM items
+        WHERE id = %s
+        
+        UNION ALL
+        
+        -- Рекурсивно получаем потомков
+        SELECT i.id, i.id_parent, i.txt, i.area, t.level + 1
+        FROM items i
+        JOIN tree t ON i.id_parent = t.id
+        WHERE t.level < %s  -- Ограничиваем глубину
+    )
+    SELECT id, id_parent, txt, area, level
+    FROM tree
+    ORDER BY level, id;
+    """
+    return iter_query(query, (root_id, max_level), itersize=itersize)
+
+def iter_root_items(markers: List[str] = None, itersize: int = None):
+    """Потоково возвращает корневые элементы (id, txt, area), опционально отфильтрованные по маркерам"""
+    query = """
+    SELECT i.id, i.txt, i.area
+    FROM items i
+    WHERE i.id_parent IS NULL
+    """
+    params = None
+    if markers:
+        # Если есть маркеры, добавляем условие LIKE
+        placeholders = ','.join(['%s'] * len(markers))
+        query += f" AND (txt ILIKE ANY (ARRAY[{placeholders}]))"
+        params = [f"%{m}%" for m in markers]
+    return iter_query(query, params, itersize=itersize)
+
+def iter_search_text(text: str, context: int = 2, itersize: int = None):
+    """
+    Потоково ищет текст в базе данных, возвращая элементы с контекстом по мере получения
+    
+    Родители и дети приходят в той же строке серверного курсора (массивами
+    JSON из коррелированных рекурсивных подзапросов), без отдельных запросов
+    на каждый найденный элемент. Как и раньше, берутся родители до третьего
+    уровня начиная с самого дальнего и дети до третьего уровня по уровням,
+    не больше context тех и других.
+    
+    Args:
+        text: Текст для поиска
+        context: Количество родительских/дочерних элементов для контекста
+        itersize: Размер порции FETCH серверного курсора
+    """
+    query = """
+    SELECT i.id, i.id_parent, i.txt,
+        COALESCE((
+            WITH RECURSIVE parents AS (
+                SELECT p.id, p.id_parent, p.txt, 1 AS level
+                FROM items p
+                WHERE p.id = i.id_parent
+                UNION ALL
+                SELECT p.id, p.id_parent, p.txt, parents.level + 1
+                FROM items p
+                JOIN parents ON parents.id_parent = p.id
+                WHERE parents.level < 3
+            )
+            SELECT json_agg(json_build_array(id, id_parent, txt) ORDER BY level DESC)
+            FROM (SELECT * FROM parents ORDER BY level DESC LIMIT %(context)s) nearest
+        ), '[]'::json) AS parents,
+        COALESCE((
+            WITH RECURSIVE children AS (
+                SELECT c.id, c.id_parent, c.txt, 1 AS level
+                FROM items c
+                WHERE c.id_parent = i.id
+                UNION ALL
+                SELECT c.id, c.id_parent, c.txt, children.level + 1
+                FROM items c
+                JOIN children ON c.id_parent = children.id
+                WHERE children.level < 3
+            )
+            SELECT json_agg(json_build_array(id, id_parent, txt) ORDER BY level)
+            FROM (SELECT * FROM children ORDER BY level LIMIT %(context)s) nearest
+        ), '[]'::json) AS children
+    FROM items i
+    WHERE i.txt ILIKE %(pattern)s
+    """
+    with get_connection(readonly=True) as conn:
+        for *row, parents, children in _iter_server_cursor(
+                conn, query, {'pattern': f"%{text}%", 'context': max(context, 0)}, itersize):
+            yield {
+                'item': tuple(row),
+                'parents': [tuple(parent) for parent in parents],
+                'children': [tuple(child) for child in children]
+            }
+
+def get_items_sample(min_id: int = 1, sample_size: int = 20, root_id: str = None,
+                     parent_depth: int = 3, child_depth: int = 3) -> List[Dict[str, Any]]:
+    """
+    Получает случайную выборку элементов из первых трех уровней дерева
+    
+    Без root_id выборка делается через TABLESAMPLE по всей таблице items,
+    с root_id - равновероятным выбором из кэшированного списка id поддерева.
+    В обоих случаях каждое подмножество из sample_size элементов равновероятно,
+    как и при прежнем ORDER BY RANDOM() LIMIT n, но без сортировки всего дерева.
     
     Args:
         min_id: Минимальный ID для выборки (игнорируется, т.к. id это UUID)
         sample_size: Размер выборки
         root_id: ID корневого элемента для ограничения выборки (UUID)
+        parent_depth: Глубина родительского контекста
+        child_depth: Глубина дочернего контекста
     """
     try:
-        with get_connection() as conn:
+        with get_connection(readonly=True) as conn:
             with conn.cursor() as cur:
-                # Базовый запрос
-                query = """
-                WITH RECURSIVE tree AS (
-                    -- Корневой элемент
-                    SELECT id, id_parent, txt, 1 as level
-                    FROM items 
-                    WHERE 1=1  -- Всегда истинное условие
-                    """
-                
-                params = []
-                
-                # Добавляем условие для корневого элемента
                 if root_id:
-                    query += " AND id = %s"
-                    params.append(root_id)
+                    rows = _sample_subtree_rows(cur, root_id, sample_size)
                 else:
-                    query += " AND id_parent IS NULL"
-                    
-                # Добавляем рекурсивную часть
-                query += """
-                    UNION ALL
-                    -- Дочерние элементы
-                    SELECT i.id, i.id_parent, i.txt, t.level + 1
-                    FROM items i
-                    JOIN tree t ON i.id_parent = t.id
-                    WHERE t.level < 3  -- Ограничиваем глубину
-                )
-                SELECT id, id_parent, txt
-                FROM tree
-                ORDER BY RANDOM()
-                LIMIT %s;
-                """
+                    rows = _sample_tree_rows(cur, sample_size)
                 
-                params.append(sample_size)
-                
-                cur.execute(query, params)
-                rows = cur.fetchall()
-                
-                # Получаем родительские и дочерние элементы для каждого элемента
-                items = []
-                for row in rows:
-                    item_data = {
-                        'item': row,
-                        'parents': get_parent_items(row[0], cur),
-                        'children': get_child_items(row[0], cur)
-                    }
-                    items.append(item_data)
-                
-                return items
+                # Получаем родительские и дочерние элементы сразу для всей выборки
+                return _attach_contexts(cur, rows, parent_depth, child_depth)
                 
     except Exception as e:
         logger.error(f"Ошибка при получении выборки: {str(e)}")
         raise
 
-def get_parent_items(item_id: int, cur) -> List[tuple]:
-    """Получает родительские элементы"""
-    query = """
-    WITH RECURSIVE parents AS (
-        -- Прямой родитель
-        SELECT i.id, i.id_parent, i.txt, 1 as level
-        FROM items i
-        JOIN items child ON child.id_parent = i.id
-        WHERE child.id = %s
+# Элементы первых трех уровней всех деревьев (корень, его дети и внуки)
+_TOP_LEVELS_FROM = """
+    LEFT JOIN items p ON p.id = i.id_parent
+    LEFT JOIN items g ON g.id = p.id_parent
+    WHERE i.id_parent IS NULL  -- уровень 1 (корень)
+       OR (p.id IS NOT NULL AND p.id_parent IS NULL)  -- уровень 2
+       OR (g.id IS NOT NULL AND g.id_parent IS NULL)  -- уровень 3
+"""
+
+# Кэш числа элементов первых трех уровней: (время подсчета, число)
+_top_levels_count: Optional[Tuple[float, int]] = None
+
+def get_top_levels_count(cur) -> int:
+    """
+    Число элементов первых трех уровней всех деревьев
+
+    Кэшируется на DB_SETTINGS['subtree_cache_ttl'] секунд, как id поддеревьев.
+    """
+    global _top_levels_count
+    cached = _top_levels_count
+    if cached and time.monotonic() - cached[0] < DB_SETTINGS.get('subtree_cache_ttl', 300):
+        return cached[1]
+    cur.execute(f"SELECT count(*) FROM items i {_TOP_LEVELS_FROM}")
+    row = cur.fetchone()
+    count = int(row[0]) if row else 0
+    _top_levels_count = (time.monotonic(), count)
+    logger.debug(f"Элементов первых трех уровней: {count}, сохранено в кэш")
+    return count
+
+def _sample_tree_rows(cur, sample_size: int) -> List[tuple]:
+    """
+    Выбирает sample_size случайных элементов первых трех уровней всех деревьев
+    
+    Доля TABLESAMPLE считается от числа элементов первых трех уровней
+    (get_top_levels_count), а не от размера всей таблицы: фильтр по родителю
+    и деду оставляет только их, и при доле от всей таблицы первая выборка
+    почти всегда оказывалась слишком маленькой. Доля берется с запасом
+    (DB_SETTINGS['sample_oversample']), окончательный выбор делается
+    random.sample по уже небольшому набору строк. Если строк все же не
+    хватило, доля увеличивается вплоть до 100%.
+    """
+    method = DB_SETTINGS.get('sample_method', 'BERNOULLI').upper()
+    if method not in ('BERNOULLI', 'SYSTEM'):
+        raise ValueError(f"Неподдерживаемый метод TABLESAMPLE: {method}")
+    oversample = max(DB_SETTINGS.get('sample_oversample', 4), 2)
+    
+    top_count = get_top_levels_count(cur)
+    percent = min(100.0, 100.0 * sample_size * oversample / top_count) if top_count > 0 else 100.0
+    
+    query = f"""
+    SELECT i.id, i.id_parent, i.txt
+    FROM items i TABLESAMPLE {method} (%s)
+    {_TOP_LEVELS_FROM}
+    """
+    while True:
+        cur.execute(query, (percent,))
+        rows = cur.fetchall()
+        if len(rows) >= sample_size or percent >= 100.0:
+            break
+        logger.debug(f"TABLESAMPLE {method} ({percent:.4f}%) вернул {len(rows)} строк, увеличиваем долю")
+        percent = min(100.0, percent * oversample)
+    
+    return random.sample(rows, min(sample_size, len(rows)))
+
+def _sample_subtree_rows(cur, root_id: str, sample_size: int) -> List[tuple]:
+    """Выбирает sample_size случайных элементов поддерева root_id (первые три уровня)"""
+    subtree_ids = get_subtree_ids(root_id, cur)
+    sampled_ids = random.sample(subtree_ids, min(sample_size, len(subtree_ids)))
+    if not sampled_ids:
+        return []
+    
+    execute_prepared(cur, 'items_by_ids', (sampled_ids,))
+    rows_by_id = {row[0]: row for row in cur.fetchall()}
+    
+    # Сохраняем случайный порядок выборки
+    return [rows_by_id[item_id] for item_id in sampled_ids if item_id in rows_by_id]
+
+def get_subtree_ids(root_id: str, cur, max_level: int = 3) -> List[str]:
+    """
+    Возвращает id элементов поддерева root_id до глубины max_level
+    
+    Результат кэшируется на DB_SETTINGS['subtree_cache_ttl'] секунд,
+    чтобы повторные выборки из одного поддерева не обходили дерево заново.
+    """
+    cache_key = f"{root_id}:{max_level}"
+    cached = _subtree_ids_cache.get(cache_key)
+    if cached and time.monotonic() - cached[0] < DB_SETTINGS.get('subtree_cache_ttl', 300):
+        return cached[1]
+    
+    cur.execute("""
+    WITH RECURSIVE tree AS (
+        SELECT id, 1 as level
+        FROM items
+        WHERE id = %s
         
         UNION ALL
         
-        -- Рекурсивно поднимаемся вверх
-        SELECT i.id, i.id_parent, i.txt, p.level + 1
+        SELECT i.id, t.level + 1
         FROM items i
-        JOIN parents p ON p.id_parent = i.id
-        WHERE p.level < 3  -- Ограничиваем глубину
+        JOIN tree t ON i.id_parent = t.id
+        WHERE t.level < %s
     )
-    SELECT id, id_parent, txt
-    FROM parents
-    ORDER BY level DESC;
-    """
-    cur.execute(query, (item_id,))
+    SELECT id FROM tree;
+    """, (root_id, max_level))
+    subtree_ids = [row[0] for row in cur.fetchall()]
+    
+    _subtree_ids_cache[cache_key] = (time.monotonic(), subtree_ids)
+    logger.debug(f"Поддерево {root_id}: {len(subtree_ids)} элементов сохранено в кэш")
+    return subtree_ids
+
+def clear_subtree_cache():
+    """Очищает кэш id поддеревьев и числа элементов верхних уровней (например, после изменения структуры items)"""
+    global _top_levels_count
+    _subtree_ids_cache.clear()
+    _top_levels_count = None
+
+def get_parent_items(item_id: int, cur) -> List[tuple]:
+    """Получает родительские элементы"""
+    execute_prepared(cur, 'parent_items', (item_id,))
     return cur.fetchall()
 
 def get_child_items(item_id: int, cur) -> List[tuple]:
     """Получает дочерние элементы"""
-    query = """
-    WITH RECURSIVE children AS (
-        -- Прямые потомки
-        SELECT id, id_parent, txt, 1 as level
-        FROM items
-        WHERE id_parent = %s
-        
-        UNION ALL
-        
-        -- Рекурсивно спускаемся вниз
-        SELECT i.id, i.id_parent, i.txt, c.level + 1
-        FROM items i
-        JOIN children c ON i.id_parent = c.id
-        WHERE c.level < 3  -- Ограничиваем глубину
-    )
-    SELECT id, id_parent, txt
-    FROM children
-    ORDER BY level;
-    """
-    cur.execute(query, (item_id,))
+    execute_prepared(cur, 'child_items', (item_id,))
     return cur.fetchall()
 
 def view_item_tree(root_id: str):
     """Показывает дерево элементов для заданного корня"""
     try:
-        with get_connection() as conn:
+        with get_connection(readonly=True) as conn:
             with conn.cursor() as cur:
                 # Сначала проверяем существование элемента
                 cur.execute("""
@@ -321,41 +931,19 @@ def view_item_tree(root_id: str):
                 if not root:
                     print(f"Элемент с ID {root_id} не найден")
                     return
+        
+        # Дерево выводится по мере получения строк серверным курсором
+        print("\nСтруктура дерева:")
+        for row in iter_item_tree(root_id):
+            if row:
+                indent = "  " * row[4]  # level теперь в позиции 4
+                id = row[0] or 'None'
+                txt = row[2] or 'Нет текста'
+                area = f" [{row[3]}]" if row[3] else ""
                 
-                # Получаем дерево
-                query = """
-                WITH RECURSIVE tree AS (
-                    -- Корневой элемент
-                    SELECT id, id_parent, txt, area, 0 as level
-                    FROM items
-                    WHERE id = %s
-                    
-                    UNION ALL
-                    
-                    -- Рекурсивно получаем потомков
-                    SELECT i.id, i.id_parent, i.txt, i.area, t.level + 1
-                    FROM items i
-                    JOIN tree t ON i.id_parent = t.id
-                    WHERE t.level < 3  -- Ограничиваем глубину
-                )
-                SELECT id, id_parent, txt, area, level
-                FROM tree
-                ORDER BY level, id;
-                """
-                cur.execute(query, (root_id,))
-                rows = cur.fetchall()
-                
-                print("\nСтруктура дерева:")
-                for row in rows:
-                    if row:
-                        indent = "  " * row[4]  # level теперь в позиции 4
-                        id = row[0] or 'None'
-                        txt = row[2] or 'Нет текста'
-                        area = f" [{row[3]}]" if row[3] else ""
-                        
-                        # Обрезаем текст до 100 символов
-                        truncated_text = (txt[:97] + "...") if len(txt) > 100 else txt
-                        print(f"{indent}[{id}]{area} {truncated_text}")
+                # Обрезаем текст до 100 символов
+                truncated_text = (txt[:97] + "...") if len(txt) > 100 else txt
+                print(f"{indent}[{id}]{area} {truncated_text}")
                     
     except Exception as e:
         logger.error(f"Ошибка при просмотре дерева: {str(e)}")
@@ -364,39 +952,22 @@ def view_item_tree(root_id: str):
 def view_root_items(markers: List[str] = None):
     """Показывает корневые элементы"""
     try:
-        with get_connection() as conn:
-            with conn.cursor() as cur:
-                # Базовый запрос для получения корневых элементов
-                query = """
-                SELECT i.id, i.txt, i.area
-                FROM items i
-                WHERE i.id_parent IS NULL
-                """
-                
-                if markers:
-                    # Если есть маркеры, добавляем условие LIKE
-                    placeholders = ','.join(['%s'] * len(markers))
-                    query += f" AND (txt ILIKE ANY (ARRAY[{placeholders}]))"
-                    cur.execute(query, [f"%{m}%" for m in markers])
-                else:
-                    cur.execute(query)
-                    
-                rows = cur.fetchall()
-                
-                if not rows:
-                    print("Корневые элементы не найдены")
-                    return
-                
+        found = False
+        for row in iter_root_items(markers):
+            if not found:
                 print("\nНайденные корневые элементы:")
-                for row in rows:
-                    if row and len(row) >= 2:  # Проверяем, что строка не пустая и содержит нужные поля
-                        item_id, txt, area = row
-                        # Обрезаем текст до 100 символов и добавляем многоточие если нужно
-                        truncated_text = (txt[:97] + "...") if txt and len(txt) > 100 else txt
-                        area_info = f" [{area}]" if area else ""
-                        print(f"ID: {item_id}{area_info}\nТекст: {truncated_text}\n")
-                    else:
-                        logger.warning(f"Пропущена некорректная строка: {row}")
+                found = True
+            if row and len(row) >= 2:  # Проверяем, что строка не пустая и содержит нужные поля
+                item_id, txt, area = row
+                # Обрезаем текст до 100 символов и добавляем многоточие если нужно
+                truncated_text = (txt[:97] + "...") if txt and len(txt) > 100 else txt
+                area_info = f" [{area}]" if area else ""
+                print(f"ID: {item_id}{area_info}\nТекст: {truncated_text}\n")
+            else:
+                logger.warning(f"Пропущена некорректная строка: {row}")
+        
+        if not found:
+            print("Корневые элементы не найдены")
                 
     except Exception as e:
         logger.error(f"Ошибка при просмотре корневых элементов: {str(e)}")
@@ -411,53 +982,35 @@ def search_text(text: str, context: int = 2) -> List[Dict]:
         context: Количество родительских/дочерних элементов для контекста
     """
     try:
-        with get_connection() as conn:
-            with conn.cursor() as cur:
-                # Поиск элементов, содержащих текст
-                query = """
-                SELECT id, id_parent, txt
-                FROM items
-                WHERE txt ILIKE %s
-                """
-                cur.execute(query, (f"%{text}%",))
-                rows = cur.fetchall()
-                
-                results = []
-                for row in rows:
-                    # Получаем контекст для каждого найденного элемента
-                    item_data = {
-                        'item': row,
-                        'parents': get_parent_items(row[0], cur)[:context],
-                        'children': get_child_items(row[0], cur)[:context]
-                    }
-                    results.append(item_data)
-                
-                return results
-                
+        return list(iter_search_text(text, context))
     except Exception as e:
         logger.error(f"Ошибка при поиске текста: {str(e)}")
         raise
 
+def print_search_result(index: int, result: Dict):
+    """Выводит один результат поиска"""
+    print(f"\nРезультат {index}:")
+    
+    # Выводим родительские элементы
+    if result['parents']:
+        print("\nКонтекст выше:")
+        for parent in result['parents']:
+            print(f"[{parent[0]}] {parent[2][:100]}...")
+    
+    # Выводим найденный элемент
+    print("\nНайденный элемент:")
+    print(f"[{result['item'][0]}] {result['item'][2][:100]}...")
+    
+    # Выводим дочерние элементы
+    if result['children']:
+        print("\nКонтекст ниже:")
+        for child in result['children']:
+            print(f"[{child[0]}] {child[2][:100]}...")
+
 def print_search_results(results: List[Dict]):
     """Выводит результаты поиска"""
     for i, result in enumerate(results, 1):
-        print(f"\nРезультат {i}:")
-        
-        # Выводим родительские элементы
-        if result['parents']:
-            print("\nКонтекст выше:")
-            for parent in result['parents']:
-                print(f"[{parent[0]}] {parent[2][:100]}...")
-        
-        # Выводим найденный элемент
-        print("\nНайденный элемент:")
-        print(f"[{result['item'][0]}] {result['item'][2][:100]}...")
-        
-        # Выводим дочерние элементы
-        if result['children']:
-            print("\nКонтекст ниже:")
-            for child in result['children']:
-                print(f"[{child[0]}] {child[2][:100]}...")
+        print_search_result(i, result)
 
 def debug_database():
     """Выводит отладочную информацию о базе данных"""
@@ -486,7 +1039,7 @@ def get_block_info_by_name(name: str) -> List[Dict]:
     Получает информацию о блоке по его названию
     """
     try:
-        with get_connection() as conn:
+        with get_connection(readonly=True) as conn:
             with conn.cursor() as cur:
                 # Поиск блоков по названию
                 query = """
@@ -503,12 +1056,7 @@ def get_block_info_by_name(name: str) -> List[Dict]:
                 result = []
                 for block in blocks:
                     # Получаем дочерние элементы первого уровня
-                    cur.execute("""
-                        SELECT id, txt, area, style
-                        FROM items
-                        WHERE id_parent = %s
-                        ORDER BY area
-                    """, (block[0],))
+                    execute_prepared(cur, 'child_blocks', (block[0],))
                     children = cur.fetchall()
                     
                     result.append({
@@ -538,14 +1086,10 @@ def get_block_info_by_id(block_id: str) -> Optional[Dict]:
     Получает информацию о блоке по его ID
     """
     try:
-        with get_connection() as conn:
+        with get_connection(readonly=True) as conn:
             with conn.cursor() as cur:
                 # Получаем информацию о блоке
-                cur.execute("""
-                    SELECT id, id_parent, txt, area, style
-                    FROM items
-                    WHERE id = %s
-                """, (block_id,))
+                execute_prepared(cur, 'item_by_id', (block_id,))
                 block = cur.fetchone()
                 
                 if not block:
@@ -554,27 +1098,18 @@ def get_block_info_by_id(block_id: str) -> Optional[Dict]:
                 # Получаем родительский блок
                 parent = None
                 if block[1]:  # если есть id_parent
-                    cur.execute("""
-                        SELECT id, txt, area, style
-                        FROM items
-                        WHERE id = %s
-                    """, (block[1],))
+                    execute_prepared(cur, 'item_by_id', (block[1],))
                     parent_data = cur.fetchone()
                     if parent_data:
                         parent = {
                             'id': parent_data[0],
-                            'text': parent_data[1],
-                            'area': parent_data[2],
-                            'type': parent_data[3]  # style используем как type
+                            'text': parent_data[2],
+                            'area': parent_data[3],
+                            'type': parent_data[4]  # style используем как type
                         }
                 
                 # Получаем дочерние элементы
-                cur.execute("""
-                    SELECT id, txt, area, style
-                    FROM items
-                    WHERE id_parent = %s
-                    ORDER BY area
-                """, (block[0],))
+                execute_prepared(cur, 'child_blocks', (block[0],))
                 children = cur.fetchall()
                 
                 return {
@@ -689,10 +1224,266 @@ def create_embeddings_table():
         logger.error(f"Ошибка при создании таблицы эмбеддингов: {str(e)}")
         return False
 
+def format_vector(embedding: Sequence[float]) -> str:
+    """Преобразует эмбеддинг в текстовое представление типа vector: [x1,x2,...]"""
+    return '[' + ','.join(str(float(x)) for x in embedding) + ']'
+
+def upsert_embedding(item_id: str, text: str, text_hash: str, embedding: Sequence[float],
+                     model: str, model_version: str) -> bool:
+    """Сохраняет или обновляет эмбеддинг элемента"""
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                execute_prepared(cur, 'upsert_embedding', (
+                    item_id, text, text_hash, format_vector(embedding),
+                    len(embedding), model, model_version
+                ))
+                return True
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении эмбеддинга: {str(e)}")
+        return False
+
+# Колонки массовой записи: (имя, тип PostgreSQL для временной таблицы).
+# Типы временной таблицы выбраны под кодирование COPY; при слиянии значения
+# приводятся к настоящим типам колонок целевой таблицы (uuid, real, ...)
+EMBEDDING_COLUMNS = [
+    ('item_id', 'text'), ('text', 'text'), ('text_hash', 'text'), ('embedding', 'vector'),
+    ('dimensions', 'int4'), ('model', 'text'), ('model_version', 'text'),
+]
+ITEM_COLUMNS = [
+    ('id', 'text'), ('id_parent', 'text'), ('txt', 'text'), ('area', 'text'), ('style', 'text'),
+]
+
+def _encode_binary_field(pg_type: str, value) -> bytes:
+    """Кодирует значение в бинарный формат COPY для типа колонки"""
+    if pg_type == 'text':
+        return str(value).encode('utf-8')
+    if pg_type == 'int4':
+        return struct.pack('>i', int(value))
+    if pg_type == 'float8':
+        return struct.pack('>d', float(value))
+    if pg_type == 'vector':
+        # Формат vector_recv из pgvector: int16 размерность, int16 резерв, float4[]
+        return struct.pack(f'>hh{len(value)}f', len(value), 0, *value)
+    raise ValueError(f"Нет бинарного кодировщика для типа {pg_type}")
+
+def _encode_text_field(pg_type: str, value) -> str:
+    """Кодирует значение в текстовый формат COPY для типа колонки"""
+    if value is None:
+        return '\\N'
+    if pg_type == 'vector':
+        value = format_vector(value)
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+def _copy_rows(cur, table: str, columns: List[Tuple[str, str]], rows: List[tuple], binary: bool = True):
+    """Загружает строки в таблицу через COPY FROM STDIN (бинарный формат или текстовый)"""
+    names = ', '.join(name for name, _ in columns)
+    if binary:
+        buffer = io.BytesIO()
+        buffer.write(b'PGCOPY\n\xff\r\n\x00' + struct.pack('>ii', 0, 0))
+        field_count = struct.pack('>h', len(columns))
+        for row in rows:
+            buffer.write(field_count)
+            for (_, pg_type), value in zip(columns, row):
+                if value is None:
+                    buffer.write(struct.pack('>i', -1))
+                    continue
+                data = _encode_binary_field(pg_type, value)
+                buffer.write(struct.pack('>i', len(data)))
+                buffer.write(data)
+        buffer.write(struct.pack('>h', -1))
+        sql = f"COPY {table} ({names}) FROM STDIN WITH (FORMAT binary)"
+    else:
+        buffer = io.StringIO()
+        for row in rows:
+            buffer.write('\t'.join(_encode_text_field(pg_type, value)
+                                   for (_, pg_type), value in zip(columns, row)))
+            buffer.write('\n')
+        sql = f"COPY {table} ({names}) FROM STDIN"
+    buffer.seek(0)
+    cur.copy_expert(sql, buffer)
+
+# Типы колонок целевых таблиц массовой записи: таблица -> {колонка: тип}
+_column_types_cache: Dict[str, Dict[str, str]] = {}
+
+def _target_column_types(cur, table: str) -> Dict[str, str]:
+    """Типы колонок таблицы из каталога (format_type, например 'uuid', 'real', 'vector(1024)')"""
+    types = _column_types_cache.get(table)
+    if types is None:
+        cur.execute("""
+            SELECT attname, format_type(atttypid, atttypmod)
+            FROM pg_attribute
+            WHERE attrelid = %s::regclass AND attnum > 0 AND NOT attisdropped
+        """, (table,))
+        types = _column_types_cache[table] = {name: pg_type for name, pg_type in cur.fetchall()}
+    return types
+
+def _bulk_merge(cur, target: str, columns: List[Tuple[str, str]], rows: Iterable[tuple],
+                conflict_columns: List[str], update_columns: List[str], template: str = None,
+                extra_update: str = '') -> int:
+    """
+    Записывает строки в target с обновлением при конфликте ключа
+    
+    Небольшие пакеты (меньше DB_SETTINGS['bulk_copy_threshold']) вставляются
+    одним execute_values. Большие загружаются через COPY во временную таблицу
+    порциями по DB_SETTINGS['bulk_batch_size'] и сливаются в target одним
+    INSERT ... SELECT ... ON CONFLICT DO UPDATE с приведением каждой колонки
+    к ее типу в target.
+    
+    Returns:
+        Количество записанных строк
+    """
+    names = [name for name, _ in columns]
+    key_index = [names.index(name) for name in conflict_columns]
+    updates = ', '.join([f"{name} = EXCLUDED.{name}" for name in update_columns] +
+                        ([extra_update] if extra_update else []))
+    conflict = f"ON CONFLICT ({', '.join(conflict_columns)}) DO UPDATE SET {updates}"
+    threshold = DB_SETTINGS.get('bulk_copy_threshold', 500)
+    batch_size = DB_SETTINGS.get('bulk_batch_size', 10000)
+    
+    def dedupe(batch):
+        # ON CONFLICT не может обновить одну строку дважды за команду - побеждает последняя
+        return list({tuple(row[i] for i in key_index): row for row in batch}.values())
+    
+    rows = iter(rows)
+    first_batch = list(islice(rows, threshold))
+    if len(first_batch) < threshold:
+        first_batch = dedupe(first_batch)
+        if first_batch:
+            vector_index = [i for i, (_, pg_type) in enumerate(columns) if pg_type == 'vector']
+            if vector_index:
+                first_batch = [
+                    tuple(format_vector(value) if i in vector_index and value is not None else value
+                          for i, value in enumerate(row))
+                    for row in first_batch
+                ]
+            execute_values(
+                cur,
+                f"INSERT INTO {target} ({', '.join(names)}) VALUES %s {conflict}",
+                first_batch,
+                template=template,
+                page_size=threshold
+            )
+        return len(first_batch)
+    
+    staging = f"{target}_staging"
+    column_defs = ', '.join(f"{name} {'integer' if pg_type == 'int4' else pg_type}" for name, pg_type in columns)
+    # Порядковый номер строки: при повторе ключа побеждает последняя загруженная
+    cur.execute(f"CREATE TEMP TABLE IF NOT EXISTS {staging} ({column_defs}, copy_order bigserial) ON COMMIT DROP")
+    cur.execute(f"TRUNCATE {staging}")
+    
+    binary = DB_SETTINGS.get('bulk_copy_binary', True)
+    total = 0
+    batch = first_batch
+    while batch:
+        _copy_rows(cur, staging, columns, batch, binary=binary)
+        total += len(batch)
+        batch = list(islice(rows, batch_size))
+    
+    # Временная таблица хранит значения в типах COPY; к типам target они приводятся явно
+    target_types = _target_column_types(cur, target)
+    values = ', '.join(f"{name}::{target_types[name]}" if name in target_types else name for name in names)
+    cur.execute(f"""
+        INSERT INTO {target} ({', '.join(names)})
+        SELECT DISTINCT ON ({', '.join(conflict_columns)}) {values}
+        FROM {staging}
+        ORDER BY {', '.join(conflict_columns)}, copy_order DESC
+        {conflict}
+    """)
+    logger.debug(f"COPY: загружено {total} строк в {target}, записано {cur.rowcount}")
+    return cur.rowcount
+
+def _upsert_embeddings(cur, rows: Iterable[tuple]) -> int:
+    """Массово сохраняет эмбеддинги на переданном курсоре (см. bulk_upsert_embeddings)"""
+    staged = (
+        (item_id, text, text_hash, list(embedding), len(embedding), model, model_version)
+        for item_id, text, text_hash, embedding, model, model_version in rows
+    )
+    return _bulk_merge(
+        cur, 'embeddings', EMBEDDING_COLUMNS, staged,
+        conflict_columns=['item_id', 'model', 'model_version'],
+        update_columns=['text', 'text_hash', 'embedding', 'dimensions'],
+        template="(%s, %s, %s, %s::vector, %s, %s, %s)",
+        extra_update='created_at = CURRENT_TIMESTAMP'
+    )
+
+def bulk_upsert_embeddings(rows: Iterable[tuple]) -> int:
+    """
+    Массово сохраняет или обновляет эмбеддинги
+    
+    Args:
+        rows: Кортежи (item_id, text, text_hash, embedding, model, model_version);
+              может быть генератором - строки забираются порциями
+    
+    Returns:
+        Количество записанных строк или -1 при ошибке
+    """
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                return _upsert_embeddings(cur, rows)
+    except Exception as e:
+        logger.error(f"Ошибка при массовом сохранении эмбеддингов: {str(e)}")
+        return -1
+
+def _upsert_items(cur, rows: Iterable[tuple]) -> int:
+    """Массово записывает элементы на переданном курсоре (см. bulk_upsert_items)"""
+    staged = (tuple(row) + (None,) * (len(ITEM_COLUMNS) - len(row)) for row in rows)
+    return _bulk_merge(
+        cur, 'items', ITEM_COLUMNS, staged,
+        conflict_columns=['id'],
+        update_columns=['id_parent', 'txt', 'area', 'style']
+    )
+
+# Функции, вызываемые со списком id после изменения элементов (например, сброс кэша ответов)
+_item_change_listeners: List[Callable[[List[int]], None]] = []
+
+def on_items_changed(listener: Callable[[List[int]], None]):
+    """Регистрирует функцию, вызываемую со списком id измененных элементов"""
+    _item_change_listeners.append(listener)
+
+def _notify_items_changed(item_ids: List[int]):
+    for listener in _item_change_listeners:
+        try:
+            listener(item_ids)
+        except Exception as e:
+            logger.warning(f"Ошибка обработчика изменения элементов: {str(e)}")
+
+def _collect_ids(rows: Iterable[tuple], ids: List[int]) -> Iterable[tuple]:
+    """Пропускает строки дальше, запоминая их id (rows может быть генератором)"""
+    for row in rows:
+        ids.append(row[0])
+        yield row
+
+def bulk_upsert_items(rows: Iterable[tuple]) -> int:
+    """
+    Массово импортирует элементы в items (с обновлением существующих по id)
+    
+    Args:
+        rows: Кортежи (id, id_parent, txt[, area[, style]]); может быть генератором
+    
+    Returns:
+        Количество записанных строк или -1 при ошибке
+    """
+    changed: List[int] = []
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                count = _upsert_items(cur, _collect_ids(rows, changed))
+        # Структура дерева могла измениться
+        clear_subtree_cache()
+        _notify_items_changed(changed)
+        return count
+    except Exception as e:
+        logger.error(f"Ошибка при массовом импорте элементов: {str(e)}")
+        return -1
+
 def ensure_text_search_index():
     """Создает индекс для текстового поиска в таблице items, если его нет"""
     try:
-        with get_connection() as conn:
+        # Проверка только читает каталог и не должна отмечать запись в потоке
+        with get_connection(readonly=True) as conn:
             with conn.cursor() as cur:
                 # Проверяем, существует ли индекс для поля txt
                 cur.execute("""
@@ -701,83 +1492,144 @@ def ensure_text_search_index():
                 """)
                 
                 existing_index = cur.fetchone()
-                
-                if not existing_index:
-                    logger.info("Создаем индекс для текстового поиска в таблице items")
-                    # Создаем индекс для текстового поиска
-                    cur.execute("""
-                        CREATE INDEX idx_items_txt ON items USING gin(to_tsvector('russian', txt));
-                    """)
-                    conn.commit()
-                    logger.info("Индекс для текстового поиска успешно создан")
-                else:
-                    logger.debug("Индекс для текстового поиска уже существует")
-                
-                return True
+        
+        if existing_index:
+            logger.debug("Индекс для текстового поиска уже существует")
+            return True
+        
+        logger.info("Создаем индекс для текстового поиска в таблице items")
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                # Создаем индекс для текстового поиска
+                cur.execute("""
+                    CREATE INDEX IF NOT EXISTS idx_items_txt ON items USING gin(to_tsvector('russian', txt));
+                """)
+        logger.info("Индекс для текстового поиска успешно создан")
+        return True
     except Exception as e:
         logger.error(f"Ошибка при создании индекса: {str(e)}")
         return False
 
-def search_by_keywords(keywords: List[str], limit: int = 20, root_id: str = None, max_depth: int = 3) -> List[Dict[str, Any]]:
+def search_by_keywords(keywords: List[str], limit: int = 20, root_id: str = None, max_depth: int = 3,
+                       parent_depth: int = 3, child_depth: int = 3) -> List[Dict[str, Any]]:
     """
     Поиск элементов по ключевым словам с учетом максимальной глубины
+    
+    Контекст (parent_depth уровней родителей и child_depth уровней детей)
+    получается пакетно для всех найденных элементов.
     """
     try:
         if not keywords:
             return []
             
-        with get_connection() as conn:
+        with get_connection(readonly=True) as conn:
             with conn.cursor() as cur:
-                # Формируем условия для поиска
-                like_conditions = []
-                params = []
+                # Любое совпадение из списка шаблонов (эквивалент OR из ILIKE)
+                patterns = [f"%{keyword}%" for keyword in keywords]
                 
-                for keyword in keywords:
-                    like_conditions.append("txt ILIKE %s")
-                    params.append(f"%{keyword}%")
-                
-                # Базовый запрос
-                query = f"""
-                SELECT id, id_parent, txt 
-                FROM items 
-                WHERE ({' OR '.join(like_conditions)})
-                """
-                
-                # Добавляем условие для корневого элемента, если оно задано
+                # Ограничиваем поиск поддеревом корневого элемента, если оно задано
                 if root_id:
-                    query += " AND (id = %s OR EXISTS (WITH RECURSIVE tree AS (SELECT id FROM items WHERE id = %s UNION ALL SELECT i.id FROM items i JOIN tree t ON i.id_parent = t.id) SELECT 1 FROM tree WHERE tree.id = items.id))"
-                    params.extend([root_id, root_id])
-                
-                # Ограничиваем количество результатов
-                query += f" LIMIT {limit}"
-                
-                # Добавляем параметр max_depth в запрос
-                query_params = {
-                    'keywords': keywords,
-                    'limit': limit,
-                    'root_id': root_id,
-                    'max_depth': max_depth  # Используем переданное значение max_depth
-                }
-                
-                cur.execute(query, params)
+                    execute_prepared(cur, 'keyword_search_in_tree', (root_id, patterns, limit))
+                else:
+                    execute_prepared(cur, 'keyword_search', (patterns, limit))
                 rows = cur.fetchall()
                 
-                # Получаем родительские и дочерние элементы для каждого элемента
-                items = []
-                for row in rows:
-                    item_data = {
-                        'item': row,
-                        'parents': get_parent_items(row[0], cur),
-                        'children': get_child_items(row[0], cur)
-                    }
-                    items.append(item_data)
-                
-                return items
+                # Получаем родительские и дочерние элементы сразу для всех найденных элементов
+                return _attach_contexts(cur, rows, parent_depth, child_depth)
                 
     except Exception as e:
         logger.error(f"Ошибка при поиске по ключевым словам: {str(e)}")
         raise
 
+def search_fulltext(text: str, limit: int = 20, root_id: str = None,
+                    parent_depth: int = 0, child_depth: int = 0) -> List[Dict[str, Any]]:
+    """
+    Полнотекстовый поиск (to_tsvector('russian', txt)) с ранжированием по ts_rank_cd
+    
+    Слова запроса объединяются через ИЛИ, поэтому найдутся элементы,
+    содержащие хотя бы одно из них (с учетом морфологии).
+    """
+    if not text or not text.strip():
+        return []
+    try:
+        with get_connection(readonly=True) as conn:
+            with conn.cursor() as cur:
+                if root_id:
+                    execute_prepared(cur, 'fulltext_search_in_tree', (root_id, text, limit))
+                else:
+                    execute_prepared(cur, 'fulltext_search', (text, limit))
+                return _attach_contexts(cur, cur.fetchall(), parent_depth, child_depth)
+    except Exception as e:
+        logger.error(f"Ошибка при полнотекстовом поиске: {str(e)}")
+        raise
+
+def get_subtree_id_set(root_id: str, max_level: int = 32) -> set:
+    """Возвращает множество id поддерева root_id (из кэша get_subtree_ids)"""
+    with get_connection(readonly=True) as conn:
+        with conn.cursor() as cur:
+            return set(get_subtree_ids(root_id, cur, max_level))
+
+def search_by_embedding(embedding: Sequence[float], limit: int = None, model: str = None,
+                        parent_depth: int = 0, child_depth: int = 0) -> List[Dict[str, Any]]:
+    """
+    Находит top-k элементов, ближайших к эмбеддингу по косинусному расстоянию
+    
+    Args:
+        embedding: Эмбеддинг запроса
+        limit: Количество результатов (None = SEARCH_SETTINGS['top_k'])
+        model: Модель эмбеддингов (None = MODELS['embedding']['name'])
+        parent_depth: Глубина родительского контекста
+        child_depth: Глубина дочернего контекста
+    
+    Returns:
+        Элементы с контекстом, как в search_by_keywords, и полем 'similarity'
+    """
+    if limit is None:
+        limit = SEARCH_SETTINGS.get('top_k', 5)
+    if model is None:
+        model = MODELS['embedding']['name']
+    try:
+        with get_connection(readonly=True) as conn:
+            with conn.cursor() as cur:
+                execute_prepared(cur, 'vector_top_k', (format_vector(embedding), model, limit))
+                rows = cur.fetchall()
+                results = _attach_contexts(cur, [row[:3] for row in rows], parent_depth, child_depth)
+                for result, row in zip(results, rows):
+                    result['similarity'] = float(row[3])
+                return results
+    except Exception as e:
+        logger.error(f"Ошибка при векторном поиске: {str(e)}")
+        raise
+
+def parse_vector(text: str) -> List[float]:
+    """Разбирает текстовое представление типа vector ([x1,x2,...])"""
+    return [float(x) for x in text.strip('[]').split(',')] if text and text != '[]' else []
+
+def get_item_embeddings(item_ids: List[str], model: str = None) -> Dict[str, List[float]]:
+    """
+    Возвращает сохраненные эмбеддинги элементов одним запросом
+
+    Args:
+        item_ids: ID элементов
+        model: Модель эмбеддингов (None = MODELS['embedding']['name'])
+
+    Returns:
+        item_id -> эмбеддинг (самой свежей версии модели); элементов без эмбеддинга в словаре нет
+    """
+    if not item_ids:
+        return {}
+    if model is None:
+        model = MODELS['embedding']['name']
+    with get_connection(readonly=True) as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT DISTINCT ON (item_id) item_id, embedding::text
+                FROM embeddings
+                WHERE item_id = ANY(%s) AND model = %s
+                ORDER BY item_id, created_at DESC
+            """, (list(item_ids), model))
+            return {item_id: parse_vector(embedding) for item_id, embedding in cur.fetchall()}
+
 def create_query_embeddings_table():
     """Создает таблицу для хранения эмбеддингов запросов, если она не существует"""
     try:
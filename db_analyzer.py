@@ -7,7 +7,7 @@ import json
 import datetime
 from typing import List, Dict, Any, Optional
 import logging
-from db import get_connection, DB_CONFIG
+from db import get_connection, iter_query, DB_CONFIG
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO, 
@@ -16,7 +16,7 @@ logger = logging.getLogger('db_analyzer')
 
 def get_database_info() -> Dict[str, Any]:
     """Получает общую информацию о базе данных"""
-    with get_connection() as conn:
+    with get_connection(readonly=True) as conn:
         with conn.cursor() as cur:
             # Получаем версию PostgreSQL
             cur.execute("SELECT version();")
@@ -57,7 +57,7 @@ def get_database_info() -> Dict[str, Any]:
 
 def get_tables_info() -> List[Dict[str, Any]]:
     """Получает информацию о всех таблицах в базе данных"""
-    with get_connection() as conn:
+    with get_connection(readonly=True) as conn:
         with conn.cursor() as cur:
             # Получаем список таблиц
             cur.execute("""
@@ -144,11 +144,8 @@ def get_tables_info() -> List[Dict[str, Any]]:
                 
                 # Получаем примеры данных
                 try:
-                    cur.execute(f"SELECT * FROM {table_name} LIMIT 5;")
-                    column_names = [desc[0] for desc in cur.description]
-                    sample_data = []
-                    for sample_row in cur.fetchall():
-                        sample_data.append(dict(zip(column_names, sample_row)))
+                    # Серверный курсор: широкие строки (txt, embedding) не буферизуются целиком
+                    sample_data = list(iter_query(f"SELECT * FROM {table_name} LIMIT 5;", as_dict=True))
                 except Exception as e:
                     sample_data = [{"error": str(e)}]
                 
@@ -169,7 +166,7 @@ def get_tables_info() -> List[Dict[str, Any]]:
 
 def get_relationships() -> List[Dict[str, Any]]:
     """Получает информацию о внешних ключах и связях между таблицами"""
-    with get_connection() as conn:
+    with get_connection(readonly=True) as conn:
         with conn.cursor() as cur:
             cur.execute("""
                 SELECT
@@ -204,7 +201,7 @@ def get_relationships() -> List[Dict[str, Any]]:
 
 def get_query_statistics() -> List[Dict[str, Any]]:
     """Получает статистику запросов и производительности"""
-    with get_connection() as conn:
+    with get_connection(readonly=True) as conn:
         with conn.cursor() as cur:
             # Проверим доступность pg_stat_statements
             cur.execute("""
@@ -0,0 +1,218 @@
+"""
+Асинхронный доступ к базе данных для конвейера обработки запросов
+
+Повторяет горячие функции чтения из db.py (поиск по ключевым словам,
+пакетное получение контекста, векторный top-k, чтение конфигурации)
+поверх собственного пула asyncpg. Запросы берутся из того же реестра
+PREPARED_STATEMENTS, asyncpg сам подготавливает и кэширует их на каждом
+подключении. Несколько запросов можно выполнять одновременно:
+
+    results, similar = await asyncio.gather(
+        search_by_keywords(keywords), search_by_embedding(embedding))
+"""
+import asyncio
+import json
+import logging
+from contextlib import asynccontextmanager
+from typing import List, Dict, Any, Optional, Sequence, Tuple
+
+import asyncpg
+
+from config import DB_CONFIG, DB_REPLICAS, DB_SETTINGS, SEARCH_SETTINGS, MODELS
+from db import numbered_sql, format_vector, _next_replica, _eject_replica, _recent_write
+
+logger = logging.getLogger(__name__)
+
+# Пулы asyncpg по циклам событий: подключения asyncpg привязаны к циклу, в
+# котором созданы, поэтому у каждого цикла (например, у каждого asyncio.run)
+# свои пулы. Внутри цикла: None - основной сервер, номер - реплика из DB_REPLICAS
+_pools: Dict[asyncio.AbstractEventLoop, Dict[Optional[int], asyncpg.Pool]] = {}
+_pool_locks: Dict[asyncio.AbstractEventLoop, asyncio.Lock] = {}
+
+def _connect_params(config) -> Dict[str, Any]:
+    """Переводит параметры подключения psycopg2 (словарь или DSN) в параметры asyncpg"""
+    if isinstance(config, str):
+        return {'dsn': config}
+    params = dict(config)
+    if 'dsn' in params:
+        return {'dsn': params['dsn']}
+    if 'dbname' in params:
+        params['database'] = params.pop('dbname')
+    if params.get('port') is not None:
+        params['port'] = int(params['port'])
+    return params
+
+async def _init_connection(conn):
+    """Регистрирует текстовый кодек для типа vector (pgvector) на новом подключении"""
+    try:
+        await conn.set_type_codec(
+            'vector',
+            encoder=format_vector,
+            decoder=lambda value: [float(x) for x in value.strip('[]').split(',') if x],
+            format='text'
+        )
+    except ValueError:
+        # Расширение vector не установлено - векторный поиск будет недоступен
+        logger.debug("Тип vector не найден, кодек не зарегистрирован")
+
+def _loop_pools() -> Dict[Optional[int], asyncpg.Pool]:
+    """Пулы текущего цикла событий; пулы закрытых циклов отбрасываются"""
+    loop = asyncio.get_running_loop()
+    for closed in [other for other in _pools if other.is_closed()]:
+        # Закрыть их уже нельзя: подключения умерли вместе со своим циклом
+        del _pools[closed]
+        _pool_locks.pop(closed, None)
+    if loop not in _pools:
+        _pools[loop] = {}
+        _pool_locks[loop] = asyncio.Lock()
+    return _pools[loop]
+
+async def get_pool(replica: Optional[int] = None) -> asyncpg.Pool:
+    """Возвращает пул asyncpg текущего цикла к основному серверу или реплике, создавая его при первом вызове"""
+    pools = _loop_pools()
+    pool = pools.get(replica)
+    if pool is not None:
+        return pool
+    async with _pool_locks[asyncio.get_running_loop()]:
+        pool = pools.get(replica)
+        if pool is None:
+            config = DB_CONFIG if replica is None else DB_REPLICAS[replica]
+            pool = await asyncpg.create_pool(
+                min_size=DB_SETTINGS.get('pool_min_size', 1),
+                max_size=DB_SETTINGS.get('async_pool_max_size', 20),
+                init=_init_connection,
+                **_connect_params(config)
+            )
+            pools[replica] = pool
+    return pool
+
+@asynccontextmanager
+async def acquire(readonly: bool = False):
+    """
+    Выдает подключение asyncpg из пула
+
+    Маршрутизация такая же, как у db.get_connection: запросы только для чтения
+    идут на реплики по кругу, недоступные реплики временно исключаются - и при
+    подключении, и при разрыве связи во время запроса.
+    """
+    if readonly and DB_REPLICAS and not _recent_write():
+        for _ in range(len(DB_REPLICAS)):
+            replica = _next_replica()
+            if replica is None:
+                break
+            try:
+                pool = await get_pool(replica)
+                conn = await pool.acquire()
+            except (OSError, asyncpg.PostgresConnectionError) as e:
+                _eject_replica(replica, e)
+                continue
+            try:
+                yield conn
+            except (OSError, asyncpg.PostgresConnectionError) as e:
+                _eject_replica(replica, e)
+                raise
+            finally:
+                await pool.release(conn)
+            return
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        yield conn
+
+async def close_pool():
+    """Закрывает пулы asyncpg текущего цикла событий (вызывать перед его завершением)"""
+    loop = asyncio.get_running_loop()
+    pools = _pools.pop(loop, {})
+    _pool_locks.pop(loop, None)
+    for pool in pools.values():
+        await pool.close()
+
+async def _fetch_contexts(conn, item_ids: List[str], parent_depth: int, child_depth: int) -> Dict[str, Tuple[List[tuple], List[tuple]]]:
+    """Асинхронный аналог db._fetch_contexts: родители и дети для всех item_ids"""
+    contexts = {item_id: ([], []) for item_id in item_ids}
+    if not item_ids:
+        return contexts
+
+    if parent_depth > 0:
+        for origin_id, *parent in await conn.fetch(numbered_sql('context_parents'), item_ids, parent_depth):
+            contexts[origin_id][0].append(tuple(parent))
+
+    if child_depth > 0:
+        for origin_id, *child in await conn.fetch(numbered_sql('context_children'), item_ids, child_depth):
+            contexts[origin_id][1].append(tuple(child))
+
+    return contexts
+
+async def _attach_contexts(conn, rows: List[tuple], parent_depth: int = 3, child_depth: int = 3) -> List[Dict[str, Any]]:
+    """Асинхронный аналог db._attach_contexts (родители от самого дальнего к ближайшему)"""
+    contexts = await _fetch_contexts(conn, list(dict.fromkeys(row[0] for row in rows)), parent_depth, child_depth)
+    return [
+        {
+            'item': row,
+            'parents': contexts[row[0]][0][::-1],
+            'children': contexts[row[0]][1]
+        }
+        for row in rows
+    ]
+
+async def search_by_keywords(keywords: List[str], limit: int = 20, root_id: str = None,
+                             parent_depth: int = 3, child_depth: int = 3) -> List[Dict[str, Any]]:
+    """Поиск элементов по ключевым словам (см. db.search_by_keywords)"""
+    if not keywords:
+        return []
+    patterns = [f"%{keyword}%" for keyword in keywords]
+    async with acquire(readonly=True) as conn:
+        if root_id:
+            records = await conn.fetch(numbered_sql('keyword_search_in_tree'), root_id, patterns, limit)
+        else:
+            records = await conn.fetch(numbered_sql('keyword_search'), patterns, limit)
+        return await _attach_contexts(conn, [tuple(record) for record in records], parent_depth, child_depth)
+
+async def get_items_with_context(item_ids: List[str], parent_depth: int = 0, child_depth: int = 0) -> Dict[str, Dict[str, Any]]:
+    """Получает элементы с контекстом за фиксированное число запросов (см. db.get_items_with_context)"""
+    item_ids = list(dict.fromkeys(item_ids))
+    if not item_ids:
+        return {}
+
+    async with acquire(readonly=True) as conn:
+        records = await conn.fetch(numbered_sql('items_by_ids'), item_ids)
+        result = {
+            record[0]: {'item': tuple(record), 'parents': [], 'children': []}
+            for record in records
+        }
+        contexts = await _fetch_contexts(conn, list(result), parent_depth, child_depth)
+        for item_id, (parents, children) in contexts.items():
+            result[item_id]['parents'] = parents
+            result[item_id]['children'] = children
+        return result
+
+async def search_by_embedding(embedding: Sequence[float], limit: int = None, model: str = None,
+                              parent_depth: int = 0, child_depth: int = 0) -> List[Dict[str, Any]]:
+    """Находит top-k ближайших к эмбеддингу элементов (см. db.search_by_embedding)"""
+    if limit is None:
+        limit = SEARCH_SETTINGS.get('top_k', 5)
+    if model is None:
+        model = MODELS['embedding']['name']
+    async with acquire(readonly=True) as conn:
+        records = await conn.fetch(numbered_sql('vector_top_k'), list(embedding), model, limit)
+        results = await _attach_contexts(conn, [tuple(record)[:3] for record in records], parent_depth, child_depth)
+        for result, record in zip(results, records):
+            result['similarity'] = float(record[3])
+        return results
+
+async def get_config_value(config_name: str, default_value=None):
+    """Загружает параметр конфигурации из таблицы config (см. config_db.get_config_from_db)"""
+    try:
+        async with acquire(readonly=True) as conn:
+            value = await conn.fetchval(numbered_sql('config_value'), config_name)
+    except asyncpg.UndefinedTableError:
+        return default_value
+    except Exception as e:
+        logger.error(f"Ошибка при загрузке конфигурации из БД: {str(e)}")
+        return default_value
+
+    if value is None:
+        return default_value
+    try:
+        return json.loads(value)
+    except (json.JSONDecodeError, TypeError):
+        return value
@@ -1,11 +1,20 @@
 import logging
 from typing import Any, Dict, Optional
 from config import DEBUG, INTERACTIVE_SETTINGS, RAG_SETTINGS, SEARCH_SETTINGS, MODELS
-import numpy as np
 import sys  # Добавляем импорт sys для выхода из программы
 
 logger = logging.getLogger(__name__)
 
+def _numpy_types(*names: str) -> tuple:
+    """
+    Типы numpy по именам, если numpy уже загружен
+
+    numpy не импортируется ради одних проверок isinstance: если его нет
+    в sys.modules, то и значений его типов быть не может.
+    """
+    np = sys.modules.get('numpy')
+    return tuple(getattr(np, name) for name in names) if np else ()
+
 def truncate_text(text: str, max_length: int = DEBUG['truncate_output']) -> str:
     """Обрезает текст до указанной длины"""
     if not text:
@@ -22,7 +31,7 @@ def format_vector(vector: Any, max_items: int = 5) -> str:
         items = list(vector.items())[:max_items]
         preview = ", ".join(f"{k}: {format_value(v)}" for k, v in items)
         return f"{{{preview}}} ... {len(vector)} items"
-    elif isinstance(vector, (list, tuple, np.ndarray)):
+    elif isinstance(vector, (list, tuple) + _numpy_types('ndarray')):
         # Для списков и массивов
         items = vector[:max_items]
         preview = ", ".join(format_value(x) for x in items)
@@ -33,14 +42,14 @@ def format_vector(vector: Any, max_items: int = 5) -> str:
 
 def format_value(value: Any) -> str:
     """Форматирует отдельное значение"""
-    if isinstance(value, (float, np.float32, np.float64)):
+    if isinstance(value, (float,) + _numpy_types('float32', 'float64')):
         return f"{value:.4f}"
-    elif isinstance(value, (int, np.int32, np.int64)):
+    elif isinstance(value, (int,) + _numpy_types('int32', 'int64')):
         return str(value)
     elif isinstance(value, str):
         # Обрезаем длинные строки
         return f'"{value[:50]}..."' if len(value) > 50 else f'"{value}"'
-    elif isinstance(value, (list, tuple, np.ndarray)):
+    elif isinstance(value, (list, tuple) + _numpy_types('ndarray')):
         return format_vector(value)
     else:
         return str(value)
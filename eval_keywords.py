@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Сравнение локального извлечения ключевых слов с LLM
+
+Для каждого запроса ключевые слова выделяются обоими способами, затем по
+ним выполняется гибридный поиск. Сообщается среднее время извлечения и
+полнота поиска:
+    с разметкой (--qrels)  - recall@k по релевантным элементам
+    без разметки           - доля top-k, найденного по словам LLM,
+                             которую находит поиск по локальным словам
+
+Использование:
+    python eval_keywords.py --queries queries.txt [-k 10]
+    python eval_keywords.py --qrels qrels.jsonl [-k 10]
+
+Формат qrels.jsonl: {"query": "...", "relevant": ["id1", "id2"]} в каждой строке.
+"""
+import argparse
+import json
+import logging
+import time
+from typing import Dict, List, Sequence
+
+METHODS = ('llm', 'local')
+
+def recall_at_k(found: Sequence[str], relevant: Sequence[str], k: int) -> float:
+    """Доля релевантных элементов среди первых k найденных"""
+    if not relevant:
+        return 0.0
+    return len(set(found[:k]) & set(relevant)) / len(set(relevant))
+
+def load_queries(queries_path: str = None, qrels_path: str = None) -> List[Dict]:
+    """Запросы из текстового файла (по одному в строке) или из qrels JSONL"""
+    if qrels_path:
+        with open(qrels_path, encoding='utf-8') as f:
+            return [json.loads(line) for line in f if line.strip()]
+    with open(queries_path, encoding='utf-8') as f:
+        return [{'query': line.strip()} for line in f if line.strip()]
+
+def evaluate(queries: List[Dict], k: int) -> Dict[str, Dict[str, float]]:
+    """Время извлечения и полнота поиска для каждого способа"""
+    from hybrid_search import hybrid_search
+    from keywords import generate_keywords_for_query
+
+    totals = {method: {'extract_ms': 0.0, 'recall': 0.0} for method in METHODS}
+    for entry in queries:
+        query = entry['query']
+        found = {}
+        for method in METHODS:
+            start = time.perf_counter()
+            keywords = generate_keywords_for_query(query, method=method)
+            totals[method]['extract_ms'] += (time.perf_counter() - start) * 1000
+            items = hybrid_search(query, keywords, limit=k)
+            found[method] = [str(item['item'][0]) for item in items]
+            logging.debug(f"{method}: {keywords} -> {found[method]}")
+
+        for method in METHODS:
+            # Без разметки эталон - выдача по словам LLM
+            relevant = [str(item_id) for item_id in entry['relevant']] if 'relevant' in entry else found['llm']
+            totals[method]['recall'] += recall_at_k(found[method], relevant, k)
+
+    count = len(queries) or 1
+    return {method: {name: value / count for name, value in values.items()} for method, values in totals.items()}
+
+def main():
+    parser = argparse.ArgumentParser(description='Сравнение локального извлечения ключевых слов с LLM')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--queries', help='Файл запросов, по одному в строке')
+    source.add_argument('--qrels', help='JSONL с запросами и релевантными элементами')
+    parser.add_argument('-k', type=int, default=10, help='Глубина выдачи для полноты')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Выводить ключевые слова и выдачу')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING)
+
+    queries = load_queries(args.queries, args.qrels)
+    results = evaluate(queries, args.k)
+    label = f"recall@{args.k}" if args.qrels else f"совпадение с LLM@{args.k}"
+    print(f"Запросов: {len(queries)}")
+    for method in METHODS:
+        print(f"{method:>6}: извлечение {results[method]['extract_ms']:8.3f} мс, "
+              f"{label} {results[method]['recall']:.3f}")
+
+if __name__ == '__main__':
+    main()
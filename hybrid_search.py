@@ -0,0 +1,172 @@
+"""
+Гибридный поиск кандидатов для реранжирования
+
+Параллельно запускает несколько независимых способов поиска (ветвей):
+    fulltext - полнотекстовый поиск PostgreSQL (to_tsvector('russian', txt))
+    bm25     - персистентный индекс BM25 (bm25_index.py)
+    vector   - ближайшие эмбеддинги (pgvector)
+    keywords - поиск подстрок по ключевым словам (ILIKE)
+
+и объединяет их ранжированные списки методом Reciprocal Rank Fusion:
+    score(d) = sum(weight_b / (rrf_k + rank_b(d)))
+Время поиска определяется самой медленной ветвью, а не суммой всех.
+Ошибка или таймаут одной ветви не мешают остальным.
+"""
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError, wait
+from typing import List, Dict, Any, Optional, Callable
+
+from config import SEARCH_SETTINGS
+from db import (search_fulltext, search_by_keywords, search_by_embedding,
+                get_items_with_context, get_subtree_id_set, carry_write_state)
+
+logger = logging.getLogger(__name__)
+
+# Общий пул потоков для ветвей поиска (ветви в основном ждут БД)
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='hybrid')
+
+def _fulltext_branch(query: str, keywords: List[str], limit: int, root_id: Optional[str]) -> List[str]:
+    text = ' '.join([query] + list(keywords or []))
+    return [item['item'][0] for item in search_fulltext(text, limit, root_id)]
+
+def _bm25_branch(query: str, keywords: List[str], limit: int, root_id: Optional[str]) -> List[str]:
+    from bm25_index import search as bm25_search
+    text = ' '.join([query] + list(keywords or []))
+    if root_id:
+        subtree = get_subtree_id_set(root_id)
+        # Индекс не знает о дереве: берем с запасом и фильтруем по поддереву
+        return [item_id for item_id, _ in bm25_search(text, limit * 4) if item_id in subtree][:limit]
+    return [item_id for item_id, _ in bm25_search(text, limit)]
+
+def _vector_branch(query: str, keywords: List[str], limit: int, root_id: Optional[str]) -> List[str]:
+    from embeddings import get_embedding
+    return vector_search(get_embedding(query), limit, root_id)
+
+def vector_search(embedding: List[float], limit: int, root_id: Optional[str]) -> List[str]:
+    """Ближайшие к эмбеддингу запроса элементы (пустой эмбеддинг - пустой результат)"""
+    if not embedding:
+        return []
+    if root_id:
+        subtree = get_subtree_id_set(root_id)
+        return [item['item'][0] for item in search_by_embedding(embedding, limit * 4)
+                if item['item'][0] in subtree][:limit]
+    return [item['item'][0] for item in search_by_embedding(embedding, limit)]
+
+def _keywords_branch(query: str, keywords: List[str], limit: int, root_id: Optional[str]) -> List[str]:
+    if not keywords:
+        return []
+    return [item['item'][0] for item in search_by_keywords(keywords, limit, root_id, parent_depth=0, child_depth=0)]
+
+# Ветви поиска: имя -> функция (query, keywords, limit, root_id) -> список id по убыванию релевантности
+BRANCHES: Dict[str, Callable[..., List[str]]] = {
+    'fulltext': _fulltext_branch,
+    'bm25': _bm25_branch,
+    'vector': _vector_branch,
+    'keywords': _keywords_branch,
+}
+
+def reciprocal_rank_fusion(rankings: Dict[str, List[str]], weights: Dict[str, float],
+                           k: int = 60) -> List[tuple]:
+    """
+    Объединяет ранжированные списки методом Reciprocal Rank Fusion
+
+    Args:
+        rankings: Имя ветви -> список id (лучший первый); повторы id внутри списка игнорируются
+        weights: Имя ветви -> вес (по умолчанию 1.0)
+        k: Сглаживающая константа RRF
+
+    Returns:
+        Список (id, оценка RRF, {ветвь: ранг}) по убыванию оценки;
+        при равенстве выше тот, у кого лучше лучший ранг, затем по id
+    """
+    scores: Dict[str, float] = {}
+    sources: Dict[str, Dict[str, int]] = {}
+    for branch, ids in rankings.items():
+        weight = weights.get(branch, 1.0)
+        rank = 0
+        for item_id in ids:
+            if branch in sources.setdefault(item_id, {}):
+                continue
+            rank += 1
+            sources[item_id][branch] = rank
+            scores[item_id] = scores.get(item_id, 0.0) + weight / (k + rank)
+    fused = sorted(scores, key=lambda item_id: (-scores[item_id], min(sources[item_id].values()), item_id))
+    return [(item_id, scores[item_id], sources[item_id]) for item_id in fused]
+
+def hybrid_search(query: str, keywords: List[str] = None, limit: int = None, root_id: str = None,
+                  parent_depth: int = 0, child_depth: int = 0,
+                  stats: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+    """
+    Находит кандидатов всеми ветвями параллельно и объединяет их через RRF
+
+    Args:
+        query: Запрос пользователя
+        keywords: Ключевые слова (для ветвей keywords, fulltext и bm25)
+        limit: Размер итогового списка (None = SEARCH_SETTINGS['hybrid_candidates'])
+        root_id: Ограничить поиск поддеревом
+        parent_depth: Глубина родительского контекста
+        child_depth: Глубина дочернего контекста
+        stats: Словарь, в который записываются время и число результатов каждой ветви
+
+    Returns:
+        Элементы в формате search_by_keywords ({'item', 'parents', 'children'})
+        с полями 'rrf_score' и 'sources' ({ветвь: ранг}), без повторов
+    """
+    if limit is None:
+        limit = SEARCH_SETTINGS.get('hybrid_candidates', 30)
+    weights = SEARCH_SETTINGS.get('hybrid_weights', {})
+    branch_limit = SEARCH_SETTINGS.get('hybrid_branch_limit', 50)
+    timeout = SEARCH_SETTINGS.get('hybrid_timeout', 10)
+    active = [name for name in BRANCHES if weights.get(name, 1.0) > 0]
+
+    # Ветви читают с реплик так же, как читал бы вызывающий поток после своей записи
+    @carry_write_state
+    def run(name):
+        start = time.perf_counter()
+        ids = BRANCHES[name](query, keywords or [], branch_limit, root_id)
+        return ids, time.perf_counter() - start
+
+    start = time.perf_counter()
+    futures = {name: _executor.submit(run, name) for name in active}
+    wait(futures.values(), timeout=timeout)
+
+    rankings: Dict[str, List[str]] = {}
+    branch_stats: Dict[str, Any] = {}
+    for name, future in futures.items():
+        try:
+            ids, elapsed = future.result(timeout=0)
+            rankings[name] = ids
+            branch_stats[name] = {'count': len(ids), 'time': elapsed}
+        except FutureTimeoutError:
+            future.cancel()
+            logger.warning(f"Ветвь поиска {name} не уложилась в {timeout} с")
+            branch_stats[name] = {'count': 0, 'error': 'timeout'}
+        except Exception as e:
+            logger.error(f"Ошибка в ветви поиска {name}: {str(e)}")
+            branch_stats[name] = {'count': 0, 'error': str(e)}
+    search_time = time.perf_counter() - start
+
+    results = fuse_results(rankings, limit, parent_depth, child_depth)
+    logger.debug(f"Гибридный поиск: {branch_stats}, поиск {search_time:.3f} с, кандидатов {len(results)}")
+    if stats is not None:
+        stats.update({'branches': branch_stats, 'search_time': search_time, 'candidates': len(results)})
+    return results
+
+def fuse_results(rankings: Dict[str, List[str]], limit: int, parent_depth: int = 0,
+                 child_depth: int = 0) -> List[Dict[str, Any]]:
+    """Объединяет ранжирования ветвей через RRF и забирает найденные элементы с контекстом"""
+    weights = SEARCH_SETTINGS.get('hybrid_weights', {})
+    fused = reciprocal_rank_fusion(rankings, weights, SEARCH_SETTINGS.get('rrf_k', 60))[:limit]
+    contexts = get_items_with_context([item_id for item_id, _, _ in fused], parent_depth, child_depth)
+
+    results = []
+    for item_id, score, sources in fused:
+        item = contexts.get(item_id)
+        if item is None:
+            # Например, эмбеддинг чанка без соответствующей строки items
+            continue
+        item['rrf_score'] = score
+        item['sources'] = sources
+        results.append(item)
+    return results
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Отчет о времени импорта модулей при запуске
+
+Запускает `python -X importtime -c "import <модуль>"` в отдельном процессе
+и показывает, сколько стоит импорт каждого пакета и какие модули дороже всего.
+
+Использование:
+    python import_report.py [main] [-n 20]
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+from collections import namedtuple
+from typing import Dict, List
+
+ImportRecord = namedtuple('ImportRecord', ['module', 'self_us', 'cumulative_us', 'depth'])
+
+_LINE_RE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s+)(\S+)\s*$')
+
+def parse_importtime(output: str) -> List[ImportRecord]:
+    """Разбирает вывод -X importtime; depth - уровень вложенности импорта (0 - верхний)"""
+    records = []
+    for line in output.splitlines():
+        match = _LINE_RE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            # Отступ: пробел-разделитель и по два пробела на уровень, начиная с первого
+            records.append(ImportRecord(module, int(self_us), int(cumulative_us), (len(indent) - 3) // 2))
+    return records
+
+def measure_imports(module: str = 'main', python: str = None) -> List[ImportRecord]:
+    """Импортирует модуль в новом процессе интерпретатора и возвращает времена импорта"""
+    root = os.path.dirname(os.path.abspath(__file__))
+    result = subprocess.run(
+        [python or sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=root, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Не удалось импортировать {module}:\n{result.stderr[-2000:]}")
+    return parse_importtime(result.stderr)
+
+def package_totals(records: List[ImportRecord]) -> Dict[str, int]:
+    """Собственное время импорта (мкс), просуммированное по пакетам верхнего уровня"""
+    totals: Dict[str, int] = {}
+    for record in records:
+        package = record.module.split('.')[0]
+        totals[package] = totals.get(package, 0) + record.self_us
+    return totals
+
+def total_time_us(records: List[ImportRecord]) -> int:
+    return sum(record.self_us for record in records)
+
+def print_report(module: str, records: List[ImportRecord], limit: int = 20):
+    print(f"Импорт {module}: {total_time_us(records) / 1000:.1f} мс, модулей: {len(records)}")
+    print(f"\n{'пакет':<30} {'мс':>8}")
+    for package, self_us in sorted(package_totals(records).items(), key=lambda item: -item[1])[:limit]:
+        print(f"{package:<30} {self_us / 1000:>8.1f}")
+    print(f"\n{'модуль':<40} {'свое мс':>8} {'всего мс':>9}")
+    for record in sorted(records, key=lambda record: -record.cumulative_us)[:limit]:
+        print(f"{record.module:<40} {record.self_us / 1000:>8.1f} {record.cumulative_us / 1000:>9.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Время импорта модулей при запуске')
+    parser.add_argument('module', nargs='?', default='main', help='Импортируемый модуль')
+    parser.add_argument('-n', '--limit', type=int, default=20, help='Сколько строк показывать')
+    args = parser.parse_args()
+    print_report(args.module, measure_imports(args.module), args.limit)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Локальное извлечение ключевых слов по статистике корпуса
+
+Вместо запроса к LLM ключевые слова выбираются из слов самого запроса по
+статистике, заранее посчитанной по items.txt:
+    df         - в скольких элементах встречается основа слова (стеммер и
+                 стоп-слова - как в tokenization.py)
+    bigrams    - в скольких элементах основы идут подряд (для фраз)
+
+Слова, которых нет в базе знаний, и слишком частые слова (df / N больше
+max_df_ratio) отбрасываются, остальные ранжируются по IDF. Пара соседних
+слов запроса становится фразой, если в корпусе это устойчивое сочетание:
+не меньше min_collocation_count элементов и PMI = ln(N * df12 / (df1 * df2))
+не меньше min_pmi. Извлечение - токенизация запроса и поиск в словарях,
+доли миллисекунды.
+
+Использование:
+    python keyword_extractor.py build
+    python keyword_extractor.py extract "запрос" [-n 5]
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import threading
+import time
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from config import KEYWORDS_SETTINGS
+from tokenization import tokenize_words
+
+logger = logging.getLogger(__name__)
+
+STATS_VERSION = 1
+
+class TermStats:
+    """Документные частоты основ и соседних пар основ по корпусу"""
+    def __init__(self, docs: int = 0, df: Dict[str, int] = None, bigrams: Dict[str, int] = None):
+        self.docs = docs
+        self.df = df or {}
+        # Ключ пары - 'основа1 основа2'
+        self.bigrams = bigrams or {}
+
+    @classmethod
+    def build(cls, texts: Iterable[str], min_bigram_count: int = None) -> 'TermStats':
+        """Считает статистику по текстам; редкие пары (меньше min_bigram_count элементов) не хранятся"""
+        if min_bigram_count is None:
+            min_bigram_count = KEYWORDS_SETTINGS.get('min_collocation_count', 3)
+        docs = 0
+        df: Counter = Counter()
+        bigrams: Counter = Counter()
+        for text in texts:
+            terms = [term for _, term in tokenize_words(text)]
+            docs += 1
+            df.update(set(terms))
+            bigrams.update({f"{first} {second}" for first, second in zip(terms, terms[1:]) if first != second})
+        return cls(docs, dict(df), {pair: count for pair, count in bigrams.items() if count >= min_bigram_count})
+
+    def idf(self, df: int) -> float:
+        """IDF как в bm25_index: ln(1 + (N - df + 0.5) / (df + 0.5))"""
+        return math.log(1.0 + (self.docs - df + 0.5) / (df + 0.5))
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': STATS_VERSION, 'docs': self.docs, 'df': self.df, 'bigrams': self.bigrams},
+                      f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'TermStats':
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('version') != STATS_VERSION:
+            raise ValueError(f"Неподдерживаемая версия статистики ключевых слов: {data.get('version')}")
+        return cls(data['docs'], data['df'], data['bigrams'])
+
+class KeywordExtractor:
+    """Выбирает ключевые слова и фразы запроса, которые есть в корпусе"""
+    def __init__(self, stats: TermStats, max_df_ratio: float = None, min_collocation_count: int = None,
+                 min_pmi: float = None):
+        self.stats = stats
+        self.max_df_ratio = max_df_ratio if max_df_ratio is not None else KEYWORDS_SETTINGS.get('max_df_ratio', 0.5)
+        self.min_collocation_count = min_collocation_count if min_collocation_count is not None \
+            else KEYWORDS_SETTINGS.get('min_collocation_count', 3)
+        self.min_pmi = min_pmi if min_pmi is not None else KEYWORDS_SETTINGS.get('min_pmi', 1.0)
+
+    def term_score(self, term: str) -> float:
+        """IDF основы; 0 - основы нет в корпусе или она слишком частая"""
+        df = self.stats.df.get(term, 0)
+        if not df or df > self.max_df_ratio * self.stats.docs:
+            return 0.0
+        return self.stats.idf(df)
+
+    def is_collocation(self, first: str, second: str) -> bool:
+        count = self.stats.bigrams.get(f"{first} {second}", 0)
+        if count < self.min_collocation_count:
+            return False
+        pmi = math.log(self.stats.docs * count / (self.stats.df[first] * self.stats.df[second]))
+        return pmi >= self.min_pmi
+
+    def extract(self, query: str, max_keywords: int = 5) -> List[str]:
+        """
+        Возвращает до max_keywords ключевых слов и фраз запроса по убыванию IDF
+
+        Слова возвращаются в той форме, в какой они написаны в запросе
+        (в нижнем регистре). Если ни одного слова запроса нет в корпусе,
+        возвращаются слова запроса длиннее трех букв, как при ошибке LLM.
+        """
+        words = tokenize_words(query)
+        scores = [self.term_score(term) for _, term in words]
+
+        candidates: List[Tuple[float, int, str]] = []
+        in_phrase = set()
+        # Фразы: соседние (после отбрасывания стоп-слов) слова запроса, устойчивые в корпусе
+        pairs = sorted(
+            (i for i in range(len(words) - 1)
+             if scores[i] and scores[i + 1] and self.is_collocation(words[i][1], words[i + 1][1])),
+            key=lambda i: -(scores[i] + scores[i + 1])
+        )
+        for i in pairs:
+            if i in in_phrase or i + 1 in in_phrase:
+                continue
+            in_phrase.update((i, i + 1))
+            candidates.append((scores[i] + scores[i + 1], i, f"{words[i][0]} {words[i + 1][0]}"))
+
+        seen_terms = {words[i][1] for i in in_phrase}
+        for i, (word, term) in enumerate(words):
+            if scores[i] and term not in seen_terms:
+                seen_terms.add(term)
+                candidates.append((scores[i], i, word))
+
+        if not candidates:
+            return [word for word, _ in words if len(word) > 3][:3]
+        candidates.sort(key=lambda candidate: (-candidate[0], candidate[1]))
+        return [keyword for _, _, keyword in candidates[:max_keywords]]
+
+_extractor: Optional[KeywordExtractor] = None
+_extractor_lock = threading.Lock()
+
+def get_extractor() -> KeywordExtractor:
+    """
+    Возвращает извлекатель со статистикой из KEYWORDS_SETTINGS['stats_path']
+
+    Raises:
+        FileNotFoundError: Статистика еще не построена (python keyword_extractor.py build)
+    """
+    global _extractor
+    if _extractor is None:
+        with _extractor_lock:
+            if _extractor is None:
+                stats = TermStats.load(KEYWORDS_SETTINGS['stats_path'])
+                logger.debug(f"Загружена статистика ключевых слов: {stats.docs} элементов, "
+                             f"{len(stats.df)} основ, {len(stats.bigrams)} пар")
+                _extractor = KeywordExtractor(stats)
+    return _extractor
+
+def extract_keywords(query: str, max_keywords: int = 5) -> List[str]:
+    """Извлекает ключевые слова запроса по статистике корпуса"""
+    return get_extractor().extract(query, max_keywords)
+
+def build_stats_from_db() -> TermStats:
+    """Считает статистику по всем элементам items и сохраняет ее в KEYWORDS_SETTINGS['stats_path']"""
+    global _extractor
+    from db import iter_items
+    stats = TermStats.build(txt or '' for _, _, txt in iter_items())
+    stats.save(KEYWORDS_SETTINGS['stats_path'])
+    _extractor = None
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description='Локальное извлечение ключевых слов по статистике корпуса')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('build', help='Посчитать статистику по items')
+    extract_parser = subparsers.add_parser('extract', help='Извлечь ключевые слова из запроса')
+    extract_parser.add_argument('query', help='Текст запроса')
+    extract_parser.add_argument('-n', '--max-keywords', type=int, default=5, help='Максимум ключевых слов')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    if args.command == 'build':
+        start = time.perf_counter()
+        stats = build_stats_from_db()
+        print(f"Элементов: {stats.docs}, основ: {len(stats.df)}, пар: {len(stats.bigrams)} "
+              f"за {time.perf_counter() - start:.1f} с")
+    elif args.command == 'extract':
+        extractor = get_extractor()
+        start = time.perf_counter()
+        keywords = extractor.extract(args.query, args.max_keywords)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        print(', '.join(keywords))
+        print(f"За {elapsed_ms:.3f} мс")
+
+if __name__ == '__main__':
+    main()
@@ -5,7 +5,38 @@ from config import KEYWORDS_SETTINGS, MODELS, RAG_SETTINGS
 
 logger = logging.getLogger(__name__)
 
-def generate_keywords_for_query(query: str, max_keywords: int = 5) -> list:
+def generate_keywords_for_query(query: str, max_keywords: int = 5, method: str = None) -> list:
+    """
+    Выделяет ключевые слова запроса способом из KEYWORDS_SETTINGS['method']
+
+    'local' - по статистике корпуса (keyword_extractor), без обращения к API;
+    если статистика еще не построена или не читается, используется LLM.
+    'llm' - запросом к GPT модели.
+
+    Args:
+        query: Запрос пользователя
+        max_keywords: Максимальное количество ключевых слов
+        method: 'local' или 'llm' (None = KEYWORDS_SETTINGS['method'])
+
+    Returns:
+        Список ключевых слов/фраз
+    """
+    method = method or KEYWORDS_SETTINGS.get('method', 'local')
+    if method == 'local':
+        from keyword_extractor import extract_keywords
+        try:
+            keywords = extract_keywords(query, max_keywords)
+            logger.debug(f"Ключевые слова по статистике корпуса: {keywords}")
+            return keywords
+        except FileNotFoundError:
+            logger.warning("Статистика ключевых слов не построена (python keyword_extractor.py build), "
+                           "используется LLM")
+        except (OSError, ValueError) as e:
+            # Нечитаемый или поврежденный файл статистики (ValueError включает JSONDecodeError)
+            logger.error(f"Ошибка при загрузке статистики ключевых слов, используется LLM: {str(e)}")
+    return generate_keywords_llm(query, max_keywords)
+
+def generate_keywords_llm(query: str, max_keywords: int = 5) -> list:
     """
     Генерирует ключевые слова для запроса с помощью GPT модели
     
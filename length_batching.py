@@ -0,0 +1,145 @@
+"""
+Пакетирование пар для кросс-энкодера по длине
+
+Пакет дополняется до длины самого длинного элемента, поэтому при пакетах в
+порядке поступления короткие заголовки платят за соседние многостраничные
+заметки. Здесь тексты один раз токенизируются (только ради длины и границ
+токенов), слишком длинные обрезаются с сохранением начала и конца, пары
+сортируются по длине и режутся на пакеты с ограничением числа пар и числа
+токенов с учетом дополнения; оценки возвращаются в исходном порядке.
+"""
+import logging
+import re
+from typing import List, Sequence, Tuple, Union
+
+from config import RERANKER_SETTINGS
+
+logger = logging.getLogger(__name__)
+
+# Служебные токены пары (запрос, текст) у XLM-RoBERTa: <s> q </s></s> t </s>
+PAIR_SPECIAL_TOKENS = 4
+
+_WORD_RE = re.compile(r'\w+|[^\w\s]')
+
+def token_offsets(tokenizer, texts: List[str]) -> List[List[Tuple[int, int]]]:
+    """
+    Возвращает границы токенов (начало, конец) в символах для каждого текста
+
+    Поддерживает быстрый токенизатор transformers (FlagReranker.tokenizer) и
+    tokenizers.Tokenizer (OnnxReranker.tokenizer); без токенизатора токенами
+    считаются слова и знаки препинания.
+    """
+    if tokenizer is None:
+        return [[match.span() for match in _WORD_RE.finditer(text)] for text in texts]
+    if hasattr(tokenizer, 'encode_batch'):
+        return [list(encoding.offsets) for encoding in tokenizer.encode_batch(texts, add_special_tokens=False)]
+    encoded = tokenizer(texts, add_special_tokens=False, return_offsets_mapping=True)
+    return [[tuple(offset) for offset in offsets] for offsets in encoded['offset_mapping']]
+
+def head_tail_sizes(length: int, max_tokens: int, head_ratio: float) -> Tuple[int, int]:
+    """Сколько токенов оставить в начале и в конце, чтобы уложиться в max_tokens"""
+    if length <= max_tokens:
+        return length, 0
+    head = min(max_tokens, max(0, int(round(max_tokens * head_ratio))))
+    return head, max_tokens - head
+
+def truncate_head_tail(text: str, offsets: Sequence[Tuple[int, int]], max_tokens: int,
+                       head_ratio: float) -> Tuple[str, int]:
+    """
+    Обрезает текст до max_tokens токенов, сохраняя начало и конец
+
+    Returns:
+        (текст, число токенов в нем)
+    """
+    head, tail = head_tail_sizes(len(offsets), max_tokens, head_ratio)
+    if tail == 0 and head == len(offsets):
+        return text, head
+    parts = []
+    if head:
+        parts.append(text[:offsets[head - 1][1]])
+    if tail:
+        parts.append(text[offsets[len(offsets) - tail][0]:])
+    return '\n'.join(parts), head + tail
+
+def length_buckets(lengths: Sequence[int], max_batch_size: int, max_batch_tokens: int = None) -> List[List[int]]:
+    """
+    Разбивает индексы на пакеты близкой длины
+
+    Индексы сортируются по длине; пакет закрывается, когда в нем max_batch_size
+    пар или когда (пар * длина самой длинной) превысила бы max_batch_tokens.
+    Поэтому короткие пары идут большими пакетами, а длинные - маленькими.
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    buckets = []
+    current: List[int] = []
+    for i in order:
+        # Порядок по возрастанию: длина пакета с i равна lengths[i]
+        too_many = len(current) >= max_batch_size
+        too_long = max_batch_tokens and current and (len(current) + 1) * lengths[i] > max_batch_tokens
+        if current and (too_many or too_long):
+            buckets.append(current)
+            current = []
+        current.append(i)
+    if current:
+        buckets.append(current)
+    return buckets
+
+def padded_tokens(lengths: Sequence[int], batches: Sequence[Sequence[int]]) -> int:
+    """Сколько токенов обработает модель с учетом дополнения до самого длинного в пакете"""
+    return sum(len(batch) * max(lengths[i] for i in batch) for batch in batches if batch)
+
+class LengthBucketedReranker:
+    """Обертка над моделью с compute_score, пакетирующая пары по длине"""
+    def __init__(self, model, max_length: int = None, head_ratio: float = None, max_batch_tokens: int = None):
+        self.model = model
+        self.tokenizer = getattr(model, 'text_tokenizer', None) or getattr(model, 'tokenizer', None)
+        self.max_length = max_length or RERANKER_SETTINGS.get('max_length', 512)
+        self.head_ratio = head_ratio if head_ratio is not None else RERANKER_SETTINGS.get('truncate_head_ratio', 0.75)
+        self.max_batch_tokens = max_batch_tokens or RERANKER_SETTINGS.get('max_batch_tokens', 16384)
+        self.last_stats = {}
+
+    def prepare(self, pairs: Sequence[Sequence[str]]) -> Tuple[List[List[str]], List[int]]:
+        """Один раз токенизирует пары, обрезает тексты; возвращает пары и их длины в токенах"""
+        queries = sorted({query for query, _ in pairs})
+        query_lengths = dict(zip(queries, (len(offsets) for offsets in token_offsets(self.tokenizer, queries))))
+        text_offsets = token_offsets(self.tokenizer, [text for _, text in pairs])
+
+        prepared, lengths = [], []
+        for (query, text), offsets in zip(pairs, text_offsets):
+            budget = max(1, self.max_length - query_lengths[query] - PAIR_SPECIAL_TOKENS)
+            text, text_length = truncate_head_tail(text, offsets, budget, self.head_ratio)
+            prepared.append([query, text])
+            lengths.append(query_lengths[query] + text_length + PAIR_SPECIAL_TOKENS)
+        return prepared, lengths
+
+    def compute_score(self, pairs, batch_size: int = 64, normalize: bool = False) -> Union[float, List[float]]:
+        """Оценивает пары пакетами по длине; интерфейс как у FlagReranker.compute_score"""
+        single = len(pairs) == 2 and isinstance(pairs[0], str)
+        if single:
+            pairs = [pairs]
+        prepared, lengths = self.prepare(pairs)
+        buckets = length_buckets(lengths, batch_size, self.max_batch_tokens)
+
+        scores: List[float] = [0.0] * len(prepared)
+        for bucket in buckets:
+            # Пакет уже подобран по длине: модель обрабатывает его за один проход
+            extra = {'normalize': True} if normalize else {}
+            bucket_scores = self.model.compute_score([prepared[i] for i in bucket], batch_size=len(bucket), **extra)
+            if isinstance(bucket_scores, (int, float)):
+                bucket_scores = [bucket_scores]
+            for i, score in zip(bucket, bucket_scores):
+                scores[i] = float(score)
+
+        self.last_stats = {
+            'buckets': len(buckets),
+            'tokens': sum(lengths),
+            'padded_tokens': padded_tokens(lengths, buckets),
+        }
+        logger.debug(f"Пакеты по длине: {self.last_stats}")
+        return scores[0] if single else scores
+
+def bucketed(model):
+    """Оборачивает модель в LengthBucketedReranker, если это включено в настройках"""
+    if not RERANKER_SETTINGS.get('length_bucketing', True) or isinstance(model, LengthBucketedReranker):
+        return model
+    return LengthBucketedReranker(model)
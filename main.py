@@ -1,13 +1,14 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Callable, Optional
 import argparse
 import logging
-from db import get_items_sample, view_item_tree, view_root_items, search_text, print_search_results, get_block_info_by_name, get_block_info_by_id, print_block_info, ensure_text_search_index, search_by_keywords
-from retrieval import rerank_items as search_similar_items
-from rag import generate_answer
-from config import DEBUG, SEARCH_SETTINGS, RAG_SETTINGS
+import time
+from db import get_items_sample, view_item_tree, view_root_items, iter_search_text, print_search_result, get_block_info_by_name, get_block_info_by_id, print_block_info, ensure_text_search_index, search_by_keywords
+from config import DEBUG, SEARCH_SETTINGS, RAG_SETTINGS, WARMUP_SETTINGS
 from debug_utils import confirm_action, debug_step
-from keywords import generate_keywords_for_query
-import db_analyzer
+from utils import StreamPrinter
+# retrieval, rag, keywords, hybrid_search и db_analyzer импортируются в функциях, которые их используют:
+# они тянут FlagEmbedding (torch, transformers), клиент OpenAI и tiktoken, а режимы -i, -s и -v
+# работают только с PostgreSQL и должны запускаться быстро (см. import_report.py и test_startup.py)
 
 def convert_item_format(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     """Преобразует формат элементов из БД в формат, ожидаемый retrieval.py"""
@@ -21,11 +22,49 @@ def convert_item_format(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
                 'parents': item.get('parents', []),
                 'children': item.get('children', [])
             }
+            # Оценки поиска нужны первому этапу каскадного реранжирования
+            for field in ('rrf_score', 'similarity'):
+                if field in item:
+                    converted_item[field] = item[field]
             converted.append(converted_item)
         else:
             logger.warning(f"Пропущен элемент с некорректным форматом: {item}")
     return converted
 
+def select_relevant_items(query: str, items: List[Dict[str, Any]], top_k: int,
+                          mmr_stats: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+    """Реранжирует элементы и, если включен MMR, выбирает из лучших top_k непохожих друг на друга"""
+    from retrieval import rerank_items as search_similar_items
+    if not SEARCH_SETTINGS.get('mmr_enabled', True):
+        return search_similar_items(query, items, top_k)
+    from mmr import diversify
+    candidates = search_similar_items(query, items, top_k * SEARCH_SETTINGS.get('mmr_pool_factor', 3))
+    return diversify(candidates, top_k, stats=mmr_stats)
+
+def generate_answer_logged(query: str, relevant_items: List[Dict[str, Any]], mmr_stats: Dict[str, Any],
+                           on_token: Callable[[str], None] = None) -> str:
+    """Генерирует ответ и пишет в лог размер контекста (с MMR и без) и время ответа"""
+    from rag import generate_answer
+    logger = logging.getLogger('process_query')
+    start = time.perf_counter()
+    answer_stats: Dict[str, Any] = {}
+    answer = generate_answer(query, relevant_items, on_token=on_token, stats=answer_stats)
+    elapsed = time.perf_counter() - start
+    source = f" (из кэша: {answer_stats['cache']})" if answer_stats.get('cache') else ''
+    compression = answer_stats.get('compression')
+    if compression:
+        source += (f", сжатие контекста {compression['tokens_before']} -> {compression['tokens_after']} токенов "
+                   f"({compression['ratio']:.0%}) за {compression['elapsed_ms']:.1f} мс")
+    packing = answer_stats.get('packing')
+    if packing:
+        source += f", в промпте {packing['tokens']} из {packing['baseline_tokens']} токенов контекста"
+    if mmr_stats:
+        logger.info(f"Контекст: {mmr_stats['tokens']} токенов (без MMR {mmr_stats['baseline_tokens']}, "
+                    f"векторы: {mmr_stats['vectors']}), ответ за {elapsed:.2f} с{source}")
+    else:
+        logger.info(f"Ответ за {elapsed:.2f} с{source}")
+    return answer
+
 def setup_logging(debug: bool):
     """Настройка логгирования"""
     level = logging.DEBUG if debug else logging.INFO
@@ -34,7 +73,8 @@ def setup_logging(debug: bool):
         format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
     )
 
-def process_query(query: str, sample_size: int = None, top_k: int = None, root_id: str = None) -> str:
+def process_query(query: str, sample_size: int = None, top_k: int = None, root_id: str = None,
+                  on_token: Callable[[str], None] = None) -> str:
     """
     Обрабатывает пользовательский запрос
     """
@@ -56,7 +96,8 @@ def process_query(query: str, sample_size: int = None, top_k: int = None, root_i
     
     # Ищем релевантные элементы
     logger.debug(f"Ищем {top_k} релевантных элементов")
-    relevant_items = search_similar_items(query, converted_items, top_k)
+    mmr_stats = {}
+    relevant_items = select_relevant_items(query, converted_items, top_k, mmr_stats)
     logger.debug(f"Найдено {len(relevant_items)} релевантных элементов")
     
     # В режиме отладки показываем найденные элементы
@@ -75,15 +116,24 @@ def process_query(query: str, sample_size: int = None, top_k: int = None, root_i
     
     # Генерируем ответ
     logger.debug("Генерируем ответ")
-    answer = generate_answer(query, relevant_items)
+    answer = generate_answer_logged(query, relevant_items, mmr_stats, on_token)
     logger.debug("Ответ получен")
     
     return answer
 
-def process_query_with_keywords(query: str, keywords: List[str], top_k: int = None, root_id: str = None, parent_context: int = 0, child_context: int = 0) -> str:
+def process_query_with_keywords(query: str, keywords: Optional[List[str]], top_k: int = None, root_id: str = None, parent_context: int = 0, child_context: int = 0,
+                                on_token: Callable[[str], None] = None,
+                                on_keywords: Callable[[List[str]], None] = None,
+                                search_stats: Dict[str, Any] = None) -> str:
     """
     Обрабатывает пользовательский запрос с использованием ключевых слов для поиска контекста
+
+    Если keywords равен None, ключевые слова генерируются LLM; при включенном
+    SEARCH_SETTINGS['pipeline_enabled'] - параллельно с поиском (pipeline.py),
+    и on_keywords вызывается с ними, как только они готовы. Использованные
+    ключевые слова записываются в search_stats['keywords'].
     """
+    from hybrid_search import hybrid_search
     logger = logging.getLogger('process_query')
     
     # Используем значения из настроек, если не указаны явно
@@ -93,7 +143,32 @@ def process_query_with_keywords(query: str, keywords: List[str], top_k: int = No
     # Получаем выборку элементов на основе ключевых слов
     logger.debug(f"Поиск элементов по ключевым словам: {keywords}")
     ensure_text_search_index()  # Создаем индекс, если его нет
-    items = search_by_keywords(keywords, SEARCH_SETTINGS['sample_size'], root_id, max_depth=0)  # Явно передаем max_depth=0
+    # Глубина контекста из --parent-context/--child-context; контекст всех найденных
+    # элементов забирается пакетно, поэтому число запросов к БД не зависит от числа элементов
+    context_depth = {}
+    if parent_context or child_context:
+        context_depth = {'parent_depth': parent_context, 'child_depth': child_context}
+    if search_stats is None:
+        search_stats = {}
+    hybrid = SEARCH_SETTINGS.get('hybrid_enabled', True)
+    if hybrid and SEARCH_SETTINGS.get('pipeline_enabled', True):
+        # Генерация ключевых слов, эмбеддинг запроса и ветви поиска - одним графом задач
+        from pipeline import search_pipeline
+        items = search_pipeline(query, keywords, root_id=root_id, on_keywords=on_keywords,
+                                stats=search_stats, **context_depth)
+        keywords = search_stats['keywords']
+    else:
+        if keywords is None:
+            from keywords import generate_keywords_for_query
+            keywords = generate_keywords_for_query(query)
+            if on_keywords is not None:
+                on_keywords(keywords)
+        search_stats['keywords'] = keywords
+        if hybrid:
+            # Полнотекстовый, BM25, векторный и ILIKE-поиск параллельно, объединение через RRF
+            items = hybrid_search(query, keywords, root_id=root_id, **context_depth)
+        else:
+            items = search_by_keywords(keywords, SEARCH_SETTINGS['sample_size'], root_id, max_depth=0, **context_depth)  # Явно передаем max_depth=0
     logger.debug(f"Найдено {len(items)} элементов по ключевым словам")
     
     # Создаем словарь для быстрого поиска ID по тексту
@@ -119,7 +194,7 @@ def process_query_with_keywords(query: str, keywords: List[str], top_k: int = No
     # Если по ключевым словам ничего не найдено, используем стандартную выборку
     if not items:
         logger.debug(f"По ключевым словам ничего не найдено, используем стандартную выборку")
-        items = get_items_sample(1, SEARCH_SETTINGS['sample_size'], root_id=root_id)
+        items = get_items_sample(1, SEARCH_SETTINGS['sample_size'], root_id=root_id, **context_depth)
     
     # Преобразуем формат элементов
     converted_items = convert_item_format(items)
@@ -129,7 +204,8 @@ def process_query_with_keywords(query: str, keywords: List[str], top_k: int = No
     
     # Ищем релевантные элементы
     logger.debug(f"Ищем {top_k} релевантных элементов")
-    relevant_items = search_similar_items(query, converted_items, top_k)
+    mmr_stats = {}
+    relevant_items = select_relevant_items(query, converted_items, top_k, mmr_stats)
     logger.debug(f"Найдено {len(relevant_items)} релевантных элементов")
     
     # В режиме отладки показываем найденные элементы
@@ -158,7 +234,7 @@ def process_query_with_keywords(query: str, keywords: List[str], top_k: int = No
     
     # Генерируем ответ
     logger.debug("Генерируем ответ")
-    answer = generate_answer(query, relevant_items)
+    answer = generate_answer_logged(query, relevant_items, mmr_stats, on_token)
     logger.debug("Ответ получен")
     
     return answer
@@ -309,6 +385,12 @@ def main():
             
         return  # Завершаем работу после просмотра информации
     
+    # Прогрев моделей и подключений в фоне, пока пользователь смотрит дерево и вводит вопрос;
+    # служебные режимы завершаются до диалога, прогрев им не нужен
+    if not (args.clear_cache or args.preload or args.migrate or args.rebuild_tables or args.clear_invalid):
+        from warmup import start_warmup
+        start_warmup()
+    
     # Используем пользовательские корневые маркеры
     root_markers = args.roots if args.roots else None
     
@@ -325,9 +407,11 @@ def main():
     
     if args.search:
         print(f"\nПоиск: '{args.search}'")
-        results = search_text(args.search, args.context)
-        if results:
-            print_search_results(results)
+        # Результаты выводятся по мере получения из серверного курсора
+        found = 0
+        for found, result in enumerate(iter_search_text(args.search, args.context), 1):
+            print_search_result(found, result)
+        if found:
             if confirm_action("\nИспользовать один из найденных элементов как корневой? (да/нет): "):
                 args.block_id = input("ID: ").strip()
         else:
@@ -443,31 +527,22 @@ def main():
             # Запрос ключевых слов - показываем последние ключевые слова в скобках
             keywords_prompt = input(f"Введите ключевые слова или фразы через запятую для поиска контекста [{last_keywords}]: ").strip()
             
-            # Автоматическая генерация ключевых слов при вводе "!"
-            if keywords_prompt == "!":
+            # Автоматическая генерация ключевых слов при вводе "!": ключевые слова
+            # генерируются во время поиска (None), а печатаются, как только готовы
+            auto_keywords = keywords_prompt == "!"
+            if auto_keywords:
                 logger.info("Запрос автоматической генерации ключевых слов")
-                try:
-                    # Получаем ключевые слова через GPT
-                    generated_keywords = generate_keywords_for_query(query)
-                    keywords_prompt = ", ".join(generated_keywords)
-                    print(f"\nАвтоматически сгенерированные ключевые слова: {keywords_prompt}")
-                    
-                    # Обновляем last_keywords для следующего запроса
-                    last_keywords = keywords_prompt
-                except Exception as e:
-                    logger.error(f"Ошибка при генерации ключевых слов: {str(e)}")
-                    print("Не удалось сгенерировать ключевые слова автоматически.")
-                    continue
-            
-            # Если пользователь не ввел ключевые слова, используем последние
-            if not keywords_prompt:
-                keywords_prompt = last_keywords
+                keywords = None
             else:
-                # Запоминаем новые ключевые слова для следующего запроса
-                last_keywords = keywords_prompt
-                
-            # Разбиваем строку на отдельные ключевые слова
-            keywords = [keyword.strip() for keyword in keywords_prompt.split(',') if keyword.strip()]
+                # Если пользователь не ввел ключевые слова, используем последние
+                if not keywords_prompt:
+                    keywords_prompt = last_keywords
+                else:
+                    # Запоминаем новые ключевые слова для следующего запроса
+                    last_keywords = keywords_prompt
+                    
+                # Разбиваем строку на отдельные ключевые слова
+                keywords = [keyword.strip() for keyword in keywords_prompt.split(',') if keyword.strip()]
             
             # Показываем список активных ключевых слов
             if keywords:
@@ -476,31 +551,52 @@ def main():
                     print(f"  {i}. {keyword}")
                 print()  # Пустая строка для разделения
             
+            # Ответ печатается по мере генерации; заголовок - перед первым фрагментом
+            printer = StreamPrinter("\nОтвет: ")
             try:
+                from warmup import get_warmup
+                warmup = get_warmup()
+                if warmup and not warmup.is_ready():
+                    # Незавершенный прогрев не повторяем, а дожидаемся
+                    logger.debug(f"Ожидание прогрева: {warmup.status()}")
+                    warmup.wait(WARMUP_SETTINGS.get('wait_timeout', 120))
                 logger.debug(f"Обработка запроса: {query}")
                 logger.debug(f"Ключевые слова: {keywords}")
                 
-                if keywords:
+                if keywords or auto_keywords:
+                    search_stats = {}
                     # Больше не нужно преобразовывать keywords в список, он уже список
                     answer = process_query_with_keywords(
                         query, 
                         keywords,  # Используем уже подготовленный список keywords
                         root_id=args.block_id,
                         parent_context=args.parent_context,
-                        child_context=args.child_context
+                        child_context=args.child_context,
+                        on_token=printer,
+                        on_keywords=lambda words: print(f"\nАвтоматически сгенерированные ключевые слова: {', '.join(words)}"),
+                        search_stats=search_stats
                     )
+                    if auto_keywords and search_stats.get('keywords'):
+                        # Обновляем last_keywords для следующего запроса
+                        last_keywords = ", ".join(search_stats['keywords'])
                 else:
                     print("Не указаны ключевые слова. Используйте ключевые слова для поиска релевантного контекста.")
                     continue
                 
-                print("\nОтвет:", answer)
+                if printer.started:
+                    printer.finish()
+                else:
+                    print("\nОтвет:", answer)
             except Exception as e:
+                # Уже напечатанная часть ответа закрывается пометкой, чтобы ошибка не слилась с ней
+                printer.finish(interrupted=True)
                 logger.error(f"Ошибка при обработке запроса: {str(e)}", exc_info=args.debug or args.debug_extended)
                 print(f"\nПроизошла ошибка: {str(e)}")
 
     # Выводим отладочную информацию о БД только в расширенном режиме отладки
     if args.debug_extended:
         try:
+            import db_analyzer
             print("\nОтладочная информация о базе данных:")
             db_analyzer.analyze_database(verbose=True)
         except Exception as e:
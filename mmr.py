@@ -0,0 +1,134 @@
+"""
+Разнообразие итогового контекста методом Maximal Marginal Relevance
+
+semantic_chunking дает перекрывающиеся чанки, а в дереве много почти
+одинаковых соседних блоков, поэтому лучшие по релевантности элементы часто
+повторяют друг друга. MMR выбирает элементы по одному, максимизируя
+
+    lambda * релевантность - (1 - lambda) * max сходство с уже выбранными
+
+Матрица сходства кандидатов считается один раз (NumPy), дальше каждый шаг -
+векторные операции над строкой матрицы. Векторы - сохраненные эмбеддинги
+элементов, а если их нет хотя бы у одного кандидата - мешок стемов (tokenize).
+"""
+import logging
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from config import SEARCH_SETTINGS
+
+logger = logging.getLogger(__name__)
+
+# Поля с оценкой релевантности, в порядке предпочтения
+RELEVANCE_FIELDS = ('rerank_score', 'similarity', 'rrf_score')
+
+def relevance_scores(items: List[Dict[str, Any]]) -> np.ndarray:
+    """
+    Релевантность кандидатов, приведенная к [0, 1]
+
+    Берется первое поле из RELEVANCE_FIELDS, которое есть у всех элементов;
+    если такого нет, релевантность убывает с позицией в списке.
+    """
+    for field in RELEVANCE_FIELDS:
+        if all(isinstance(item.get(field), (int, float)) for item in items):
+            scores = np.array([item[field] for item in items], dtype=np.float64)
+            break
+    else:
+        scores = -np.arange(len(items), dtype=np.float64)
+    spread = scores.max() - scores.min() if len(scores) else 0.0
+    return (scores - scores.min()) / spread if spread > 0 else np.ones(len(items))
+
+def lexical_vectors(texts: List[str]) -> np.ndarray:
+    """Нормированные векторы частот стемов (для кандидатов без эмбеддингов)"""
+    from tokenization import tokenize
+    documents = [tokenize(text) for text in texts]
+    vocabulary = {term: i for i, term in enumerate(sorted({term for doc in documents for term in doc}))}
+    vectors = np.zeros((len(texts), max(1, len(vocabulary))), dtype=np.float64)
+    for row, doc in enumerate(documents):
+        for term in doc:
+            vectors[row, vocabulary[term]] += 1.0
+    return vectors
+
+def similarity_matrix(vectors: np.ndarray) -> np.ndarray:
+    """Косинусное сходство всех пар строк"""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    normalized = vectors / np.where(norms == 0, 1.0, norms)
+    return normalized @ normalized.T
+
+def mmr_select(relevance: np.ndarray, similarity: np.ndarray, k: int, lambda_mult: float) -> List[int]:
+    """
+    Выбирает k индексов методом MMR
+
+    Args:
+        relevance: Релевантность кандидатов (чем больше, тем лучше)
+        similarity: Матрица сходства кандидатов n x n
+        k: Сколько выбрать
+        lambda_mult: 1.0 - только релевантность, 0.0 - только разнообразие
+    """
+    count = len(relevance)
+    k = min(k, count)
+    selected: List[int] = []
+    # Максимальное сходство каждого кандидата с уже выбранными
+    max_similarity = np.zeros(count)
+    available = np.ones(count, dtype=bool)
+    for _ in range(k):
+        scores = lambda_mult * relevance - (1.0 - lambda_mult) * max_similarity
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        np.maximum(max_similarity, similarity[best], out=max_similarity)
+    return selected
+
+def _item_vectors(items: List[Dict[str, Any]]) -> Optional[np.ndarray]:
+    """Сохраненные эмбеддинги кандидатов или None, если хотя бы одного нет"""
+    from db import get_item_embeddings
+    try:
+        embeddings = get_item_embeddings([item['id'] for item in items])
+    except Exception as e:
+        logger.warning(f"Не удалось получить эмбеддинги для MMR: {str(e)}")
+        return None
+    if any(not embeddings.get(item['id']) for item in items):
+        return None
+    return np.array([embeddings[item['id']] for item in items], dtype=np.float64)
+
+def diversify(items: List[Dict[str, Any]], top_k: int, lambda_mult: float = None,
+              stats: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+    """
+    Выбирает top_k разнообразных элементов из кандидатов после реранжирования
+
+    Args:
+        items: Кандидаты в формате retrieval ('id', 'text', оценки релевантности)
+        top_k: Сколько элементов оставить
+        lambda_mult: Баланс релевантности и разнообразия (None = SEARCH_SETTINGS['mmr_lambda'])
+        stats: Словарь, в который записываются источник векторов ('vectors'),
+               число токенов контекста без MMR и с MMR ('baseline_tokens', 'tokens')
+
+    Returns:
+        Выбранные элементы в порядке выбора MMR
+    """
+    if lambda_mult is None:
+        lambda_mult = SEARCH_SETTINGS.get('mmr_lambda', 0.7)
+    if len(items) <= 1:
+        return items[:top_k]
+
+    vectors = _item_vectors(items) if SEARCH_SETTINGS.get('mmr_use_embeddings', True) else None
+    source = 'embeddings'
+    if vectors is None:
+        vectors = lexical_vectors([item['text'] for item in items])
+        source = 'lexical'
+
+    relevance = relevance_scores(items)
+    selected = [items[i] for i in mmr_select(relevance, similarity_matrix(vectors), top_k, lambda_mult)]
+
+    if stats is not None:
+        from rag import num_tokens_from_string
+        baseline = [items[i] for i in np.argsort(-relevance, kind='stable')[:top_k]]
+        stats.update({
+            'vectors': source,
+            'candidates': len(items),
+            'baseline_tokens': sum(num_tokens_from_string(item['text']) for item in baseline),
+            'tokens': sum(num_tokens_from_string(item['text']) for item in selected),
+        })
+    return selected
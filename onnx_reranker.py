@@ -0,0 +1,100 @@
+"""
+Реранжировщик bge на ONNX Runtime для CPU
+
+Использует ONNX-экспорт того же кросс-энкодера, что и FlagReranker
+(например, `optimum-cli export onnx --model BAAI/bge-reranker-base <каталог>`),
+из локального каталога с model.onnx и tokenizer.json. При quantize=True
+модель один раз квантуется динамически в int8 (model.int8.onnx рядом
+с исходной) и дальше загружается уже квантованной.
+
+compute_score совместим с FlagReranker.compute_score: возвращает логиты
+(или сигмоиду при normalize=True) списком, а для одной пары - числом.
+"""
+import logging
+import os
+from typing import List, Sequence, Union
+
+import numpy as np
+
+from config import RERANKER_SETTINGS
+
+logger = logging.getLogger(__name__)
+
+def quantize_model(model_path: str) -> str:
+    """Квантует model.onnx в int8 (динамически), если это еще не сделано; возвращает путь"""
+    source = os.path.join(model_path, 'model.onnx')
+    target = os.path.join(model_path, 'model.int8.onnx')
+    if not os.path.exists(target) or os.path.getmtime(target) < os.path.getmtime(source):
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        logger.info(f"Квантование {source} в int8")
+        quantize_dynamic(source, target, weight_type=QuantType.QInt8)
+    return target
+
+class OnnxReranker:
+    """Кросс-энкодер на ONNX Runtime с интерфейсом FlagReranker.compute_score"""
+    def __init__(self, model_path: str = None, quantize: bool = None, intra_op_threads: int = None,
+                 max_length: int = None):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        self.model_path = model_path or RERANKER_SETTINGS['onnx_model_path']
+        if quantize is None:
+            quantize = RERANKER_SETTINGS.get('onnx_quantize', True)
+        if intra_op_threads is None:
+            intra_op_threads = RERANKER_SETTINGS.get('intra_op_threads', 0)
+        self.max_length = max_length or RERANKER_SETTINGS.get('max_length', 512)
+
+        model_file = quantize_model(self.model_path) if quantize else os.path.join(self.model_path, 'model.onnx')
+        options = ort.SessionOptions()
+        # 0 - число потоков выбирает сам ONNX Runtime
+        options.intra_op_num_threads = intra_op_threads
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(model_file, options, providers=['CPUExecutionProvider'])
+        self.input_names = {node.name for node in self.session.get_inputs()}
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(self.model_path, 'tokenizer.json'))
+        self.tokenizer.enable_truncation(max_length=self.max_length)
+        # Без обрезки: для подсчета длины текстов при пакетировании (length_batching.py)
+        self.text_tokenizer = Tokenizer.from_file(os.path.join(self.model_path, 'tokenizer.json'))
+        logger.info(f"ONNX реранжировщик загружен: {model_file}, потоков: {intra_op_threads or 'авто'}")
+
+    def _encode(self, pairs: Sequence[Sequence[str]]):
+        encodings = self.tokenizer.encode_batch([(query, text) for query, text in pairs])
+        width = max(len(encoding.ids) for encoding in encodings)
+        input_ids = np.zeros((len(encodings), width), dtype=np.int64)
+        attention_mask = np.zeros((len(encodings), width), dtype=np.int64)
+        token_type_ids = np.zeros((len(encodings), width), dtype=np.int64)
+        pad_id = self.tokenizer.token_to_id('<pad>') or 0
+        input_ids.fill(pad_id)
+        for row, encoding in enumerate(encodings):
+            length = len(encoding.ids)
+            input_ids[row, :length] = encoding.ids
+            attention_mask[row, :length] = 1
+            token_type_ids[row, :length] = encoding.type_ids
+        inputs = {'input_ids': input_ids, 'attention_mask': attention_mask}
+        if 'token_type_ids' in self.input_names:
+            inputs['token_type_ids'] = token_type_ids
+        return inputs
+
+    def compute_score(self, pairs, batch_size: int = 64, normalize: bool = False) -> Union[float, List[float]]:
+        """
+        Оценивает пары (запрос, текст)
+
+        Args:
+            pairs: Список пар [запрос, текст] или одна пара
+            batch_size: Размер пакета для одного запуска модели
+            normalize: Применить сигмоиду к логитам
+
+        Returns:
+            Список оценок в порядке пар или число для одной пары
+        """
+        single = len(pairs) == 2 and isinstance(pairs[0], str)
+        if single:
+            pairs = [pairs]
+        scores = []
+        for start in range(0, len(pairs), batch_size):
+            logits = self.session.run(None, self._encode(pairs[start:start + batch_size]))[0]
+            scores.extend(np.asarray(logits, dtype=np.float64).reshape(len(logits), -1)[:, 0].tolist())
+        if normalize:
+            scores = [float(1.0 / (1.0 + np.exp(-score))) for score in scores]
+        return scores[0] if single else scores
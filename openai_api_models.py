@@ -1,7 +1,9 @@
 #4566b621-926d-4405-82a1-f76728e8d93f
 from openai import OpenAI
 from config import OPENAI_API_KEY, MODELS
+from typing import Any, Callable, Dict, Iterator, List, Optional
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 
@@ -11,6 +13,76 @@ client = OpenAI(
     timeout=60.0  # Увеличиваем таймаут до 60 секунд
 )
 
+def iter_chat_completion(messages: List[Dict[str, str]], model: str = None, stats: Dict[str, Any] = None,
+                         api_client: OpenAI = None, **params) -> Iterator[str]:
+    """
+    Потоковая генерация: отдает фрагменты ответа по мере их поступления
+
+    После завершения потока в stats (если передан) записываются время до
+    первого токена ('ttft'), общее время ('total_time'), число токенов
+    ('tokens' - по числу фрагментов потока, обычно один токен на фрагмент)
+    и скорость генерации после первого токена ('tokens_per_sec').
+
+    Args:
+        messages: Сообщения чата
+        model: Модель (None = MODELS['generation']['name'])
+        stats: Словарь для статистики ответа
+        api_client: Клиент OpenAI (None = общий client)
+        **params: Остальные параметры chat.completions.create (temperature, max_tokens, ...)
+    """
+    api_client = api_client or client
+    start = time.perf_counter()
+    ttft = None
+    tokens = 0
+    stream = api_client.chat.completions.create(
+        model=model or MODELS['generation']['name'],
+        messages=messages,
+        stream=True,
+        **params
+    )
+    for chunk in stream:
+        if not chunk.choices:
+            continue
+        text = chunk.choices[0].delta.content
+        if text:
+            if ttft is None:
+                ttft = time.perf_counter() - start
+            tokens += 1
+            yield text
+
+    total_time = time.perf_counter() - start
+    generation_time = total_time - (ttft or 0.0)
+    if stats is not None:
+        stats.update({
+            'ttft': ttft,
+            'total_time': total_time,
+            'tokens': tokens,
+            'tokens_per_sec': tokens / generation_time if tokens and generation_time > 0 else None,
+        })
+
+def stream_chat_completion(messages: List[Dict[str, str]], on_token: Optional[Callable[[str], None]] = None,
+                           stats: Dict[str, Any] = None, **kwargs) -> str:
+    """
+    Потоковая генерация с обработчиком фрагментов; возвращает полный текст ответа
+
+    Args:
+        messages: Сообщения чата
+        on_token: Вызывается с каждым фрагментом ответа (например, для печати)
+        stats: Словарь для статистики ответа (см. iter_chat_completion)
+        **kwargs: Параметры iter_chat_completion
+    """
+    stats = {} if stats is None else stats
+    parts = []
+    for text in iter_chat_completion(messages, stats=stats, **kwargs):
+        parts.append(text)
+        if on_token:
+            on_token(text)
+    if stats.get('ttft') is not None:
+        logger.info(f"Ответ: первый токен через {stats['ttft']:.2f} с, {stats['tokens']} токенов "
+                    f"за {stats['total_time']:.2f} с" +
+                    (f" ({stats['tokens_per_sec']:.1f} ток/с)" if stats['tokens_per_sec'] else ""))
+    return ''.join(parts)
+
 def list_models():
     """Получает список доступных моделей"""
     try:
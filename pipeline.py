@@ -0,0 +1,162 @@
+"""
+Поиск кандидатов как граф зависимостей
+
+Раньше обработка шла последовательно: генерация ключевых слов (запрос к
+LLM), затем гибридный поиск, и ни эмбеддинг запроса, ни лексический поиск
+по самому запросу не начинались, пока не пришли ключевые слова. Здесь
+каждый шаг - задача графа, которая стартует, как только готовы ее входы:
+
+    generate_keywords -> keywords (ILIKE)
+    embedding         -> vector
+    fulltext, bm25       (по тексту запроса, без ожидания)
+    все ветви         -> RRF и контекст элементов (hybrid_search.fuse_results)
+
+Поэтому время до кандидатов - максимум, а не сумма вызова LLM и поиска.
+Если ключевые слова заданы пользователем, лексические ветви ищут по запросу
+вместе с ними, как в hybrid_search.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import Future, wait
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from config import SEARCH_SETTINGS
+
+logger = logging.getLogger(__name__)
+
+class Pipeline:
+    """
+    Граф задач: каждая задача выполняется в своем потоке, как только
+    завершились ее зависимости, и получает их результаты аргументами
+
+    Потоки отдельные, а не общий пул: задача, ждущая зависимость, занимает
+    поток, и в ограниченном пуле конкурентные запросы могли бы заблокировать
+    друг друга.
+    """
+    def __init__(self):
+        self.tasks: Dict[str, tuple] = {}
+        self.errors: Dict[str, str] = {}
+        # Имя задачи -> (начало, конец) в секундах от запуска графа
+        self.timings: Dict[str, tuple] = {}
+
+    def add(self, name: str, fn: Callable[..., Any], deps: Sequence[str] = ()) -> 'Pipeline':
+        """Добавляет задачу; зависимости должны быть добавлены раньше (граф без циклов)"""
+        for dep in deps:
+            if dep not in self.tasks:
+                raise ValueError(f"Задача {name} зависит от неизвестной задачи {dep}")
+        self.tasks[name] = (fn, tuple(deps))
+        return self
+
+    def run(self, timeout: float = None) -> Dict[str, Any]:
+        """
+        Выполняет граф и ждет его завершения не дольше timeout секунд
+
+        Returns:
+            Результаты успешно завершенных задач; ошибки (в том числе ошибки
+            зависимостей и 'timeout') записываются в self.errors
+        """
+        from db import carry_write_state
+        futures: Dict[str, Future] = {name: Future() for name in self.tasks}
+        start = time.perf_counter()
+
+        # Задачи читают с реплик так же, как читал бы вызывающий поток после своей записи
+        @carry_write_state
+        def worker(name: str):
+            fn, deps = self.tasks[name]
+            try:
+                args = [futures[dep].result() for dep in deps]
+                begin = time.perf_counter()
+                result = fn(*args)
+                self.timings[name] = (begin - start, time.perf_counter() - start)
+                futures[name].set_result(result)
+            except Exception as e:
+                futures[name].set_exception(e)
+
+        for name in self.tasks:
+            threading.Thread(target=worker, args=(name,), name=f'pipeline-{name}', daemon=True).start()
+        wait(futures.values(), timeout=timeout)
+
+        results = {}
+        for name, future in futures.items():
+            if not future.done():
+                self.errors[name] = 'timeout'
+            elif future.exception() is not None:
+                self.errors[name] = str(future.exception())
+            else:
+                results[name] = future.result()
+        return results
+
+def _generate_keywords(query: str, on_keywords: Optional[Callable[[List[str]], None]]) -> List[str]:
+    from keywords import generate_keywords_for_query
+    keywords = generate_keywords_for_query(query)
+    if on_keywords is not None:
+        on_keywords(keywords)
+    return keywords
+
+def _embed_query(query: str) -> List[float]:
+    from embeddings import get_embedding
+    return get_embedding(query)
+
+def search_pipeline(query: str, keywords: List[str] = None, root_id: str = None,
+                    parent_depth: int = 0, child_depth: int = 0,
+                    on_keywords: Callable[[List[str]], None] = None,
+                    stats: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+    """
+    Находит кандидатов, выполняя генерацию ключевых слов и ветви поиска параллельно
+
+    Args:
+        query: Запрос пользователя
+        keywords: Ключевые слова; None - выделить их generate_keywords_for_query параллельно с поиском
+        root_id: Ограничить поиск поддеревом
+        parent_depth: Глубина родительского контекста
+        child_depth: Глубина дочернего контекста
+        on_keywords: Вызывается со сгенерированными ключевыми словами, как только они готовы
+        stats: Словарь, в который записываются ключевые слова ('keywords'),
+               интервалы задач ('timings'), ошибки ('errors') и общее время ('time')
+
+    Returns:
+        Элементы в формате hybrid_search
+    """
+    from hybrid_search import BRANCHES, vector_search, fuse_results
+    weights = SEARCH_SETTINGS.get('hybrid_weights', {})
+    branch_limit = SEARCH_SETTINGS.get('hybrid_branch_limit', 50)
+    generate = keywords is None
+    # Сгенерированных ключевых слов лексические ветви не ждут
+    lexical_keywords = [] if generate else list(keywords)
+
+    def branch(name: str):
+        return lambda: BRANCHES[name](query, lexical_keywords, branch_limit, root_id)
+
+    pipeline = Pipeline()
+    pipeline.add('generate_keywords', (lambda: _generate_keywords(query, on_keywords)) if generate
+                 else (lambda: lexical_keywords))
+    for name in ('fulltext', 'bm25'):
+        if weights.get(name, 1.0) > 0:
+            pipeline.add(name, branch(name))
+    if weights.get('vector', 1.0) > 0:
+        pipeline.add('embedding', lambda: _embed_query(query))
+        pipeline.add('vector', lambda embedding: vector_search(embedding, branch_limit, root_id), ['embedding'])
+    if weights.get('keywords', 1.0) > 0:
+        pipeline.add('keywords', lambda words: BRANCHES['keywords'](query, words, branch_limit, root_id),
+                     ['generate_keywords'])
+
+    start = time.perf_counter()
+    results = pipeline.run(SEARCH_SETTINGS.get('hybrid_timeout', 10))
+    for name, error in pipeline.errors.items():
+        logger.warning(f"Задача поиска {name} не выполнена: {error}")
+
+    rankings = {name: results[name] for name in BRANCHES if name in results}
+    items = fuse_results(rankings, SEARCH_SETTINGS.get('hybrid_candidates', 30), parent_depth, child_depth)
+    elapsed = time.perf_counter() - start
+
+    logger.debug(f"Граф поиска: {pipeline.timings}, всего {elapsed:.3f} с, кандидатов {len(items)}")
+    if stats is not None:
+        stats.update({
+            'keywords': results.get('generate_keywords', lexical_keywords),
+            'timings': pipeline.timings,
+            'errors': pipeline.errors,
+            'time': elapsed,
+            'candidates': len(items),
+        })
+    return items
@@ -1,7 +1,7 @@
 from typing import List, Dict, Any
 import logging
 from config import SEARCH_SETTINGS, RAG_SETTINGS, DEBUG
-from db import get_items_sample
+from db import get_items_sample, get_items_with_context, search_by_keywords, ensure_text_search_index
 from embeddings import get_embedding, calculate_similarity, create_embedding_for_item
 from debug_utils import debug_step
 from retrieval import extract_text
@@ -20,7 +20,8 @@ def process_query_with_keywords(query: str, keywords: List[str], top_k: int = No
         # Получаем выборку элементов на основе ключевых слов
         logger.debug(f"Поиск элементов по ключевым словам: {keywords}")
         ensure_text_search_index()  # Создаем индекс, если его нет
-        items = search_by_keywords(keywords, SEARCH_SETTINGS['sample_size'], root_id)
+        # Контекст запрашивается ниже одним get_items_with_context и для результатов, и для выборки
+        items = search_by_keywords(keywords, SEARCH_SETTINGS['sample_size'], root_id, parent_depth=0, child_depth=0)
         logger.debug(f"Найдено {len(items)} элементов по ключевым словам")
         
         # Если по ключевым словам ничего не найдено, используем стандартную выборку
@@ -28,16 +29,14 @@ def process_query_with_keywords(query: str, keywords: List[str], top_k: int = No
             logger.debug(f"По ключевым словам ничего не найдено, используем стандартную выборку")
             items = get_items_sample(1, SEARCH_SETTINGS['sample_size'], root_id=root_id)
             
-        # Обогащаем каждый элемент контекстом в соответствии с параметрами
-        items_with_context = []
-        for item in items:
-            item_with_context = get_item_with_context(
-                item[0], 
-                parent_depth=parent_context,
-                child_depth=child_context
-            )
-            if item_with_context:
-                items_with_context.append(item_with_context)
+        # Обогащаем все элементы контекстом одним пакетным запросом на направление
+        item_ids = [item['item'][0] for item in items]
+        contexts = get_items_with_context(
+            item_ids,
+            parent_depth=parent_context,
+            child_depth=child_context
+        )
+        items_with_context = [contexts[item_id] for item_id in item_ids if item_id in contexts]
         
         # Ищем релевантные элементы
         logger.debug(f"Ищем {top_k} релевантных элементов")
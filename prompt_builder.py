@@ -0,0 +1,162 @@
+"""
+Сборка промпта с однократной токенизацией
+
+Раньше каждый контекст кодировался при обрезке, затем склеенный контекст и
+весь промпт кодировались еще раз, а generate_answer кодировал промпт снова,
+и на каждый вызов заново искался энкодер модели. Здесь энкодер кэшируется по
+модели, каждый контекст и запрос кодируются один раз, постоянные части
+шаблона - один раз за процесс. Длина промпта - сумма известных длин частей,
+обрезка - срез массива токенов (декодируется только обрезанный контекст).
+
+Части кодируются по отдельности, поэтому на стыках BPE может склеить токены
+иначе, чем в целом промпте; сумма длин частей практически всегда не меньше
+числа токенов промпта, то есть оценка идет в безопасную сторону.
+"""
+import logging
+import threading
+from functools import lru_cache
+from string import Formatter
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from config import MODELS
+
+logger = logging.getLogger(__name__)
+
+# Формат одного контекста, разделитель между контекстами и между фрагментами одного контекста
+CONTEXT_HEADER = "Context {number}:\n"
+CONTEXT_SEPARATOR = "\n\n"
+SPAN_SEPARATOR = "\n...\n"
+
+# Фрагменты контекста: список (начало, конец) в токенах
+Spans = List[Tuple[int, int]]
+
+_encoders: Dict[str, Any] = {}
+_encoders_lock = threading.Lock()
+
+def get_encoder(model: str = None):
+    """Возвращает энкодер tiktoken для модели (создается один раз на процесс)"""
+    model = model or MODELS['generation']['name']
+    encoder = _encoders.get(model)
+    if encoder is None:
+        import tiktoken
+        with _encoders_lock:
+            encoder = _encoders.get(model)
+            if encoder is None:
+                try:
+                    encoder = tiktoken.encoding_for_model(model)
+                except KeyError:
+                    logger.warning(f"Модель {model} не найдена, используем gpt-3.5-turbo")
+                    encoder = tiktoken.encoding_for_model("gpt-3.5-turbo")
+                _encoders[model] = encoder
+    return encoder
+
+@lru_cache(maxsize=1024)
+def _fixed_length(encoder, text: str) -> int:
+    """Число токенов постоянной части промпта (фрагмент шаблона, заголовок, разделитель)"""
+    return len(encoder.encode(text)) if text else 0
+
+class PromptBuilder:
+    """
+    Промпт из шаблона с полями {context} и {query}
+
+    Контексты и запрос кодируются в конструкторе; render собирает промпт
+    любого размера без повторной токенизации.
+    """
+    def __init__(self, template: str, query: str, contexts: Sequence[str],
+                 max_context_tokens: int = None, model: str = None, encoder=None,
+                 context_tokens: Sequence[Optional[List[int]]] = None):
+        """
+        Args:
+            template: Шаблон промпта с полями {context} и {query}
+            query: Вопрос пользователя
+            contexts: Тексты контекстов в порядке включения
+            max_context_tokens: Максимум токенов на один контекст (None - без ограничения)
+            model: Модель, по которой выбирается энкодер
+            encoder: Энкодер с методами encode/decode (по умолчанию get_encoder(model))
+            context_tokens: Уже известные токены контекстов тем же энкодером
+                            (например, из context_compressor); None - закодировать текст
+        """
+        self.encoder = encoder or get_encoder(model)
+        self.template = template
+        self.query = query
+        self.contexts = list(contexts)
+        self.max_context_tokens = max_context_tokens
+        # Токены каждого контекста целиком: обрезка - срез этих массивов
+        known = context_tokens if context_tokens is not None else [None] * len(self.contexts)
+        self.context_tokens: List[List[int]] = [
+            tokens if tokens is not None else self.encoder.encode(text)
+            for text, tokens in zip(self.contexts, known)
+        ]
+        fields = [(literal, field) for literal, field, _, _ in Formatter().parse(template)]
+        query_length = len(self.encoder.encode(query))
+        self.fixed_tokens = sum(_fixed_length(self.encoder, literal) for literal, _ in fields) + \
+            query_length * sum(1 for _, field in fields if field == 'query')
+        self.last_stats: Dict[str, int] = {}
+        self.last_context = ''
+
+    def context_lengths(self) -> List[int]:
+        """Длины контекстов в токенах с учетом max_context_tokens"""
+        limit = self.max_context_tokens
+        return [len(tokens) if limit is None else min(len(tokens), limit) for tokens in self.context_tokens]
+
+    def overhead(self, position: int) -> int:
+        """Токены заголовка контекста с номером position (с 0) и разделителя перед ним"""
+        header = _fixed_length(self.encoder, CONTEXT_HEADER.format(number=position + 1))
+        return header + (_fixed_length(self.encoder, CONTEXT_SEPARATOR) if position else 0)
+
+    def span_separator_tokens(self) -> int:
+        return _fixed_length(self.encoder, SPAN_SEPARATOR)
+
+    def context_text(self, index: int, spans: Spans) -> str:
+        """Текст выбранных фрагментов контекста (целый текст не декодируется)"""
+        tokens = self.context_tokens[index]
+        if spans == [(0, len(tokens))]:
+            return self.contexts[index]
+        return SPAN_SEPARATOR.join(self.encoder.decode(tokens[start:end]) for start, end in spans)
+
+    def render(self, max_tokens: int = None) -> Tuple[str, int]:
+        """
+        Собирает промпт не длиннее max_tokens токенов
+
+        Шаблон и вопрос сохраняются целиком; контексты включаются по порядку,
+        последний поместившийся обрезается, остальные отбрасываются.
+
+        Returns:
+            (промпт, число токенов в нем)
+        """
+        selected: List[Tuple[int, int]] = []
+        used = self.fixed_tokens
+        for index, length in enumerate(self.context_lengths()):
+            cost = self.overhead(len(selected))
+            if max_tokens is not None:
+                length = min(length, max_tokens - used - cost)
+                if length <= 0:
+                    break
+            selected.append((index, [(0, length)]))
+            used += cost + length
+        return self.assemble(selected), used
+
+    def assemble(self, selected: Sequence[Tuple[int, Spans]]) -> str:
+        """
+        Промпт из выбранных контекстов в заданном порядке
+
+        Args:
+            selected: Пары (индекс контекста, фрагменты в порядке следования)
+        """
+        context = CONTEXT_SEPARATOR.join(
+            CONTEXT_HEADER.format(number=position + 1) + self.context_text(index, spans)
+            for position, (index, spans) in enumerate(selected)
+        )
+        lengths = [sum(end - start for start, end in spans) for _, spans in selected]
+        self.last_stats = {
+            'contexts': len(selected),
+            'context_tokens': sum(lengths),
+            'tokens': self.fixed_tokens + sum(
+                self.overhead(position) + length + self.span_separator_tokens() * (len(spans) - 1)
+                for position, ((_, spans), length) in enumerate(zip(selected, lengths))
+            ),
+            'truncated': sum(1 for (index, _), length in zip(selected, lengths)
+                             if length < len(self.context_tokens[index])),
+        }
+        self.last_context = context
+        return self.template.format(context=context, query=self.query)
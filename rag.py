@@ -1,27 +1,32 @@
+import json
 import logging
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Callable
 from openai import OpenAI
-from config import OPENAI_API_KEY, RAG_SETTINGS, MODELS
+from config import OPENAI_API_KEY, RAG_SETTINGS, MODELS, ANSWER_CACHE_SETTINGS, DEBUG
 from retrieval import rerank_items as search_similar_items
 from db import get_items_sample
-import tiktoken
+from prompt_builder import PromptBuilder, get_encoder
 from debug_utils import debug_step
-from openai_api_models import client
+from openai_api_models import client, stream_chat_completion
 from utils import timeit
+import time
 
 logger = logging.getLogger(__name__)
 
+SYSTEM_PROMPT = "Ты помощник, который отвечает на вопросы, используя предоставленный контекст."
+
+PROMPT_TEMPLATE = """Используй следующий контекст для ответа на вопрос. 
+Если информации недостаточно, скажи об этом.
+
+{context}
+
+Вопрос: {query}
+
+Ответ:"""
+
 def num_tokens_from_string(string: str, model: str = None) -> int:
     """Возвращает количество токенов в строке"""
-    if model is None:
-        model = MODELS['generation']['name']
-    try:
-        encoding = tiktoken.encoding_for_model(model)
-        return len(encoding.encode(string))
-    except KeyError:
-        logger.warning(f"Модель {model} не найдена, используем gpt-3.5-turbo")
-        encoding = tiktoken.encoding_for_model("gpt-3.5-turbo")
-        return len(encoding.encode(string))
+    return len(get_encoder(model).encode(string))
 
 def truncate_text(text: str, max_tokens: int = None) -> str:
     """Обрезает текст до указанного количества токенов"""
@@ -29,7 +34,7 @@ def truncate_text(text: str, max_tokens: int = None) -> str:
         max_tokens = MODELS['generation']['max_tokens']
         
     logger.debug(f"Обрезаем текст. Исходная длина: {len(text)} символов")
-    encoding = tiktoken.encoding_for_model(MODELS['generation']['name'])
+    encoding = get_encoder()
     tokens = encoding.encode(text)
     logger.debug(f"Количество токенов: {len(tokens)}")
     
@@ -40,55 +45,81 @@ def truncate_text(text: str, max_tokens: int = None) -> str:
     logger.debug(f"Текст обрезан. Новая длина: {len(truncated)} символов")
     return truncated
 
+# Настройки RAG_SETTINGS, от которых зависит собранный промпт (а значит, и ответ)
+PROMPT_SHAPING_SETTINGS = ('compression_enabled', 'compression_target_tokens', 'context_packing',
+                           'context_budget', 'pack_span_tokens')
+
+def answer_cache_params(gen_params: Dict[str, Any], context_params: Dict[str, Any]) -> tuple:
+    """
+    Модель, температура и описание промпта для ключа кэша ответов
+
+    Описание промпта - шаблоны и настройки его сборки: ответ, полученный при
+    других сжатии, упаковке или размере чанка, не выдается из кэша.
+    """
+    shaping = {name: RAG_SETTINGS.get(name) for name in PROMPT_SHAPING_SETTINGS}
+    shaping['chunk_size'] = context_params['chunk_size']
+    template = SYSTEM_PROMPT + PROMPT_TEMPLATE + json.dumps(shaping, sort_keys=True)
+    return MODELS['generation']['name'], gen_params['temperature'], template
+
 @timeit
-def generate_prompt(query: str, context_items: List[Dict[str, Any]]) -> str:
-    """Генерирует промпт для модели"""
+def prepare_prompt(query: str, context_items: List[Dict[str, Any]],
+                   context_params: Dict[str, Any] = None) -> PromptBuilder:
+    """
+    Токенизирует запрос и контексты один раз
+
+    Возвращает PromptBuilder: промпт нужного размера собирается его методами
+    render или assemble без повторной токенизации.
+
+    context_params: параметры контекста (chunk_size); None - запросить
+    их через debug_step('context') или взять из RAG_SETTINGS.
+    """
     logger.debug(f"Генерация промпта для запроса: {query}")
     
     # Получаем параметры контекста (возможно, обновленные пользователем)
-    context_params = debug_step('context') or RAG_SETTINGS
-    
-    # Ограничиваем количество токенов для каждого контекста
-    max_tokens_per_context = context_params['chunk_size']
-    context_texts = []
-    
-    for i, item in enumerate(context_items):
-        logger.debug(f"Обработка контекста {i+1}")
-        context = item['text']
-        truncated_context = truncate_text(context, max_tokens_per_context)
-        context_texts.append(f"Context {i+1}:\n{truncated_context}")
-    
-    context_str = "\n\n".join(context_texts)
-    total_tokens = num_tokens_from_string(context_str)
-    logger.debug(f"Общее количество токенов в контексте: {total_tokens}")
+    if context_params is None:
+        context_params = debug_step('context') or RAG_SETTINGS
     
-    prompt = f"""Используй следующий контекст для ответа на вопрос. 
-Если информации недостаточно, скажи об этом.
-
-{context_str}
-
-Вопрос: {query}
-
-Ответ:"""
+    # Каждый контекст ограничивается chunk_size токенов; токены сжатых контекстов уже посчитаны
+    return PromptBuilder(PROMPT_TEMPLATE, query, [item['text'] for item in context_items],
+                         max_context_tokens=context_params['chunk_size'],
+                         context_tokens=[item.get('tokens') for item in context_items])
 
-    # Отладка: показываем собранный контекст и промпт
+def show_prompt(builder: PromptBuilder, prompt: str):
+    """Отладка: показывает собранный контекст и промпт, который будет отправлен модели"""
+    logger.debug(f"Общее количество токенов в контексте: {builder.last_stats['context_tokens']}")
     debug_step('context', {
-        'context_count': len(context_texts),
-        'total_tokens': total_tokens,
-        'context': context_str
+        'context_count': builder.last_stats['contexts'],
+        'total_tokens': builder.last_stats['context_tokens'],
+        'context': builder.last_context
     })
-    
     debug_step('generation', {
         'model': MODELS['generation']['name'],
         'prompt': prompt,
-        'tokens': num_tokens_from_string(prompt)
+        'tokens': builder.last_stats['tokens']
     })
-    
+
+def generate_prompt(query: str, context_items: List[Dict[str, Any]]) -> str:
+    """Генерирует промпт для модели"""
+    builder = prepare_prompt(query, context_items)
+    prompt = builder.render()[0]
+    show_prompt(builder, prompt)
     return prompt
 
 @timeit
-def generate_answer(query: str, context_items: List[Dict[str, Any]]) -> str:
-    """Генерирует ответ на основе контекста"""
+def generate_answer(query: str, context_items: List[Dict[str, Any]], on_token: Callable[[str], None] = None,
+                    stats: Dict[str, Any] = None) -> str:
+    """
+    Генерирует ответ на основе контекста
+
+    Если передан on_token и включен RAG_SETTINGS['stream'], ответ генерируется
+    потоком: on_token вызывается с каждым фрагментом по мере поступления, а в
+    stats записываются время до первого токена и скорость генерации
+    (см. openai_api_models.iter_chat_completion). Возвращается полный текст.
+
+    Ответы кэшируются (answer_cache): при попадании API не вызывается,
+    готовый ответ передается в on_token целиком, а в stats['cache']
+    записывается уровень попадания ('exact' или 'semantic').
+    """
     logger.debug("Генерация ответа")
     
     # Проверяем, есть ли реальный контекст
@@ -103,40 +134,99 @@ def generate_answer(query: str, context_items: List[Dict[str, Any]]) -> str:
         logger.warning("Отсутствует релевантный контекст, используем более простую модель")
         return "Извините, в базе знаний не найдено информации по вашему запросу. Пожалуйста, уточните вопрос или используйте другие ключевые слова."
     
-    prompt = generate_prompt(query, context_items)
-    
-    # Получаем параметры генерации (возможно, обновленные пользователем)
+    # Получаем параметры генерации и контекста (возможно, обновленные пользователем)
     gen_params = debug_step('generation') or RAG_SETTINGS
+    context_params = debug_step('context') or RAG_SETTINGS
     
-    total_tokens = num_tokens_from_string(prompt)
-    logger.debug(f"Общее количество токенов в промпте: {total_tokens}")
-    
-    # Оставляем запас для ответа
+    # Ответ на тот же (или перефразированный) вопрос по тому же контексту;
+    # проверяется до сжатия и сборки промпта, которые при попадании не нужны
+    cache = None
+    cache_params = answer_cache_params(gen_params, context_params)
+    if ANSWER_CACHE_SETTINGS.get('enabled', True):
+        from answer_cache import get_answer_cache
+        cache = get_answer_cache()
+        cached = cache.get(query, context_items, *cache_params)
+        if cached is not None:
+            answer, level = cached
+            report = cache.report()
+            logger.info(f"Ответ из кэша ({level}), попаданий {report['hit_rate']:.0%}, "
+                        f"сэкономлено {report['saved_seconds']:.1f} с")
+            if stats is not None:
+                stats['cache'] = level
+            if on_token is not None and RAG_SETTINGS.get('stream', True):
+                on_token(answer)
+            return answer
+    
+    # Необязательное сжатие: из длинных контекстов остаются предложения, релевантные запросу
+    prompt_items = context_items
+    if RAG_SETTINGS.get('compression_enabled', False):
+        from context_compressor import compress_contexts
+        compression_stats: Dict[str, Any] = {}
+        prompt_items = compress_contexts(query, context_items, stats=compression_stats)
+        logger.debug(f"Сжатие контекста: {compression_stats}")
+        if stats is not None:
+            stats['compression'] = compression_stats
+    
+    builder = prepare_prompt(query, prompt_items, context_params)
+    
+    # Оставляем запас для ответа; вопрос и инструкции не обрезаются
     max_prompt_tokens = MODELS['generation']['max_tokens'] - gen_params['max_tokens']
-    if total_tokens > max_prompt_tokens:
-        logger.warning(f"Превышен безопасный лимит токенов: {total_tokens}")
-        prompt = truncate_text(prompt, max_prompt_tokens)
-        logger.debug("Промпт обрезан до безопасного размера")
+    if RAG_SETTINGS.get('context_packing', True):
+        from context_packer import pack_contexts
+        from mmr import relevance_scores
+        budget = max_prompt_tokens - builder.fixed_tokens
+        if RAG_SETTINGS.get('context_budget'):
+            budget = min(budget, RAG_SETTINGS['context_budget'])
+        pack_stats: Dict[str, Any] = {}
+        prompt = builder.assemble(pack_contexts(builder, relevance_scores(prompt_items), budget, stats=pack_stats))
+        total_tokens = builder.last_stats['tokens']
+        logger.debug(f"Упаковка контекста: {pack_stats}")
+        if stats is not None:
+            stats['packing'] = pack_stats
+    else:
+        prompt, total_tokens = builder.render(max_prompt_tokens)
+        if builder.last_stats['contexts'] < len(context_items) or builder.last_stats['truncated']:
+            logger.warning(f"Промпт обрезан до безопасного лимита токенов: {builder.last_stats}")
+    logger.debug(f"Общее количество токенов в промпте: {total_tokens}")
+    show_prompt(builder, prompt)
     
+    messages = [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
+    ]
     try:
-        response = client.chat.completions.create(
-            model=MODELS['generation']['name'],
-            messages=[
-                {"role": "system", "content": "Ты помощник, который отвечает на вопросы, используя предоставленный контекст."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=gen_params['temperature'],
-            max_tokens=gen_params['max_tokens']
-        )
-        logger.debug("Ответ получен от API")
-        
-        answer = response.choices[0].message.content
+        start = time.perf_counter()
+        if on_token is not None and RAG_SETTINGS.get('stream', True):
+            stream_stats = {} if stats is None else stats
+            answer = stream_chat_completion(
+                messages,
+                on_token=on_token,
+                stats=stream_stats,
+                temperature=gen_params['temperature'],
+                max_tokens=gen_params['max_tokens']
+            )
+            logger.debug("Потоковый ответ получен от API")
+        else:
+            response = client.chat.completions.create(
+                model=MODELS['generation']['name'],
+                messages=messages,
+                temperature=gen_params['temperature'],
+                max_tokens=gen_params['max_tokens']
+            )
+            logger.debug("Ответ получен от API")
+            
+            answer = response.choices[0].message.content
+            stream_stats = {}
+        if cache is not None and answer:
+            cache.put(query, context_items, *cache_params, answer, time.perf_counter() - start)
         
         # Оставить только этот один вызов в конце
         debug_step('generation', {
             'model': MODELS['generation']['name'],
-            'answer_tokens': num_tokens_from_string(answer),
-            'answer': answer
+            'answer_tokens': num_tokens_from_string(answer) if DEBUG['enabled'] else None,
+            'answer': answer,
+            **({'ttft': stream_stats['ttft'], 'tokens_per_sec': stream_stats['tokens_per_sec']}
+               if stream_stats.get('ttft') is not None else {})
         })
         
         return answer
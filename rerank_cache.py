@@ -0,0 +1,158 @@
+"""
+Кэш оценок кросс-энкодера
+
+Ключ - (хеш нормализованного запроса, text_hash документа, модель реранжировщика).
+Оценки хранятся в ограниченном LRU в памяти и, если включено
+RERANKER_SETTINGS['cache_persist'], в таблице rerank_scores.
+"""
+import hashlib
+import logging
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from config import RERANKER_SETTINGS
+
+logger = logging.getLogger(__name__)
+
+CacheKey = Tuple[str, str, str]
+
+def normalize_query(query: str) -> str:
+    """Приводит запрос к каноническому виду: нижний регистр, ё -> е, одиночные пробелы"""
+    return re.sub(r'\s+', ' ', query.lower().replace('ё', 'е')).strip()
+
+def query_hash(query: str) -> str:
+    """Возвращает SHA-256 хеш нормализованного запроса"""
+    return hashlib.sha256(normalize_query(query).encode('utf-8')).hexdigest()
+
+class RerankScoreCache:
+    """Потокобезопасный LRU-кэш оценок с необязательным хранением в БД"""
+    def __init__(self, max_size: int = None, persist: bool = None):
+        self.max_size = max_size if max_size is not None else RERANKER_SETTINGS.get('cache_size', 20000)
+        self.persist = persist if persist is not None else RERANKER_SETTINGS.get('cache_persist', False)
+        self._scores: "OrderedDict[CacheKey, float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._table_ready = False
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, keys: List[CacheKey]) -> Dict[CacheKey, float]:
+        """Возвращает найденные оценки; промахи памяти дочитываются из БД одним запросом"""
+        found = {}
+        missing = []
+        with self._lock:
+            for key in keys:
+                score = self._scores.get(key)
+                if score is None:
+                    missing.append(key)
+                else:
+                    self._scores.move_to_end(key)
+                    found[key] = score
+
+        if missing and self.persist:
+            stored = self._load(missing)
+            if stored:
+                self._remember(stored)
+                found.update(stored)
+
+        with self._lock:
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, scores: Dict[CacheKey, float]):
+        """Сохраняет оценки в памяти и, если включено, в БД"""
+        if not scores:
+            return
+        self._remember(scores)
+        if self.persist:
+            self._store(scores)
+
+    def clear(self):
+        with self._lock:
+            self._scores.clear()
+            self.hits = self.misses = 0
+
+    def __len__(self):
+        return len(self._scores)
+
+    def _remember(self, scores: Dict[CacheKey, float]):
+        with self._lock:
+            for key, score in scores.items():
+                self._scores[key] = score
+                self._scores.move_to_end(key)
+            while len(self._scores) > self.max_size:
+                self._scores.popitem(last=False)
+
+    # --- Хранение в БД ---
+
+    def _ensure_table(self):
+        """Создает таблицу rerank_scores на основном сервере; флаг ставится после фиксации"""
+        from db import get_connection
+        if self._table_ready:
+            return
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS rerank_scores (
+                        query_hash TEXT NOT NULL,
+                        text_hash TEXT NOT NULL,
+                        model TEXT NOT NULL,
+                        score DOUBLE PRECISION NOT NULL,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        PRIMARY KEY (query_hash, text_hash, model)
+                    )
+                """)
+        self._table_ready = True
+
+    def _load(self, keys: List[CacheKey]) -> Dict[CacheKey, float]:
+        from psycopg2.errors import UndefinedTable
+        from db import get_connection
+        result = {}
+        try:
+            # Обычно все ключи относятся к одному запросу и одной модели
+            groups: Dict[Tuple[str, str], List[str]] = {}
+            for q_hash, t_hash, model in keys:
+                groups.setdefault((q_hash, model), []).append(t_hash)
+            # Чтение не создает таблицу (это делает _store) и может идти на реплику
+            with get_connection(readonly=True) as conn:
+                with conn.cursor() as cur:
+                    for (q_hash, model), text_hashes in groups.items():
+                        cur.execute("""
+                            SELECT text_hash, score FROM rerank_scores
+                            WHERE query_hash = %s AND model = %s AND text_hash = ANY(%s)
+                        """, (q_hash, model, text_hashes))
+                        for t_hash, score in cur.fetchall():
+                            result[(q_hash, t_hash, model)] = float(score)
+        except UndefinedTable:
+            # Оценки еще ни разу не сохранялись
+            pass
+        except Exception as e:
+            logger.error(f"Ошибка при чтении кэша оценок реранжирования: {str(e)}")
+        return result
+
+    def _store(self, scores: Dict[CacheKey, float]):
+        from db import get_connection, _bulk_merge
+        try:
+            self._ensure_table()
+            with get_connection() as conn:
+                with conn.cursor() as cur:
+                    _bulk_merge(
+                        cur, 'rerank_scores',
+                        [('query_hash', 'text'), ('text_hash', 'text'), ('model', 'text'), ('score', 'float8')],
+                        ((q_hash, t_hash, model, score) for (q_hash, t_hash, model), score in scores.items()),
+                        conflict_columns=['query_hash', 'text_hash', 'model'],
+                        update_columns=['score']
+                    )
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении кэша оценок реранжирования: {str(e)}")
+
+_cache: Optional[RerankScoreCache] = None
+
+def get_rerank_cache() -> RerankScoreCache:
+    """Возвращает общий кэш оценок, создавая его при первом вызове"""
+    global _cache
+    if _cache is None:
+        _cache = RerankScoreCache()
+    return _cache
@@ -0,0 +1,121 @@
+"""
+Сервис реранжирования с динамическими микропакетами
+
+Один рабочий поток владеет моделью кросс-энкодера. Параллельные вызовы
+кладут свои пары (запрос, текст) в общую очередь; поток собирает их в пакет,
+пока в нем не наберется max_batch_size пар или не пройдет max_wait_ms с
+момента прихода первого запроса, запускает один compute_score на весь пакет
+и раздает оценки по futures вызывающих. Под нагрузкой модель работает
+крупными пакетами и не делит потоки CPU между конкурентными вызовами,
+а одиночный запрос ждет не дольше max_wait_ms.
+"""
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, List, Optional, Sequence, Tuple
+
+from config import RERANKER_SETTINGS
+
+logger = logging.getLogger(__name__)
+
+class RerankService:
+    """Рабочий поток, объединяющий пары конкурентных вызовов в микропакеты"""
+    def __init__(self, model_loader: Callable[[], object], max_batch_size: int = None, max_wait_ms: float = None):
+        """
+        Args:
+            model_loader: Функция, возвращающая модель с методом compute_score
+                          (вызывается в рабочем потоке перед каждым пакетом,
+                          поэтому должна сама кэшировать модель)
+            max_batch_size: Максимум пар в одном пакете
+            max_wait_ms: Сколько ждать пополнения пакета после первого запроса
+        """
+        self.model_loader = model_loader
+        self.max_batch_size = max_batch_size or RERANKER_SETTINGS.get('service_max_batch_size', 64)
+        if max_wait_ms is None:
+            max_wait_ms = RERANKER_SETTINGS.get('service_max_wait_ms', 5)
+        self.max_wait = max_wait_ms / 1000
+        self._queue: "queue.Queue[Optional[tuple]]" = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='rerank-service', daemon=True)
+        self._thread.start()
+        self.batches = 0
+        self.pairs = 0
+
+    def submit(self, pairs: Sequence[Sequence[str]]) -> Future:
+        """Ставит пары в очередь; future получит список оценок в порядке pairs"""
+        future = Future()
+        if not pairs:
+            future.set_result([])
+        else:
+            self._queue.put(([list(pair) for pair in pairs], future))
+        return future
+
+    def score(self, pairs: Sequence[Sequence[str]], timeout: float = None) -> List[float]:
+        """Оценивает пары и ждет результат"""
+        return self.submit(pairs).result(timeout)
+
+    def close(self):
+        """Останавливает рабочий поток после обработки уже поставленных запросов"""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _collect(self, first: tuple) -> Tuple[List[tuple], bool]:
+        """Добирает запросы к первому, пока пакет не заполнится или не истечет ожидание"""
+        batch = [first]
+        size = len(first[0])
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                request = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if request is None:
+                return batch, True
+            batch.append(request)
+            size += len(request[0])
+        return batch, False
+
+    def _run(self):
+        stop = False
+        while not stop:
+            first = self._queue.get()
+            if first is None:
+                break
+            batch, stop = self._collect(first)
+            # Запросы, которые уже отменены вызывающими, не считаем
+            batch = [(pairs, future) for pairs, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            all_pairs = [pair for pairs, _ in batch for pair in pairs]
+            try:
+                scores = self.model_loader().compute_score(all_pairs, batch_size=self.max_batch_size)
+                if isinstance(scores, (int, float)):
+                    # Для одной пары compute_score возвращает число, а не список
+                    scores = [scores]
+            except Exception as e:
+                logger.error(f"Ошибка реранжирования пакета из {len(all_pairs)} пар: {str(e)}")
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            self.batches += 1
+            self.pairs += len(all_pairs)
+            logger.debug(f"Пакет реранжирования: {len(batch)} запросов, {len(all_pairs)} пар")
+            offset = 0
+            for pairs, future in batch:
+                future.set_result([float(score) for score in scores[offset:offset + len(pairs)]])
+                offset += len(pairs)
+
+_service: Optional[RerankService] = None
+_service_lock = threading.Lock()
+
+def get_rerank_service(model_loader: Callable[[], object]) -> RerankService:
+    """Возвращает общий сервис реранжирования, создавая его при первом вызове"""
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = RerankService(model_loader)
+    return _service
@@ -1,16 +1,20 @@
 from openai_api_models import client as openai_client
 
 from typing import List, Dict, Any, Optional, Tuple
+import threading
+import time
 import numpy as np
 from rank_bm25 import BM25Okapi
 # from db import get_items_sample # Закомментировано, т.к. функция get_items_sample не используется в текущей реализации
-from embeddings import get_embedding, calculate_similarity # create_embedding_for_item - не используется здесь
-from config import SEARCH_SETTINGS, RAG_SETTINGS, DEBUG
+from embeddings import get_embedding, calculate_similarity, get_text_hash # create_embedding_for_item - не используется здесь
+from config import SEARCH_SETTINGS, RAG_SETTINGS, DEBUG, RERANKER_SETTINGS
+from rerank_cache import get_rerank_cache, query_hash
+from rerank_service import get_rerank_service
+from length_batching import bucketed
 from debug_utils import debug_step
 import logging
 from utils import timeit
 from config_db import get_threshold
-from FlagEmbedding import FlagReranker
 
 def validate_item(item: Dict[str, Any]) -> bool:
     """
@@ -60,8 +64,170 @@ def extract_text(item: Dict[str, Any]) -> Optional[str]:
 
 logger = logging.getLogger(__name__)
 
+def __getattr__(name: str):
+    """
+    Ленивый импорт FlagReranker: FlagEmbedding тянет за собой torch и transformers,
+    поэтому загружается при первом обращении, а не при импорте retrieval
+    """
+    if name == 'FlagReranker':
+        from FlagEmbedding import FlagReranker
+        globals()['FlagReranker'] = FlagReranker
+        return FlagReranker
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 # Кэш для модели реранжировщика
 _reranker_cache = None
+# Модель может загружаться одновременно прогревом (warmup.py) и первым запросом
+_reranker_lock = threading.Lock()
+
+def _get_reranker(model_name: str, max_retries: int = 3):
+    """Возвращает модель реранжировщика, загружая ее при первом вызове"""
+    global _reranker_cache
+    if _reranker_cache is not None:
+        return _reranker_cache
+    with _reranker_lock:
+        if _reranker_cache is None:
+            _load_reranker(model_name, max_retries)
+    return _reranker_cache
+
+def _load_reranker(model_name: str, max_retries: int):
+    global _reranker_cache
+    if _reranker_cache is None:
+        logger.debug(f"Initializing reranker model: {model_name}")
+        for attempt in range(max_retries):
+            try:
+                if RERANKER_SETTINGS.get('backend', 'flag') == 'onnx':
+                    from onnx_reranker import OnnxReranker
+                    _reranker_cache = OnnxReranker()
+                else:
+                    # use_fp16=True может ускорить, но требует совместимого GPU
+                    # Через атрибут модуля, чтобы работала ленивая загрузка (и подмена в тестах)
+                    flag_reranker = globals().get('FlagReranker') or __getattr__('FlagReranker')
+                    _reranker_cache = flag_reranker(model_name, use_fp16=False) # Изменено на False для большей совместимости
+                logger.info(f"Reranker model {model_name} initialized successfully (attempt {attempt + 1})")
+                break
+            except Exception as e:
+                if attempt == max_retries - 1:
+                    logger.error(f"Failed to initialize reranker after {max_retries} attempts: {str(e)}")
+                    raise RuntimeError(f"Failed to initialize reranker after {max_retries} attempts") from e
+                logger.warning(f"Retrying model initialization (attempt {attempt + 1}): {str(e)}")
+    return _reranker_cache
+
+def _reranker_cache_model(model_name: str) -> str:
+    """Имя модели для ключа кэша оценок: оценки int8 ONNX не смешиваются с оценками FlagReranker"""
+    if RERANKER_SETTINGS.get('backend', 'flag') == 'onnx':
+        quantized = RERANKER_SETTINGS.get('onnx_quantize', True)
+        return f"{model_name}:onnx{'-int8' if quantized else ''}"
+    return model_name
+
+def compute_rerank_scores(query: str, texts: List[str], model_name: str, max_retries: int = 3,
+                          stats: Dict[str, Any] = None) -> List[float]:
+    """
+    Возвращает оценки кросс-энкодера для пар (query, text) в порядке texts
+
+    Оценки берутся из кэша по ключу (хеш нормализованного запроса, text_hash,
+    модель); в модель одним пакетом уходят только промахи кэша.
+    В stats (если передан) записывается число пар, оцененных моделью ('computed').
+    """
+    use_cache = RERANKER_SETTINGS.get('cache_enabled', True)
+    keys = []
+    cached = {}
+    if use_cache:
+        q_hash = query_hash(query)
+        cache_model = _reranker_cache_model(model_name)
+        keys = [(q_hash, get_text_hash(text), cache_model) for text in texts]
+        cached = get_rerank_cache().get_many(keys)
+
+    missing = [i for i in range(len(texts)) if not use_cache or keys[i] not in cached]
+    fresh = {}
+    if missing:
+        # Модель FlagReranker.compute_score ожидает list of pairs: [[query, doc1], [query, doc2]...]
+        missing_pairs = [[query, texts[i]] for i in missing]
+        if RERANKER_SETTINGS.get('service_enabled', False):
+            # Пары конкурентных запросов объединяются в общие пакеты рабочим потоком сервиса
+            service = get_rerank_service(lambda: bucketed(_get_reranker(model_name, max_retries)))
+            scores = service.score(missing_pairs)
+        else:
+            reranker = bucketed(_get_reranker(model_name, max_retries))
+            scores = reranker.compute_score(missing_pairs, batch_size=SEARCH_SETTINGS.get('reranker_batch_size', 64))
+        if isinstance(scores, (int, float)):
+            # Для одной пары compute_score возвращает число, а не список
+            scores = [scores]
+        fresh = {i: float(score) for i, score in zip(missing, scores)}
+        if use_cache:
+            get_rerank_cache().put_many({keys[i]: score for i, score in fresh.items()})
+
+    logger.debug(f"Rerank scores: {len(texts) - len(missing)} from cache, {len(missing)} computed")
+    if stats is not None:
+        stats['computed'] = len(missing)
+    return [fresh[i] if i in fresh else cached[keys[i]] for i in range(len(texts))]
+
+# Поля элементов с оценкой первого этапа, в порядке предпочтения
+FIRST_STAGE_FIELDS = ('rrf_score', 'similarity', 'bm25_score')
+
+# Оценка времени одной пары кросс-энкодера (мс), уточняется после каждого вызова модели
+_pair_cost_ms: Optional[float] = None
+
+def first_stage_scores(query: str, items: List[Dict[str, Any]], texts: List[str]) -> Tuple[List[float], str]:
+    """
+    Дешевые оценки первого этапа каскада
+
+    Берет готовую оценку поиска (RRF, косинусное сходство или BM25), если она
+    есть у всех элементов; иначе считает BM25 запроса по самим кандидатам.
+
+    Returns:
+        (оценки в порядке items, название источника оценок)
+    """
+    for field in FIRST_STAGE_FIELDS:
+        if all(isinstance(item.get(field), (int, float)) for item in items):
+            return [float(item[field]) for item in items], field
+
+    from tokenization import tokenize
+    corpus = [tokenize(text) for text in texts]
+    query_tokens = tokenize(query)
+    if not query_tokens or not any(corpus):
+        return [0.0] * len(texts), 'bm25'
+    return [float(score) for score in BM25Okapi(corpus).get_scores(query_tokens)], 'bm25'
+
+def choose_shortlist_size(sorted_scores: List[float], top_k: int, budget_ms: float = None,
+                          pair_cost_ms: float = None) -> int:
+    """
+    Выбирает, сколько лучших по первому этапу кандидатов отдать кросс-энкодеру
+
+    Размер не меньше max(top_k, cascade_min) и не больше cascade_max и того, что
+    укладывается в бюджет budget_ms при стоимости пары pair_cost_ms. Внутри этих
+    границ список обрезается на первом разрыве оценок, превышающем долю
+    cascade_score_gap от их общего размаха: все, что ниже разрыва, заметно хуже.
+
+    Args:
+        sorted_scores: Оценки первого этапа по убыванию
+        top_k: Количество возвращаемых результатов
+        budget_ms: Бюджет времени на реранжирование (None или 0 - без ограничения)
+        pair_cost_ms: Оценка времени одной пары
+    """
+    count = len(sorted_scores)
+    floor = min(count, max(top_k, SEARCH_SETTINGS.get('cascade_min', 10)))
+    ceiling = min(count, SEARCH_SETTINGS.get('cascade_max', 50))
+    if budget_ms and pair_cost_ms:
+        ceiling = min(ceiling, int(budget_ms // pair_cost_ms))
+    if ceiling <= floor:
+        return floor
+
+    spread = sorted_scores[0] - sorted_scores[-1]
+    if spread > 0:
+        gap = SEARCH_SETTINGS.get('cascade_score_gap', 0.15)
+        for size in range(floor, ceiling):
+            if (sorted_scores[size - 1] - sorted_scores[size]) / spread >= gap:
+                return size
+    return ceiling
+
+def _update_pair_cost(elapsed_ms: float, computed: int):
+    """Скользящее среднее времени одной пары; пары из кэша в оценку не входят"""
+    global _pair_cost_ms
+    if computed <= 0:
+        return
+    cost = elapsed_ms / computed
+    _pair_cost_ms = cost if _pair_cost_ms is None else 0.7 * _pair_cost_ms + 0.3 * cost
 
 @timeit
 def rerank_with_cross_encoder(
@@ -70,12 +236,18 @@ def rerank_with_cross_encoder(
     model_name: str = "bge-reranker-base",
     top_k: int = None,
     min_score: float = 0.0, # min_score пока не используется в логике ниже, но оставлен для совместимости
-    max_retries: int = 3
+    max_retries: int = 3,
+    cascade: bool = None,
+    stats: Dict[str, Any] = None
 ) -> List[Dict[str, Any]]:
     """
     Реранжирует результаты поиска с использованием кросс-энкодера BGE.
     Поддерживает несколько форматов входных данных и включает расширенное логирование.
 
+    В каскадном режиме кандидаты сначала упорядочиваются дешевой оценкой
+    (first_stage_scores), и кросс-энкодер получает только первые M из них
+    (choose_shortlist_size с бюджетом SEARCH_SETTINGS['rerank_budget_ms']).
+
     Args:
         query: Поисковый запрос (непустая строка)
         items: Список элементов для реранжирования. Ожидается, что каждый элемент - словарь,
@@ -84,6 +256,11 @@ def rerank_with_cross_encoder(
         top_k: Количество возвращаемых результатов (None = из SEARCH_SETTINGS)
         min_score: Минимальный score для включения в результаты (пока не используется)
         max_retries: Максимальное количество попыток при ошибках модели
+        cascade: Каскадный режим (None = SEARCH_SETTINGS['cascade_enabled'])
+        stats: Словарь, в который записываются число кандидатов ('candidates'),
+               число реранжированных ('reranked'), источник оценок первого этапа
+               ('first_stage'), бюджет ('budget_ms'), время ('elapsed_ms')
+               и доля использованного бюджета ('budget_used')
 
     Returns:
         Список реранжированных элементов (исходные словари item),
@@ -95,8 +272,6 @@ def rerank_with_cross_encoder(
         ValueError: При невалидных входных параметрах
         RuntimeError: При ошибках модели после max_retries попыток
     """
-    global _reranker_cache
-
     # Расширенная валидация входных параметров
     if not isinstance(query, str) or not query.strip():
         raise ValueError("Query must be a non-empty string")
@@ -129,21 +304,6 @@ def rerank_with_cross_encoder(
     logger.info(f"Starting reranking for query: '{query[:50]}...' with {len(items)} items")
     logger.debug(f"Parameters: top_k={top_k}, min_score={min_score}, model={model_name}")
 
-    # Инициализация модели с кэшированием и повторными попытками
-    if _reranker_cache is None:
-        logger.debug(f"Initializing reranker model: {model_name}")
-        for attempt in range(max_retries):
-            try:
-                # use_fp16=True может ускорить, но требует совместимого GPU
-                _reranker_cache = FlagReranker(model_name, use_fp16=False) # Изменено на False для большей совместимости
-                logger.info(f"Reranker model {model_name} initialized successfully (attempt {attempt + 1})")
-                break
-            except Exception as e:
-                if attempt == max_retries - 1:
-                    logger.error(f"Failed to initialize reranker after {max_retries} attempts: {str(e)}")
-                    raise RuntimeError(f"Failed to initialize reranker after {max_retries} attempts") from e
-                logger.warning(f"Retrying model initialization (attempt {attempt + 1}): {str(e)}")
-
     # Подготавливаем пары запрос-текст для реранжирования с детальным логированием
     pairs = []
     valid_items_map = {} # Используем map для связи индекса пары с исходным item
@@ -180,11 +340,37 @@ def rerank_with_cross_encoder(
         logger.warning("No valid pairs for reranking, returning empty list")
         return []
 
+    if cascade is None:
+        cascade = SEARCH_SETTINGS.get('cascade_enabled', False)
+    budget_ms = SEARCH_SETTINGS.get('rerank_budget_ms', 0)
+    rerank_stats = {'candidates': len(pairs), 'first_stage': None, 'budget_ms': budget_ms}
+    if cascade and len(pairs) > top_k:
+        candidates = [valid_items_map[i] for i in range(len(pairs))]
+        scores, rerank_stats['first_stage'] = first_stage_scores(query, candidates, [text for _, text in pairs])
+        order = sorted(range(len(pairs)), key=lambda i: -scores[i])
+        pair_cost_ms = _pair_cost_ms or SEARCH_SETTINGS.get('cascade_pair_ms', 20)
+        shortlist = order[:choose_shortlist_size([scores[i] for i in order], top_k, budget_ms, pair_cost_ms)]
+        pairs = [pairs[i] for i in shortlist]
+        valid_items_map = {new: valid_items_map[old] for new, old in enumerate(shortlist)}
+        logger.debug(f"Cascade: {len(pairs)} of {len(candidates)} candidates go to the cross-encoder "
+                     f"(first stage: {rerank_stats['first_stage']})")
+    rerank_stats['reranked'] = len(pairs)
+
     try:
-        # Получаем оценки реранжирования
+        # Получаем оценки реранжирования (модель загружается и вызывается только для промахов кэша)
         logger.debug(f"Computing rerank scores for {len(pairs)} pairs...")
-        # Модель FlagReranker.compute_score ожидает list of pairs: [[query, doc1], [query, doc2]...]
-        rerank_scores = _reranker_cache.compute_score(pairs, batch_size=SEARCH_SETTINGS.get('reranker_batch_size', 64))
+        score_stats = {}
+        start = time.perf_counter()
+        rerank_scores = compute_rerank_scores(query, [text for _, text in pairs], model_name, max_retries,
+                                              stats=score_stats)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        _update_pair_cost(elapsed_ms, score_stats.get('computed', 0))
+        rerank_stats['elapsed_ms'] = elapsed_ms
+        rerank_stats['budget_used'] = elapsed_ms / budget_ms if budget_ms else None
+        logger.info(f"Reranked {rerank_stats['reranked']} of {rerank_stats['candidates']} candidates "
+                    f"in {elapsed_ms:.1f} ms" + (f" ({rerank_stats['budget_used']:.0%} of budget)" if budget_ms else ""))
+        if stats is not None:
+            stats.update(rerank_stats)
         logger.debug(f"Got {len(rerank_scores)} rerank scores")
 
         # Добавляем оценки к исходным элементам
@@ -209,6 +395,9 @@ def rerank_with_cross_encoder(
         return sorted_items[:top_k]
 
     except Exception as e:
+        if _reranker_cache is None:
+            # Модель не удалось загрузить - как и раньше, сообщаем об этом вызывающему
+            raise
         logger.error(f"Reranking failed: {str(e)}", exc_info=DEBUG)
         # В случае ошибки реранкера, можно вернуть пустой список или исходные items
 
@@ -10,6 +10,9 @@ DB_CONFIG = {
     "port": os.getenv("DB_PORT", "5432")
 }
 
+# Реплики только для чтения (необязательно): строки DSN через точку с запятой
+DB_REPLICAS = [dsn for dsn in os.getenv("DB_REPLICA_DSNS", "").split(";") if dsn.strip()]
+
 # API ключи
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 
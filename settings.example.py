@@ -7,5 +7,12 @@ DB_CONFIG = {
     "port": "5432"
 }
 
+# Read-only replicas (optional): dicts like DB_CONFIG or DSN strings.
+# Read-only queries are spread across them; writes always go to DB_CONFIG.
+DB_REPLICAS = [
+    # {"dbname": "your_db_name", "user": "your_db_user", "password": "your_db_password",
+    #  "host": "replica1", "port": "5432"},
+]
+
 # API keys
 OPENAI_API_KEY = "your-openai-api-key" 
\ No newline at end of file
@@ -17,10 +17,13 @@ Standalone Search Mode
 """
 
 import psycopg2
+from psycopg2.extras import execute_values
 import uuid
 import sys
-from config import DB_CONFIG, OPENAI_API_KEY, MODELS
+from config import DB_CONFIG, OPENAI_API_KEY, MODELS, RAG_SETTINGS
 from openai import OpenAI
+from openai_api_models import stream_chat_completion
+from utils import StreamPrinter
 import logging
 from datetime import datetime
 
@@ -145,8 +148,17 @@ def select_blocks(results):
             print("Пожалуйста, введите номер или 'done'.")
     return selected_blocks
 
-def query_ai(selected_blocks, user_query):
-    """Отправка запроса к OpenAI с выбранными блоками в качестве контекста."""
+def query_ai(selected_blocks, user_query, on_token=None, stats=None):
+    """
+    Отправка запроса к OpenAI с выбранными блоками в качестве контекста.
+
+    Если передан on_token и включен RAG_SETTINGS['stream'], ответ генерируется
+    потоком: on_token получает фрагменты по мере поступления, в stats
+    записываются время до первого токена и скорость. Возвращается полный текст.
+
+    При ошибке (в том числе посреди потока) возвращается None, а текст ошибки
+    записывается в stats['error'] - чтобы он не попал в диалог как ответ.
+    """
     try:
         # Формируем контекст из выбранных блоков
         context = "\n\n".join([f"ID: {block_id}\nТекст: {text}" for block_id, text in selected_blocks])
@@ -160,13 +172,18 @@ def query_ai(selected_blocks, user_query):
 
 Пожалуйста, ответьте на вопрос пользователя, используя предоставленный контекст."""
         
+        messages = [
+            {"role": "system", "content": "Вы помощник, который отвечает на вопросы, используя предоставленный контекст."},
+            {"role": "user", "content": prompt}
+        ]
+        if on_token is not None and RAG_SETTINGS.get('stream', True):
+            return stream_chat_completion(messages, on_token=on_token, stats=stats, api_client=client,
+                                          model=MODELS['generation']['name'], temperature=0.7, max_tokens=1000)
+        
         # Отправляем запрос к OpenAI
         response = client.chat.completions.create(
             model=MODELS['generation']['name'],
-            messages=[
-                {"role": "system", "content": "Вы помощник, который отвечает на вопросы, используя предоставленный контекст."},
-                {"role": "user", "content": prompt}
-            ],
+            messages=messages,
             temperature=0.7,
             max_tokens=1000
         )
@@ -174,7 +191,9 @@ def query_ai(selected_blocks, user_query):
         return response.choices[0].message.content
     except Exception as e:
         logger.error(f"Ошибка при запросе к OpenAI: {str(e)}")
-        return f"Произошла ошибка при запросе к ИИ: {str(e)}"
+        if stats is not None:
+            stats['error'] = str(e)
+        return None
 
 def save_dialogue(selected_blocks, user_query, ai_response, parent_id=None):
     """Сохранение диалога в базу данных."""
@@ -190,19 +209,11 @@ def save_dialogue(selected_blocks, user_query, ai_response, parent_id=None):
                 timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
                 dialogue_text = f"Запрос: {user_query}\n\nОтвет: {ai_response}\n\nВремя: {timestamp}"
                 
-                # Вставляем запись диалога
-                cur.execute("""
-                    INSERT INTO items (id, id_parent, txt)
-                    VALUES (%s, %s, %s)
-                """, (dialogue_id, parent_id, dialogue_text))
-                
-                # Для каждого выбранного блока создаем дочерний элемент
+                # Запись диалога и дочерние элементы для выбранных блоков - одной командой
+                rows = [(dialogue_id, parent_id, dialogue_text)]
                 for block_id, text in selected_blocks:
-                    child_id = str(uuid.uuid4())
-                    cur.execute("""
-                        INSERT INTO items (id, id_parent, txt)
-                        VALUES (%s, %s, %s)
-                    """, (child_id, dialogue_id, f"Контекст из блока {block_id}: {text[:100]}..."))
+                    rows.append((str(uuid.uuid4()), dialogue_id, f"Контекст из блока {block_id}: {text[:100]}..."))
+                execute_values(cur, "INSERT INTO items (id, id_parent, txt) VALUES %s", rows)
                 
                 conn.commit()
                 return dialogue_id
@@ -289,14 +300,24 @@ def main():
             # Формирование запроса к ИИ
             user_query = input("Введите ваш запрос к ИИ: ")
             print("\nОтправка запроса к ИИ...")
-            ai_response = query_ai(selected_blocks, user_query)
-            
-            print("\n=== Ответ ИИ ===")
-            print(ai_response)
-            print("=== Конец ответа ===")
+            printer = StreamPrinter("\n=== Ответ ИИ ===\n")
+            ai_stats = {}
+            ai_response = query_ai(selected_blocks, user_query, on_token=printer, stats=ai_stats)
             
-            # Сохраняем последний диалог
-            last_dialogue = (selected_blocks, user_query, ai_response)
+            if ai_response is None:
+                # Уже напечатанная часть оборванного ответа закрывается пометкой и в диалог не сохраняется
+                printer.finish(interrupted=True)
+                print(f"Произошла ошибка при запросе к ИИ: {ai_stats.get('error')}")
+            else:
+                if printer.started:
+                    printer.finish()
+                else:
+                    print("\n=== Ответ ИИ ===")
+                    print(ai_response)
+                print("=== Конец ответа ===")
+                
+                # Сохраняем последний диалог
+                last_dialogue = (selected_blocks, user_query, ai_response)
             
         elif choice == "5" and 'last_dialogue' in locals():
             # Сохранение диалога
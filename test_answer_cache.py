@@ -0,0 +1,138 @@
+import unittest
+from unittest.mock import patch
+from answer_cache import AnswerCache, context_fingerprint, exact_key
+
+PARAMS = ('gpt-4o', 0.3, 'шаблон')
+
+def items(*texts):
+    return [{'id': i, 'text': text} for i, text in enumerate(texts, 1)]
+
+class FakeEmbedder:
+    """Эмбеддинги по заранее заданной таблице; считает вызовы"""
+    def __init__(self, vectors):
+        self.vectors = vectors
+        self.calls = []
+
+    def __call__(self, text):
+        self.calls.append(text)
+        return self.vectors[text]
+
+
+class TestAnswerCache(unittest.TestCase):
+    def test_exact_hit_ignores_query_formatting(self):
+        cache = AnswerCache(max_size=10, semantic=False)
+        context = items('Бэкап делается ночью', 'Хранится 30 дней')
+        cache.put('Как делается бэкап?', context, *PARAMS, 'Ночью.', 2.5)
+        self.assertEqual(cache.get('  как делается  БЭКАП?', context, *PARAMS), ('Ночью.', 'exact'))
+        report = cache.report()
+        self.assertEqual((report['hits_exact'], report['misses']), (1, 0))
+        self.assertEqual(report['saved_seconds'], 2.5)
+
+    def test_key_depends_on_context_and_generation_params(self):
+        fingerprint = context_fingerprint(items('а', 'б'))
+        key = exact_key('вопрос', fingerprint, *PARAMS)
+        self.assertNotEqual(key, exact_key('вопрос', fingerprint[::-1], *PARAMS))
+        self.assertNotEqual(key, exact_key('вопрос', context_fingerprint(items('а', 'в')), *PARAMS))
+        self.assertNotEqual(key, exact_key('вопрос', fingerprint, 'gpt-4o', 0.7, 'шаблон'))
+        self.assertNotEqual(key, exact_key('вопрос', fingerprint, 'gpt-4o', 0.3, 'другой шаблон'))
+
+    def test_changed_item_text_misses(self):
+        cache = AnswerCache(max_size=10, semantic=False)
+        cache.put('вопрос', items('старый текст'), *PARAMS, 'ответ', 1.0)
+        self.assertIsNone(cache.get('вопрос', items('новый текст'), *PARAMS))
+        self.assertEqual(cache.report()['misses'], 1)
+
+    def test_invalidate_items(self):
+        cache = AnswerCache(max_size=10, semantic=False)
+        cache.put('первый', items('а', 'б'), *PARAMS, 'ответ 1', 1.0)
+        cache.put('второй', [{'id': 5, 'text': 'в'}], *PARAMS, 'ответ 2', 1.0)
+        self.assertEqual(cache.invalidate_items([2]), 1)
+        self.assertIsNone(cache.get('первый', items('а', 'б'), *PARAMS))
+        self.assertEqual(cache.get('второй', [{'id': 5, 'text': 'в'}], *PARAMS), ('ответ 2', 'exact'))
+
+    def test_semantic_hit_requires_same_context_set(self):
+        embed = FakeEmbedder({
+            'как делается бэкап': [1.0, 0.0],
+            'каким образом делается бэкап': [0.99, 0.05],
+            'сколько хранится бэкап': [0.0, 1.0],
+        })
+        cache = AnswerCache(max_size=10, semantic=True, threshold=0.9, embed=embed)
+        context = items('Бэкап делается ночью', 'Хранится 30 дней')
+        cache.put('как делается бэкап', context, *PARAMS, 'Ночью.', 3.0)
+        # Порядок элементов контекста для семантического уровня не важен
+        self.assertEqual(cache.get('каким образом делается бэкап', context[::-1], *PARAMS), ('Ночью.', 'semantic'))
+        self.assertIsNone(cache.get('сколько хранится бэкап', context, *PARAMS))
+        report = cache.report()
+        self.assertEqual((report['hits_semantic'], report['misses']), (1, 1))
+        self.assertAlmostEqual(report['hit_rate'], 0.5)
+        # Эмбеддинг сохраненного запроса считается один раз
+        self.assertEqual(embed.calls.count('как делается бэкап'), 1)
+
+    def test_no_embedding_without_matching_context(self):
+        embed = FakeEmbedder({})
+        cache = AnswerCache(max_size=10, semantic=True, threshold=0.9, embed=embed)
+        cache.put('вопрос', items('а'), *PARAMS, 'ответ', 1.0)
+        self.assertIsNone(cache.get('другой вопрос', items('б'), *PARAMS))
+        self.assertEqual(embed.calls, [])
+
+    def test_embedding_not_stored_into_evicted_entry(self):
+        cache = AnswerCache(max_size=10, semantic=True, threshold=0.9, embed=None)
+        context = items('Бэкап делается ночью')
+        cache.put('как делается бэкап', context, *PARAMS, 'Ночью.', 3.0)
+
+        def embed(text):
+            # Пока эмбеддинг считается вне блокировки, запись удаляют из другого потока
+            cache.invalidate_items([1])
+            return [1.0, 0.0]
+
+        cache._embed = embed
+        entry = next(iter(cache._entries.values()))
+        self.assertIsNone(cache.get('каким образом делается бэкап', context, *PARAMS))
+        self.assertIsNone(entry['embedding'])
+        self.assertEqual(len(cache), 0)
+
+    def test_lru_eviction_cleans_indexes(self):
+        cache = AnswerCache(max_size=1, semantic=False)
+        cache.put('первый', items('а'), *PARAMS, 'ответ 1', 1.0)
+        cache.put('второй', [{'id': 7, 'text': 'б'}], *PARAMS, 'ответ 2', 1.0)
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.invalidate_items([1]), 0)
+        self.assertIsNone(cache.get('первый', items('а'), *PARAMS))
+
+
+class TestGenerateAnswerCache(unittest.TestCase):
+    def test_hit_skips_compression_and_prompt_building(self):
+        import rag
+        cache = AnswerCache(max_size=10, semantic=False)
+        context = items('Бэкап делается ночью')
+        stats = {}
+        with patch('answer_cache.get_answer_cache', return_value=cache), \
+                patch.dict('rag.ANSWER_CACHE_SETTINGS', {'enabled': True}), \
+                patch.dict('rag.RAG_SETTINGS', {'compression_enabled': True}), \
+                patch('context_compressor.compress_contexts') as compress, \
+                patch('rag.prepare_prompt') as prepare:
+            cache.put('как делается бэкап', context, *rag.answer_cache_params(rag.RAG_SETTINGS, rag.RAG_SETTINGS),
+                      'Ночью.', 1.0)
+            self.assertEqual(rag.generate_answer('Как делается  бэкап', context, stats=stats), 'Ночью.')
+        compress.assert_not_called()
+        prepare.assert_not_called()
+        self.assertEqual(stats['cache'], 'exact')
+
+    def test_prompt_shaping_settings_are_part_of_the_key(self):
+        import rag
+        cache = AnswerCache(max_size=10, semantic=False)
+        context = items('Бэкап делается ночью')
+        cache.put('вопрос', context, *rag.answer_cache_params(rag.RAG_SETTINGS, rag.RAG_SETTINGS), 'ответ', 1.0)
+        for settings in ({'compression_enabled': not rag.RAG_SETTINGS['compression_enabled']},
+                         {'compression_target_tokens': 50}, {'context_packing': False}, {'context_budget': 10}):
+            with patch.dict('rag.RAG_SETTINGS', settings):
+                self.assertIsNone(cache.get('вопрос', context, *rag.answer_cache_params(rag.RAG_SETTINGS, rag.RAG_SETTINGS)))
+        # chunk_size берется из параметров контекста (debug_step('context'))
+        context_params = dict(rag.RAG_SETTINGS, chunk_size=100)
+        self.assertIsNone(cache.get('вопрос', context, *rag.answer_cache_params(rag.RAG_SETTINGS, context_params)))
+        self.assertEqual(cache.get('вопрос', context, *rag.answer_cache_params(rag.RAG_SETTINGS, rag.RAG_SETTINGS)),
+                         ('ответ', 'exact'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,143 @@
+import math
+import random
+import tempfile
+import unittest
+from collections import Counter
+from unittest.mock import patch
+import numpy as np
+import bm25_index
+from bm25_index import BM25Index, encode_varints, decode_varints, encode_postings, decode_postings
+from tokenization import tokenize
+
+
+DOCS = [
+    ('a', 'Теория познания изучает знание и его источники'),
+    ('b', 'Бытие и время: философия бытия'),
+    ('c', 'Знания о бытии накапливаются в базе знаний'),
+    ('d', 'Рецепт борща со свеклой'),
+    ('e', 'Knowledge Universe TIP: база знаний о познании'),
+    ('f', ''),
+]
+
+
+def exhaustive_bm25(docs, query, k1=1.5, b=0.75):
+    """Эталонный BM25 по тем же формулам, построчно на Python"""
+    tokenized = {doc_id: tokenize(text) for doc_id, text in docs}
+    n = len(tokenized)
+    avgdl = sum(len(tokens) for tokens in tokenized.values()) / n or 1.0
+    scores = {}
+    for term, query_tf in Counter(tokenize(query)).items():
+        df = sum(term in tokens for tokens in tokenized.values())
+        if not df:
+            continue
+        idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+        for doc_id, tokens in tokenized.items():
+            tf = tokens.count(term)
+            if tf:
+                norm = k1 * (1 - b + b * len(tokens) / avgdl)
+                scores[doc_id] = scores.get(doc_id, 0.0) + query_tf * idf * tf * (k1 + 1) / (tf + norm)
+    return scores
+
+
+class TestVarints(unittest.TestCase):
+    def test_roundtrip(self):
+        values = [0, 1, 127, 128, 300, 16383, 16384, 2 ** 31, 2 ** 40 + 7]
+        self.assertEqual(decode_varints(encode_varints(values)).tolist(), values)
+        self.assertEqual(len(encode_varints([127])), 1)
+        self.assertEqual(len(encode_varints([128])), 2)
+
+    def test_postings_roundtrip(self):
+        doc_ids = np.array([3, 4, 200, 100000])
+        tfs = np.array([1, 5, 2, 1])
+        decoded_ids, decoded_tfs = decode_postings(encode_postings(doc_ids, tfs), len(doc_ids))
+        self.assertEqual(decoded_ids.tolist(), doc_ids.tolist())
+        self.assertEqual(decoded_tfs.tolist(), tfs.tolist())
+
+
+class TestBM25Index(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def assertMatchesExhaustive(self, index, docs, query):
+        expected = exhaustive_bm25(docs, query)
+        results = dict(index.search(query, top_k=len(docs)))
+        self.assertEqual(set(results), set(expected))
+        for doc_id, score in expected.items():
+            self.assertAlmostEqual(results[doc_id], score, places=9)
+
+    def test_search_matches_exhaustive_scoring(self):
+        index = BM25Index(self.tmp.name).build(DOCS)
+        for query in ['знание бытия', 'база знаний', 'борщ', 'knowledge', 'ничего подобного']:
+            self.assertMatchesExhaustive(index, DOCS, query)
+        self.assertEqual(index.search('знания', top_k=1)[0][0], 'c')
+
+    def test_index_is_reloaded_from_disk(self):
+        BM25Index(self.tmp.name).build(DOCS)
+        reloaded = BM25Index(self.tmp.name)
+        self.assertIsInstance(reloaded.segments[0].postings, np.memmap)
+        self.assertMatchesExhaustive(reloaded, DOCS, 'знание бытия')
+
+    def test_incremental_update(self):
+        index = BM25Index(self.tmp.name).build(DOCS)
+        changed = [doc for doc in DOCS if doc[0] not in ('d', 'b')]
+        changed.append(('b', 'Время и бытие в базе знаний'))
+        changed.append(('g', 'Новый элемент про борщ и знание'))
+
+        with patch.dict('bm25_index.BM25_SETTINGS', {'max_segments': 8, 'max_deleted_ratio': 1.0}):
+            stats = index.update(changed)
+        self.assertEqual(stats, {'added': 1, 'changed': 1, 'deleted': 1, 'unchanged': 4})
+        self.assertEqual(len(index.segments), 2)
+        self.assertMatchesExhaustive(BM25Index(self.tmp.name), changed, 'знание бытия борщ')
+
+        # Повторное обновление тем же набором ничего не меняет
+        self.assertEqual(index.update(changed)['unchanged'], len(changed))
+
+    def test_compaction_keeps_results(self):
+        index = BM25Index(self.tmp.name).build(DOCS)
+        remaining = DOCS[2:]
+        with patch.dict('bm25_index.BM25_SETTINGS', {'max_segments': 8, 'max_deleted_ratio': 0.1}):
+            index.update(remaining)
+        self.assertEqual(len(index.segments), 1)
+        self.assertEqual(len(index.doc_ids), len(remaining))
+        self.assertMatchesExhaustive(BM25Index(self.tmp.name), remaining, 'знание бытия')
+
+
+class TestDynamicPruning(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        rng = random.Random(7)
+        vocab = ['знание', 'бытие', 'время', 'теория', 'познание', 'база', 'мир', 'человек',
+                 'сознание', 'опыт', 'смысл', 'язык', 'истина', 'природа', 'общество', 'логика']
+        weights = [1.0 / (rank + 1) for rank in range(len(vocab))]
+        self.docs = [
+            (f"id{i}", ' '.join(rng.choices(vocab, weights=weights, k=rng.randint(3, 40))))
+            for i in range(400)
+        ]
+        self.queries = [' '.join(rng.sample(vocab, rng.randint(1, 5))) for _ in range(60)]
+
+    def assertSameAsExhaustive(self, index):
+        skipped = 0
+        for query in self.queries:
+            for top_k in (1, 3, 10):
+                stats = {}
+                pruned = index.search(query, top_k, exhaustive=False, stats=stats)
+                self.assertEqual(pruned, index.search(query, top_k, exhaustive=True), (query, top_k))
+                skipped += stats['skipped']
+        self.assertGreater(skipped, 0)
+
+    def test_matches_exhaustive_scoring(self):
+        self.assertSameAsExhaustive(BM25Index(self.tmp.name).build(self.docs))
+
+    def test_matches_exhaustive_after_update(self):
+        index = BM25Index(self.tmp.name).build(self.docs)
+        updated = self.docs[50:] + [(f"new{i}", text) for i, (_, text) in enumerate(self.docs[:20])]
+        with patch.dict('bm25_index.BM25_SETTINGS', {'max_segments': 8, 'max_deleted_ratio': 1.0}):
+            index.update(updated)
+        self.assertEqual(len(index.segments), 2)
+        self.assertSameAsExhaustive(index)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import unittest
+from unittest.mock import patch
+import retrieval
+from retrieval import choose_shortlist_size, first_stage_scores, rerank_with_cross_encoder
+
+
+def make_items(count):
+    return [{'id': f'id{i}', 'text': f'текст номер {i}', 'similarity': 1.0 - i / 100} for i in range(count)]
+
+
+class TestShortlistSize(unittest.TestCase):
+    def setUp(self):
+        patcher = patch.dict(retrieval.SEARCH_SETTINGS, {'cascade_min': 3, 'cascade_max': 8, 'cascade_score_gap': 0.3})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_cut_at_score_gap(self):
+        scores = [0.9, 0.88, 0.87, 0.86, 0.85, 0.3, 0.29, 0.28, 0.27, 0.26]
+        self.assertEqual(choose_shortlist_size(scores, top_k=2), 5)
+
+    def test_gap_before_floor_is_ignored(self):
+        scores = [0.9, 0.1, 0.09, 0.08, 0.07, 0.06]
+        self.assertEqual(choose_shortlist_size(scores, top_k=4), 6)
+
+    def test_budget_limits_size_but_not_below_top_k(self):
+        scores = [1.0 - i / 100 for i in range(20)]
+        self.assertEqual(choose_shortlist_size(scores, top_k=2, budget_ms=100, pair_cost_ms=20), 5)
+        self.assertEqual(choose_shortlist_size(scores, top_k=4, budget_ms=10, pair_cost_ms=20), 4)
+
+    def test_no_gap_uses_ceiling(self):
+        self.assertEqual(choose_shortlist_size([0.5] * 20, top_k=2), 8)
+
+
+class TestFirstStageScores(unittest.TestCase):
+    def test_prefers_search_scores(self):
+        items = [{'rrf_score': 0.2, 'similarity': 0.9}, {'rrf_score': 0.1, 'similarity': 0.8}]
+        self.assertEqual(first_stage_scores('q', items, ['a', 'b']), ([0.2, 0.1], 'rrf_score'))
+
+    def test_falls_back_to_bm25(self):
+        texts = ['рецепт борща со свеклой', 'настройка репликации postgresql', 'погода завтра']
+        scores, source = first_stage_scores('репликация postgresql', [{}, {}, {}], texts)
+        self.assertEqual(source, 'bm25')
+        self.assertEqual(max(range(3), key=lambda i: scores[i]), 1)
+
+
+class TestCascadeRerank(unittest.TestCase):
+    def test_only_shortlist_is_reranked(self):
+        items = make_items(30)
+        calls = []
+
+        def fake_scores(query, texts, model_name, max_retries=3, stats=None):
+            calls.append(list(texts))
+            if stats is not None:
+                stats['computed'] = len(texts)
+            # Кросс-энкодер переворачивает порядок первого этапа
+            return [float(i) for i in range(len(texts))]
+
+        settings = {'cascade_min': 5, 'cascade_max': 10, 'rerank_budget_ms': 0}
+        with patch.dict(retrieval.SEARCH_SETTINGS, settings), \
+                patch('retrieval.compute_rerank_scores', side_effect=fake_scores):
+            stats = {}
+            result = rerank_with_cross_encoder('текст', items, top_k=3, cascade=True, stats=stats)
+
+        self.assertEqual(len(calls[0]), 10)
+        self.assertEqual(calls[0], [item['text'] for item in items[:10]])
+        self.assertEqual([item['id'] for item in result], ['id9', 'id8', 'id7'])
+        self.assertEqual((stats['candidates'], stats['reranked'], stats['first_stage']), (30, 10, 'similarity'))
+
+    def test_cascade_disabled_reranks_everything(self):
+        items = make_items(12)
+        with patch('retrieval.compute_rerank_scores', return_value=[0.0] * 12) as scores:
+            stats = {}
+            rerank_with_cross_encoder('текст', items, top_k=3, cascade=False, stats=stats)
+        self.assertEqual(len(scores.call_args[0][1]), 12)
+        self.assertEqual(stats['reranked'], 12)
+        self.assertIsNone(stats['first_stage'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import unittest
+from context_compressor import GAP, bm25_scores, compress_contexts, head_sentence, select_sentences, split_sentences
+from prompt_builder import PromptBuilder
+from test_prompt_builder import CharEncoder, TEMPLATE
+
+NOTE = ("Сервер стоит в серверной на третьем этаже. Доступ по пропуску. "
+        "Резервное копирование выполняется каждую ночь. Копии хранятся 30 дней. "
+        "Уборка проходит по пятницам. Кофемашина на кухне.")
+
+class TestContextCompressor(unittest.TestCase):
+    def test_split_sentences(self):
+        text = "Первое. Второе?  Третье!\n- пункт списка\n\nПоследнее"
+        self.assertEqual([text[s:e] for s, e in split_sentences(text)],
+                         ['Первое.', 'Второе?', 'Третье!', '- пункт списка', 'Последнее'])
+
+    def test_bm25_prefers_matching_sentences(self):
+        scores = bm25_scores(['резервн', 'копирован'], [['сервер', 'этаж'], ['резервн', 'копирован', 'ноч'], ['копирован']])
+        self.assertEqual(scores[0], 0.0)
+        self.assertGreater(scores[1], scores[2])
+        self.assertGreater(scores[2], 0.0)
+
+    def test_select_sentences_keeps_neighbors_in_order(self):
+        self.assertEqual(select_sentences([0, 0, 0, 5.0, 0, 0], [10] * 6, target=30), [2, 3, 4])
+        # Соседи не помещаются в бюджет
+        self.assertEqual(select_sentences([0, 0, 0, 5.0, 0, 0], [10] * 6, target=15), [3])
+        # Совпадений нет - остается начало
+        self.assertEqual(select_sentences([0, 0, 0], [10] * 3, target=20), [0, 1])
+
+    def test_compress_long_context(self):
+        items = [{'id': 1, 'text': NOTE, 'rerank_score': 0.9}, {'id': 2, 'text': 'Короткая заметка'}]
+        stats = {}
+        result = compress_contexts('Как часто делается резервное копирование?', items,
+                                   target_tokens=120, encoder=CharEncoder(), stats=stats)
+        self.assertEqual(result[0]['text'],
+                         "Доступ по пропуску. Резервное копирование выполняется каждую ночь. Копии хранятся 30 дней.")
+        self.assertEqual(result[0]['rerank_score'], 0.9)
+        self.assertEqual({k: v for k, v in result[1].items() if k != 'tokens'}, items[1])
+        self.assertEqual(items[0]['text'], NOTE)
+        self.assertEqual(stats['compressed'], 1)
+        self.assertLess(stats['ratio'], 1.0)
+        self.assertIn('elapsed_ms', stats)
+
+    def test_gap_between_distant_sentences(self):
+        items = [{'id': 1, 'text': NOTE}]
+        result = compress_contexts('сервер кофемашина', items, target_tokens=120, encoder=CharEncoder())
+        self.assertIn(GAP, result[0]['text'])
+        self.assertTrue(result[0]['text'].startswith('Сервер стоит'))
+        self.assertTrue(result[0]['text'].endswith('Кофемашина на кухне.'))
+
+    def test_context_without_sentence_breaks_keeps_its_head(self):
+        text = "резервное копирование базы " * 20
+        items = [{'id': 1, 'text': text}]
+        stats = {}
+        result = compress_contexts('резервное копирование', items, target_tokens=50, encoder=CharEncoder(), stats=stats)
+        self.assertEqual(result[0]['text'], text[:50])
+        self.assertEqual(len(result[0]['tokens']), 50)
+        self.assertEqual(stats['compressed'], 1)
+
+    def test_head_of_best_sentence_when_none_fits(self):
+        self.assertEqual(select_sentences([0, 2.0], [10, 10], target=5), [])
+        self.assertEqual(head_sentence([0, 2.0], [[1] * 10, [2] * 10], target=5), (1, [2] * 5))
+        # Без совпадений - начало первого предложения
+        self.assertEqual(head_sentence([0, 0], [[1] * 10, [2] * 10], target=5), (0, [1] * 5))
+
+    def test_tokens_are_reused_by_prompt_builder(self):
+        encoder = CharEncoder()
+        items = [{'id': 1, 'text': "Вступление.\n\n" + NOTE + "  "}, {'id': 2, 'text': 'Короткая заметка'}]
+        result = compress_contexts('сервер кофемашина', items, target_tokens=120, encoder=encoder)
+        for item in result:
+            self.assertEqual(encoder.decode(item['tokens']), item['text'])
+        # Контекст целиком не кодируется: только предложения и промежутки
+        self.assertNotIn(items[0]['text'], encoder.encoded)
+
+        encoded = len(encoder.encoded)
+        builder = PromptBuilder(TEMPLATE, 'вопрос', [item['text'] for item in result], encoder=encoder,
+                                context_tokens=[item['tokens'] for item in result])
+        prompt, tokens = builder.render()
+        self.assertEqual(tokens, len(prompt))
+        self.assertNotIn(result[0]['text'], encoder.encoded[encoded:])
+        self.assertNotIn(result[1]['text'], encoder.encoded[encoded:])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+from context_packer import pack_contexts, merge_spans, window_bounds
+from prompt_builder import PromptBuilder
+from test_prompt_builder import CharEncoder, TEMPLATE
+
+FILLER = 'Посторонний текст про погоду и отпуск. ' * 5
+
+class TestContextPacker(unittest.TestCase):
+    def builder(self, query, contexts):
+        return PromptBuilder(TEMPLATE, query, contexts, encoder=CharEncoder())
+
+    def test_window_helpers(self):
+        self.assertEqual(window_bounds(450, 200), [(0, 200), (200, 400), (400, 450)])
+        self.assertEqual(merge_spans([(400, 450), (0, 200), (200, 300)]), [(0, 300), (400, 450)])
+
+    def test_everything_fits(self):
+        contexts = ['короткий контекст', 'еще один контекст']
+        builder = self.builder('вопрос', contexts)
+        selected = pack_contexts(builder, [1.0, 0.5], budget=10000, span_tokens=50)
+        self.assertEqual(selected, [(0, [(0, len(contexts[0]))]), (1, [(0, len(contexts[1]))])])
+        self.assertEqual(builder.assemble(selected), builder.render()[0])
+
+    def test_budget_and_question_are_respected(self):
+        contexts = [FILLER + 'резервное копирование выполняется ночью', FILLER, 'Копии хранятся 30 дней']
+        builder = self.builder('Когда выполняется резервное копирование?', contexts)
+        budget = 120
+        stats = {}
+        prompt = builder.assemble(pack_contexts(builder, [1.0, 0.9, 0.8], budget, span_tokens=40, stats=stats))
+        self.assertLessEqual(len(prompt) - builder.fixed_tokens, budget)
+        self.assertLessEqual(builder.last_stats['tokens'] - builder.fixed_tokens, budget)
+        self.assertTrue(prompt.endswith('Вопрос: Когда выполняется резервное копирование?\nОтвет:'))
+        self.assertLess(stats['tokens'], stats['baseline_tokens'])
+
+    def test_prefers_matching_span_over_head_of_long_context(self):
+        contexts = [FILLER + 'резервное копирование выполняется ночью' + FILLER]
+        builder = self.builder('резервное копирование', contexts)
+        selected = pack_contexts(builder, [1.0], budget=60, span_tokens=40)
+        prompt = builder.assemble(selected)
+        self.assertIn('копирование', prompt)
+        self.assertNotEqual(selected[0][1][0][0], 0)
+
+    def test_short_relevant_context_beats_long_one(self):
+        contexts = [FILLER * 3, 'Короткий ответ']
+        builder = self.builder('вопрос', contexts)
+        selected = pack_contexts(builder, [1.0, 1.0], budget=40, span_tokens=400)
+        self.assertEqual([index for index, _ in selected], [1])
+
+
+class TestGenerateAnswerPacking(unittest.TestCase):
+    def test_debug_shows_packed_prompt_that_is_sent(self):
+        import rag
+        shown = []
+        sent = []
+
+        def debug_step(stage, data=None):
+            if data is not None:
+                shown.append((stage, data))
+
+        def create(**kwargs):
+            sent.append(kwargs['messages'][1]['content'])
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content='Ответ'))])
+
+        items = [{'id': i, 'text': f"Заметка {i}. " * 200, 'rerank_score': 1.0 / i} for i in range(1, 4)]
+        with patch('prompt_builder.get_encoder', return_value=CharEncoder()), \
+                patch('rag.debug_step', side_effect=debug_step), \
+                patch('rag.client.chat.completions.create', side_effect=create), \
+                patch.dict('rag.ANSWER_CACHE_SETTINGS', {'enabled': False}), \
+                patch.dict('rag.RAG_SETTINGS', {'context_packing': True, 'context_budget': 500}), \
+                patch.object(PromptBuilder, 'render', side_effect=AssertionError("полный промпт не нужен")):
+            self.assertEqual(rag.generate_answer('заметка 2', items), 'Ответ')
+        prompts = [data['prompt'] for stage, data in shown if stage == 'generation' and 'prompt' in data]
+        self.assertEqual(len(sent), 1)
+        self.assertEqual(prompts, sent)
+        self.assertLessEqual(next(data['total_tokens'] for stage, data in shown if stage == 'context'), 500)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,625 @@
+import asyncio
+import os
+import struct
+import threading
+import time
+import unittest
+from collections import Counter
+from unittest.mock import patch, MagicMock
+import db
+
+try:
+    import db_async
+except ImportError:  # asyncpg не установлен
+    db_async = None
+
+
+class FakeCursor:
+    """Курсор-заглушка: отвечает на запросы выборки по заранее заданным данным"""
+    def __init__(self, tree_rows, top_count=None, sampled_counts=None):
+        self.tree_rows = tree_rows
+        self.rows_by_id = {row[0]: row for row in tree_rows}
+        # Число элементов первых трех уровней (по умолчанию - все строки)
+        self.top_count = len(tree_rows) if top_count is None else top_count
+        # Сколько строк вернет каждый очередной TABLESAMPLE (по умолчанию - все)
+        self.sampled_counts = list(sampled_counts or [])
+        self.executed = []
+        self._result = []
+
+    def execute(self, query, params=None):
+        self.executed.append((query, params))
+        if 'count(*)' in query:
+            self._result = [(self.top_count,)]
+        elif 'TABLESAMPLE' in query:
+            count = self.sampled_counts.pop(0) if self.sampled_counts else len(self.tree_rows)
+            self._result = self.tree_rows[:count]
+        elif 'WITH RECURSIVE parents' in query or 'WITH RECURSIVE children' in query:
+            self._result = []
+        elif 'WITH RECURSIVE tree' in query:
+            self._result = [(row[0],) for row in self.tree_rows]
+        elif 'ANY' in query:
+            self._result = [self.rows_by_id[item_id] for item_id in params[0]]
+        else:
+            self._result = []
+
+    def fetchone(self):
+        return self._result[0] if self._result else None
+
+    def fetchall(self):
+        return list(self._result)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+class TestItemsSample(unittest.TestCase):
+    def setUp(self):
+        db.clear_subtree_cache()
+        self.rows = [(f"id-{i}", None if i == 0 else "id-0", f"текст {i}") for i in range(20)]
+        self.sample_size = 5
+
+    def _connection(self, cursor):
+        conn = MagicMock()
+        conn.__enter__.return_value = conn
+        conn.cursor.return_value = cursor
+        return conn
+
+    def _run_sampling(self, cursor, root_id=None, runs=4000):
+        """Многократно делает выборку и считает, сколько раз выпал каждый id"""
+        counts = Counter()
+        with patch('db.get_connection', return_value=self._connection(cursor)):
+            for _ in range(runs):
+                items = db.get_items_sample(1, self.sample_size, root_id=root_id)
+                ids = [item['item'][0] for item in items]
+                # Выборка без повторов и нужного размера, как у ORDER BY RANDOM() LIMIT n
+                self.assertEqual(len(ids), self.sample_size)
+                self.assertEqual(len(set(ids)), self.sample_size)
+                counts.update(ids)
+        return counts
+
+    def assertUniform(self, counts, runs):
+        """Каждый элемент должен попадать в выборку с вероятностью sample_size / N"""
+        expected = runs * self.sample_size / len(self.rows)
+        self.assertEqual(set(counts), {row[0] for row in self.rows})
+        for item_id, count in counts.items():
+            self.assertLess(abs(count - expected) / expected, 0.15, f"{item_id}: {count} vs {expected}")
+
+    def test_unscoped_sample_uses_tablesample(self):
+        cursor = FakeCursor(self.rows)
+        counts = self._run_sampling(cursor, runs=4000)
+        self.assertUniform(counts, 4000)
+
+        queries = [query for query, _ in cursor.executed]
+        self.assertTrue(any('TABLESAMPLE BERNOULLI' in q for q in queries))
+        self.assertFalse(any('ORDER BY RANDOM()' in q for q in queries))
+
+    def test_unscoped_sample_grows_percent_when_short(self):
+        cursor = FakeCursor(self.rows, top_count=1000, sampled_counts=[2, 20])
+        with patch('db.get_connection', return_value=self._connection(cursor)):
+            items = db.get_items_sample(1, self.sample_size)
+
+        self.assertEqual(len(items), self.sample_size)
+        percents = [params[0] for query, params in cursor.executed if 'TABLESAMPLE' in query]
+        self.assertEqual(len(percents), 2)
+        self.assertGreater(percents[1], percents[0])
+
+    def test_percent_comes_from_cached_top_levels_count(self):
+        cursor = FakeCursor(self.rows, top_count=400)
+        with patch('db.get_connection', return_value=self._connection(cursor)), \
+                patch.dict('db.DB_SETTINGS', {'sample_oversample': 4}):
+            for _ in range(3):
+                db.get_items_sample(1, self.sample_size)
+        percents = [params[0] for query, params in cursor.executed if 'TABLESAMPLE' in query]
+        # 5 элементов * запас 4 из 400 элементов верхних уровней
+        self.assertEqual(percents, [5.0] * 3)
+        self.assertEqual(sum(1 for query, _ in cursor.executed if 'count(*)' in query), 1)
+
+    def test_scoped_sample_is_uniform_and_cached(self):
+        cursor = FakeCursor(self.rows)
+        counts = self._run_sampling(cursor, root_id='id-0', runs=4000)
+        self.assertUniform(counts, 4000)
+
+        # Поддерево обходится один раз, дальше используется кэш id
+        tree_queries = [q for q, _ in cursor.executed if 'WITH RECURSIVE tree' in q]
+        self.assertEqual(len(tree_queries), 1)
+
+    def test_small_tree_returns_everything(self):
+        cursor = FakeCursor(self.rows[:3])
+        with patch('db.get_connection', return_value=self._connection(cursor)):
+            items = db.get_items_sample(1, self.sample_size, root_id='id-0')
+        self.assertEqual(sorted(item['item'][0] for item in items), ['id-0', 'id-1', 'id-2'])
+
+
+class TreeCursor:
+    """Курсор-заглушка, который выполняет запросы контекста над деревом в памяти"""
+    def __init__(self, rows):
+        self.rows = {row[0]: row for row in rows}
+        self.executed = []
+        self._result = []
+
+    def execute(self, query, params=None):
+        self.executed.append(query)
+        ids, depth = params[0], params[1] if len(params) > 1 else None
+        if 'WITH RECURSIVE parents' in query:
+            self._result = []
+            for origin_id in sorted(ids):
+                parent_id = self.rows[origin_id][1]
+                for _ in range(depth):
+                    if parent_id not in self.rows:
+                        break
+                    self._result.append((origin_id,) + self.rows[parent_id])
+                    parent_id = self.rows[parent_id][1]
+        elif 'WITH RECURSIVE children' in query:
+            self._result = []
+            for origin_id in sorted(ids):
+                level = [origin_id]
+                for _ in range(depth):
+                    level = [row[0] for row in self.rows.values() if row[1] in level]
+                    self._result.extend((origin_id,) + self.rows[child_id] for child_id in level)
+        else:
+            self._result = [self.rows[item_id] for item_id in ids if item_id in self.rows]
+
+    def fetchall(self):
+        return list(self._result)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+class TestItemsWithContext(unittest.TestCase):
+    def setUp(self):
+        # Цепочка a -> b -> c -> d и отдельная ветка a -> e
+        self.rows = [
+            ('a', None, 'A'), ('b', 'a', 'B'), ('c', 'b', 'C'),
+            ('d', 'c', 'D'), ('e', 'a', 'E'),
+        ]
+        self.cursor = TreeCursor(self.rows)
+        conn = MagicMock()
+        conn.__enter__.return_value = conn
+        conn.cursor.return_value = self.cursor
+        self.conn = conn
+
+    def test_batched_context_uses_constant_queries(self):
+        with patch('db.get_connection', return_value=self.conn):
+            result = db.get_items_with_context(['c', 'a', 'd', 'missing'], parent_depth=2, child_depth=2)
+
+        # Один запрос элементов и по одному рекурсивному на направление
+        self.assertEqual(len(self.cursor.executed), 3)
+        self.assertEqual(set(result), {'a', 'c', 'd'})
+        self.assertEqual([p[0] for p in result['d']['parents']], ['c', 'b'])
+        self.assertEqual([p[0] for p in result['c']['parents']], ['b', 'a'])
+        self.assertEqual([c[0] for c in result['a']['children']], ['b', 'e', 'c'])
+        self.assertEqual(result['a']['parents'], [])
+
+    def test_single_item_wrapper(self):
+        with patch('db.get_connection', return_value=self.conn):
+            result = db.get_item_with_context('b', parent_depth=1)
+        self.assertEqual(result['item'], ('b', 'a', 'B'))
+        self.assertEqual(result['parents'], [('a', None, 'A')])
+        self.assertEqual(result['children'], [])
+        self.assertEqual(len(self.cursor.executed), 2)
+
+
+class TestServerCursors(unittest.TestCase):
+    def _connection(self, rows):
+        named_cursor = MagicMock()
+        named_cursor.__enter__.return_value = named_cursor
+        named_cursor.__iter__.return_value = iter(rows)
+        named_cursor.description = [('id',), ('id_parent',), ('txt',)]
+        conn = MagicMock()
+        conn.__enter__.return_value = conn
+        conn.cursor.return_value = named_cursor
+        return conn, named_cursor
+
+    def test_iter_query_streams_through_named_cursor(self):
+        rows = [('a', None, 'x'), ('b', 'a', 'y')]
+        conn, cursor = self._connection(rows)
+        with patch('db.get_connection', return_value=conn):
+            stream = db.iter_query("SELECT id, id_parent, txt FROM items", itersize=50)
+            # Генератор ленивый: до первой итерации подключение не открывается
+            conn.cursor.assert_not_called()
+            self.assertEqual(next(stream), rows[0])
+            self.assertEqual(list(stream), rows[1:])
+
+        self.assertTrue(conn.cursor.call_args.kwargs['name'].startswith('stream_'))
+        self.assertEqual(cursor.itersize, 50)
+
+    def test_iter_query_as_dict(self):
+        conn, _ = self._connection([('a', None, 'x')])
+        with patch('db.get_connection', return_value=conn):
+            rows = list(db.iter_query("SELECT * FROM items LIMIT 5", as_dict=True))
+        self.assertEqual(rows, [{'id': 'a', 'id_parent': None, 'txt': 'x'}])
+
+    def test_search_text_context_comes_with_each_row(self):
+        rows = [('b', 'a', 'найдено', [['a', None, 'корень']], [['c', 'b', 'дочерний']])]
+        conn, cursor = self._connection(rows)
+        with patch('db.get_connection', return_value=conn):
+            results = list(db.iter_search_text('найдено', context=1))
+        self.assertEqual(results, [{'item': ('b', 'a', 'найдено'), 'parents': [('a', None, 'корень')],
+                                    'children': [('c', 'b', 'дочерний')]}])
+        # Один потоковый запрос, без запросов контекста на каждую строку
+        self.assertEqual(cursor.execute.call_count, 1)
+        self.assertEqual(cursor.execute.call_args.args[1], {'pattern': '%найдено%', 'context': 1})
+
+
+class TestPreparedStatements(unittest.TestCase):
+    def _cursor(self):
+        cur = MagicMock()
+        cur.connection.prepared_statements = set()
+        cur.connection.autocommit = False
+        return cur
+
+    def setUp(self):
+        db._unpreparable.clear()
+        self.addCleanup(db._unpreparable.clear)
+
+    def test_prepare_sql_numbers_parameters(self):
+        sql = db._prepare_sql('keyword_search_in_tree')
+        self.assertTrue(sql.startswith("PREPARE keyword_search_in_tree (text, text[], bigint) AS"))
+        self.assertIn("WHERE id = $1::uuid", sql)
+        self.assertIn("ILIKE ANY($2)", sql)
+        self.assertIn("LIMIT $3", sql)
+        self.assertNotIn("%s", sql)
+
+    def test_statement_is_prepared_once_per_connection(self):
+        cur = self._cursor()
+        db.execute_prepared(cur, 'item_by_id', ('a',))
+        db.execute_prepared(cur, 'item_by_id', ('b',))
+
+        statements = [call.args[0] for call in cur.execute.call_args_list]
+        self.assertEqual(sum(s.startswith('PREPARE item_by_id') for s in statements), 1)
+        self.assertEqual(cur.execute.call_args_list[-1].args, ("EXECUTE item_by_id (%s)", ('b',)))
+        self.assertIn('item_by_id', cur.connection.prepared_statements)
+
+        # Новое подключение из пула готовит оператор заново
+        other = self._cursor()
+        db.execute_prepared(other, 'item_by_id', ('c',))
+        self.assertTrue(any(call.args[0].startswith('PREPARE item_by_id') for call in other.execute.call_args_list))
+
+    def test_id_parameters_are_cast_to_uuid(self):
+        self.assertIn("WHERE id = ANY($1::uuid[])", db._prepare_sql('items_by_ids'))
+        self.assertIn("WHERE child.id = ANY($1::uuid[])", db._prepare_sql('context_parents'))
+        self.assertIn("VALUES ($1::uuid,", db._prepare_sql('upsert_embedding'))
+
+    def test_failed_prepare_falls_back_to_plain_execute(self):
+        cur = self._cursor()
+
+        def execute(query, params=None):
+            if query.startswith('PREPARE'):
+                raise db.psycopg2.ProgrammingError("operator does not exist: uuid = text")
+
+        cur.execute.side_effect = execute
+        db.execute_prepared(cur, 'item_by_id', ('a',))
+        db.execute_prepared(cur, 'item_by_id', ('b',))
+        statements = [call.args[0] for call in cur.execute.call_args_list]
+        self.assertEqual(statements[:3], ["SAVEPOINT prepare_statement", db._prepare_sql('item_by_id'),
+                                          "ROLLBACK TO SAVEPOINT prepare_statement"])
+        # Подготовка не повторяется, оба вызова выполнены обычным запросом
+        self.assertEqual(sum(s.startswith('PREPARE') for s in statements), 1)
+        self.assertEqual(cur.execute.call_args_list[-1].args, (db.PREPARED_STATEMENTS['item_by_id'][1], ('b',)))
+        self.assertNotIn('item_by_id', cur.connection.prepared_statements)
+
+    def test_plain_execute_when_disabled(self):
+        cur = self._cursor()
+        with patch.dict('db.DB_SETTINGS', {'use_prepared_statements': False}):
+            db.execute_prepared(cur, 'config_value', ('similarity_threshold',))
+        query, params = cur.execute.call_args.args
+        self.assertIn("SELECT value FROM config WHERE name = %s", query)
+        self.assertEqual(params, ('similarity_threshold',))
+
+
+class TestConnectionPool(unittest.TestCase):
+    def test_connection_returns_to_pool(self):
+        pool = MagicMock()
+        conn = pool.getconn.return_value
+        conn.closed = 0
+        with patch('db._get_pool', return_value=pool):
+            with db.get_connection() as got:
+                self.assertIs(got, conn)
+        conn.commit.assert_called_once()
+        pool.putconn.assert_called_once_with(conn, close=False)
+
+    def test_connection_rolls_back_on_error(self):
+        pool = MagicMock()
+        conn = pool.getconn.return_value
+        conn.closed = 0
+        with patch('db._get_pool', return_value=pool):
+            with self.assertRaises(RuntimeError):
+                with db.get_connection():
+                    raise RuntimeError("ошибка запроса")
+        conn.rollback.assert_called_once()
+        conn.commit.assert_not_called()
+        pool.putconn.assert_called_once_with(conn, close=False)
+
+
+class TestBoundedConnectionPool(unittest.TestCase):
+    def setUp(self):
+        patcher = patch('psycopg2.pool.psycopg2.connect', side_effect=lambda *args, **kwargs: MagicMock(closed=0))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.pool = db.BoundedConnectionPool(0, 2, timeout=5)
+
+    def test_exhausted_pool_raises_after_timeout(self):
+        self.pool.getconn()
+        self.pool.getconn()
+        start = time.monotonic()
+        with self.assertRaises(db.pg_pool.PoolError):
+            self.pool.getconn(timeout=0.05)
+        self.assertGreaterEqual(time.monotonic() - start, 0.04)
+
+    def test_waits_for_returned_connection(self):
+        first = self.pool.getconn()
+        self.pool.getconn()
+        threading.Timer(0.05, self.pool.putconn, args=(first,)).start()
+        # Вместо немедленного PoolError getconn дожидается возврата подключения
+        self.assertIsNotNone(self.pool.getconn())
+
+    def test_failed_connect_frees_slot(self):
+        with patch('psycopg2.pool.psycopg2.connect', side_effect=db.psycopg2.OperationalError("down")):
+            for _ in range(3):
+                with self.assertRaises(db.psycopg2.OperationalError):
+                    self.pool.getconn(timeout=0)
+        self.pool.getconn(timeout=0)
+        self.pool.getconn(timeout=0)
+
+
+class TestBulkWrite(unittest.TestCase):
+    def setUp(self):
+        db._column_types_cache.clear()
+        self.addCleanup(db._column_types_cache.clear)
+
+    def _rows(self, count):
+        return [(f"id{i}", f"текст {i}", f"h{i}", [0.5, -1.0, 2.0], 'model', '1.0') for i in range(count)]
+
+    def test_small_batch_uses_execute_values(self):
+        cur = MagicMock()
+        with patch('db.execute_values') as values, patch.dict('db.DB_SETTINGS', {'bulk_copy_threshold': 10}):
+            count = db._upsert_embeddings(cur, self._rows(3) + self._rows(1))
+        self.assertEqual(count, 3)  # повтор ключа схлопнут
+        sql, rows = values.call_args.args[1:3]
+        self.assertIn('ON CONFLICT (item_id, model, model_version) DO UPDATE', sql)
+        self.assertEqual(rows[0][3], '[0.5,-1.0,2.0]')
+        cur.copy_expert.assert_not_called()
+
+    def test_large_batch_goes_through_binary_copy(self):
+        cur = MagicMock()
+        cur.rowcount = 5
+        buffers = []
+        cur.copy_expert.side_effect = lambda sql, buffer: buffers.append((sql, buffer.getvalue()))
+        settings = {'bulk_copy_threshold': 2, 'bulk_batch_size': 2, 'bulk_copy_binary': True}
+        with patch('db.execute_values') as values, patch.dict('db.DB_SETTINGS', settings):
+            count = db._upsert_embeddings(cur, iter(self._rows(5)))
+        values.assert_not_called()
+        self.assertEqual(count, 5)
+        # 5 строк порциями по 2: три COPY в одну временную таблицу и одно слияние
+        self.assertEqual(len(buffers), 3)
+        sql, data = buffers[0]
+        self.assertIn('COPY embeddings_staging', sql)
+        self.assertIn('FORMAT binary', sql)
+        self.assertTrue(data.startswith(b'PGCOPY\n\xff\r\n\x00'))
+        self.assertIn(struct.pack('>hh3f', 3, 0, 0.5, -1.0, 2.0), data)
+        merge = cur.execute.call_args_list[-1].args[0]
+        self.assertIn('INSERT INTO embeddings', merge)
+        self.assertIn('ON CONFLICT (item_id, model, model_version) DO UPDATE', merge)
+
+    def test_merge_casts_to_target_column_types(self):
+        cur = MagicMock()
+        cur.fetchall.return_value = [('id', 'uuid'), ('id_parent', 'uuid'), ('txt', 'text'), ('area', 'real'),
+                                     ('style', 'text'), ('created_at', 'timestamp without time zone')]
+        rows = [(f"00000000-0000-0000-0000-00000000000{i}", None, f"текст {i}", '1.5', None) for i in range(3)]
+        with patch.dict('db.DB_SETTINGS', {'bulk_copy_threshold': 2, 'bulk_copy_binary': False}), \
+                patch('db._notify_items_changed'):
+            db._upsert_items(cur, rows)
+            merge = cur.execute.call_args_list[-1].args[0]
+            # Типы целевой таблицы читаются из каталога один раз
+            db._upsert_items(cur, rows)
+        self.assertIn("SELECT DISTINCT ON (id) id::uuid, id_parent::uuid, txt::text, area::real, style::text", merge)
+        self.assertEqual(sum('pg_attribute' in call.args[0] for call in cur.execute.call_args_list), 1)
+
+    def test_text_copy_escapes_values(self):
+        self.assertEqual(db._encode_text_field('text', 'a\tb\nc\\'), 'a\\tb\\nc\\\\')
+        self.assertEqual(db._encode_text_field('text', None), '\\N')
+        self.assertEqual(db._encode_text_field('vector', [1, 2]), '[1.0,2.0]')
+
+
+class TestReplicaRouting(unittest.TestCase):
+    def setUp(self):
+        self.pools = {None: MagicMock(name='primary'), 0: MagicMock(name='replica0'), 1: MagicMock(name='replica1')}
+        for pool in self.pools.values():
+            pool.getconn.return_value.closed = 0
+        patchers = [
+            patch('db._get_pool', side_effect=lambda replica=None: self.pools[replica]),
+            patch('db.DB_REPLICAS', ['replica0', 'replica1']),
+            patch.dict('db._replica_ejected', clear=True),
+            patch('db._replica_next', 0),
+            patch('db._thread_state', type('State', (), {})()),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _connection(self, readonly):
+        with db.get_connection(readonly=readonly) as conn:
+            return conn
+
+    def test_reads_round_robin_across_replicas(self):
+        conns = [self._connection(readonly=True) for _ in range(4)]
+        replica0 = self.pools[0].getconn.return_value
+        replica1 = self.pools[1].getconn.return_value
+        self.assertEqual(conns, [replica0, replica1, replica0, replica1])
+        self.pools[None].getconn.assert_not_called()
+
+    def test_unhealthy_replica_is_ejected(self):
+        self.pools[0].getconn.side_effect = db.psycopg2.OperationalError("connection refused")
+        conns = [self._connection(readonly=True) for _ in range(3)]
+        self.assertEqual(conns, [self.pools[1].getconn.return_value] * 3)
+        # Исключенная реплика больше не опрашивается до истечения интервала
+        self.assertEqual(self.pools[0].getconn.call_count, 1)
+
+    def test_falls_back_to_primary_when_all_replicas_down(self):
+        for replica in (0, 1):
+            self.pools[replica].getconn.side_effect = db.psycopg2.OperationalError("down")
+        self.assertIs(self._connection(readonly=True), self.pools[None].getconn.return_value)
+
+    def test_read_after_write_stays_on_primary(self):
+        primary = self.pools[None].getconn.return_value
+        self.assertIs(self._connection(readonly=False), primary)
+        self.assertIs(self._connection(readonly=True), primary)
+        with patch.dict('db.DB_SETTINGS', {'read_your_writes_window': 0}):
+            self.assertIs(self._connection(readonly=True), self.pools[0].getconn.return_value)
+
+    def test_primary_connection_without_write_keeps_reads_on_replicas(self):
+        with db.get_connection(write=False):
+            pass
+        self.assertIs(self._connection(readonly=True), self.pools[0].getconn.return_value)
+
+    def test_existing_text_index_is_checked_without_write(self):
+        cursor = self.pools[0].getconn.return_value.cursor.return_value.__enter__.return_value
+        cursor.fetchone.return_value = ('idx_items_txt',)
+        self.assertTrue(db.ensure_text_search_index())
+        self.pools[None].getconn.assert_not_called()
+        self.assertIs(self._connection(readonly=True), self.pools[1].getconn.return_value)
+
+    def test_worker_threads_inherit_recent_write(self):
+        primary = self.pools[None].getconn.return_value
+        conns = []
+
+        def read():
+            conns.append(self._connection(readonly=True))
+
+        with patch('db._thread_state', threading.local()):
+            self._connection(readonly=False)
+            for task in (read, db.carry_write_state(read)):
+                worker = threading.Thread(target=task)
+                worker.start()
+                worker.join()
+        # Без переноса отметки поток читает с реплики, с переносом - с основного сервера
+        self.assertEqual(conns, [self.pools[0].getconn.return_value, primary])
+
+
+@unittest.skipUnless(os.getenv('TEST_PRIMARY_DSN') and os.getenv('TEST_REPLICA_DSN'),
+                     "нужны TEST_PRIMARY_DSN и TEST_REPLICA_DSN двух локальных экземпляров PostgreSQL")
+class TestReplicaRoutingIntegration(unittest.TestCase):
+    def test_reads_go_to_replica_and_writes_to_primary(self):
+        db.close_pool()
+        self.addCleanup(db.close_pool)
+        query = "SELECT inet_server_addr()::text || ':' || current_setting('port')"
+        with patch('db.DB_CONFIG', {'dsn': os.environ['TEST_PRIMARY_DSN']}), \
+                patch('db.DB_REPLICAS', [os.environ['TEST_REPLICA_DSN']]), \
+                patch.dict('db.DB_SETTINGS', {'read_your_writes_window': 0}):
+            with db.get_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(query)
+                    primary = cur.fetchone()[0]
+            with db.get_connection(readonly=True) as conn:
+                with conn.cursor() as cur:
+                    cur.execute(query)
+                    replica = cur.fetchone()[0]
+        self.assertNotEqual(primary, replica)
+
+
+class FakeAsyncConnection:
+    """Подключение asyncpg-заглушка: отвечает на запросы по дереву в памяти через TreeCursor"""
+    def __init__(self, rows, delay=0.0):
+        self.cursor = TreeCursor(rows)
+        self.delay = delay
+
+    async def fetch(self, query, *params):
+        await asyncio.sleep(self.delay)
+        self.cursor.execute(query, params)
+        return self.cursor.fetchall()
+
+
+@unittest.skipIf(db_async is None, "asyncpg не установлен")
+class TestAsyncDb(unittest.TestCase):
+    rows = [('a', None, 'A'), ('b', 'a', 'B'), ('c', 'b', 'C'), ('e', 'a', 'E')]
+
+    def _patch_connection(self, conn):
+        @db_async.asynccontextmanager
+        async def acquire(readonly=False):
+            yield conn
+        return patch('db_async.acquire', acquire)
+
+    def test_items_with_context_matches_sync_version(self):
+        conn = FakeAsyncConnection(self.rows)
+        with self._patch_connection(conn):
+            result = asyncio.run(db_async.get_items_with_context(['c', 'a'], parent_depth=2, child_depth=1))
+
+        sync_conn = MagicMock()
+        sync_conn.__enter__.return_value = sync_conn
+        sync_conn.cursor.return_value = TreeCursor(self.rows)
+        with patch('db.get_connection', return_value=sync_conn):
+            expected = db.get_items_with_context(['c', 'a'], parent_depth=2, child_depth=1)
+        self.assertEqual(result, expected)
+        self.assertEqual(len(conn.cursor.executed), 3)
+
+    def test_queries_run_concurrently(self):
+        conn = FakeAsyncConnection(self.rows, delay=0.2)
+
+        async def run():
+            return await asyncio.gather(*[db_async.get_items_with_context(['c']) for _ in range(5)])
+
+        with self._patch_connection(conn):
+            start = time.perf_counter()
+            results = asyncio.run(run())
+            elapsed = time.perf_counter() - start
+        self.assertEqual(len(results), 5)
+        # Пять запросов по 0.2 с выполняются одновременно, а не друг за другом
+        self.assertLess(elapsed, 0.6)
+
+    def test_pools_are_per_event_loop(self):
+        created = []
+
+        async def create_pool(**params):
+            created.append(MagicMock(close=MagicMock(side_effect=lambda: asyncio.sleep(0))))
+            return created[-1]
+
+        async def run():
+            first = await db_async.get_pool()
+            self.assertIs(await db_async.get_pool(), first)
+            await db_async.close_pool()
+            return first
+
+        with patch('db_async.asyncpg.create_pool', create_pool), patch.dict('db_async._pools', clear=True):
+            pools = [asyncio.run(run()) for _ in range(2)]
+            self.assertEqual(db_async._pools, {})
+        # Второй asyncio.run получает новый пул, а не пул закрытого цикла
+        self.assertEqual(pools, created)
+        self.assertIsNot(pools[0], pools[1])
+        for pool in created:
+            pool.close.assert_called_once()
+
+    def test_replica_ejected_on_query_error(self):
+        pool = MagicMock()
+        pool.acquire.side_effect = lambda: asyncio.sleep(0, result='conn')
+        pool.release.side_effect = lambda conn: asyncio.sleep(0)
+
+        async def get_pool(replica=None):
+            return pool
+
+        async def run():
+            async with db_async.acquire(readonly=True):
+                raise db_async.asyncpg.ConnectionDoesNotExistError("connection was closed")
+
+        with patch('db_async.get_pool', get_pool), patch('db_async.DB_REPLICAS', ['replica0']), \
+                patch('db_async._recent_write', return_value=False), \
+                patch('db_async._next_replica', return_value=0), patch('db_async._eject_replica') as eject:
+            with self.assertRaises(db_async.asyncpg.ConnectionDoesNotExistError):
+                asyncio.run(run())
+        self.assertEqual(eject.call_args.args[0], 0)
+        pool.release.assert_called_once_with('conn')
+
+    def test_connect_params_from_db_config(self):
+        params = db_async._connect_params({'dbname': 'maymun', 'user': 'u', 'host': 'h', 'port': '5433'})
+        self.assertEqual(params, {'database': 'maymun', 'user': 'u', 'host': 'h', 'port': 5433})
+        self.assertEqual(db_async._connect_params('postgresql://h/db'), {'dsn': 'postgresql://h/db'})
+
+
+if __name__ == '__main__':
+    unittest.main()
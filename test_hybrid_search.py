@@ -0,0 +1,75 @@
+import time
+import unittest
+from unittest.mock import patch
+import hybrid_search
+from hybrid_search import reciprocal_rank_fusion, hybrid_search as run_hybrid_search
+
+
+def fake_contexts(item_ids, parent_depth=0, child_depth=0):
+    return {item_id: {'item': (item_id, None, f"текст {item_id}"), 'parents': [], 'children': []}
+            for item_id in item_ids}
+
+
+class TestReciprocalRankFusion(unittest.TestCase):
+    def test_scores_and_order(self):
+        fused = reciprocal_rank_fusion(
+            {'bm25': ['a', 'b', 'c'], 'vector': ['c', 'a', 'd']},
+            {'bm25': 1.0, 'vector': 1.0}, k=60)
+        scores = {item_id: score for item_id, score, _ in fused}
+        self.assertAlmostEqual(scores['a'], 1 / 61 + 1 / 62)
+        self.assertAlmostEqual(scores['c'], 1 / 63 + 1 / 61)
+        self.assertEqual([item_id for item_id, _, _ in fused], ['a', 'c', 'b', 'd'])
+        self.assertEqual(fused[0][2], {'bm25': 1, 'vector': 2})
+
+    def test_weights_and_duplicates(self):
+        fused = reciprocal_rank_fusion(
+            {'bm25': ['a', 'a', 'b'], 'keywords': ['b']}, {'bm25': 1.0, 'keywords': 0.5}, k=60)
+        scores = {item_id: score for item_id, score, _ in fused}
+        self.assertAlmostEqual(scores['a'], 1 / 61)
+        self.assertAlmostEqual(scores['b'], 1 / 62 + 0.5 / 61)
+
+
+class TestHybridSearch(unittest.TestCase):
+    def _branches(self, delay=0.0, **rankings):
+        def make(ids):
+            def branch(query, keywords, limit, root_id):
+                time.sleep(delay)
+                if isinstance(ids, Exception):
+                    raise ids
+                return list(ids)[:limit]
+            return branch
+        return {name: make(ids) for name, ids in rankings.items()}
+
+    def test_branches_run_in_parallel(self):
+        branches = self._branches(delay=0.3, fulltext=['a'], bm25=['b'], vector=['c'], keywords=['a'])
+        with patch.dict('hybrid_search.BRANCHES', branches, clear=True), \
+                patch('hybrid_search.get_items_with_context', side_effect=fake_contexts):
+            start = time.perf_counter()
+            items = run_hybrid_search('запрос', ['слово'])
+            elapsed = time.perf_counter() - start
+        self.assertLess(elapsed, 0.6)
+        self.assertEqual([item['item'][0] for item in items], ['a', 'b', 'c'])
+        self.assertEqual(items[0]['sources'], {'fulltext': 1, 'keywords': 1})
+
+    def test_failed_branch_is_skipped(self):
+        branches = self._branches(fulltext=RuntimeError("нет индекса"), bm25=['b', 'a'])
+        stats = {}
+        with patch.dict('hybrid_search.BRANCHES', branches, clear=True), \
+                patch('hybrid_search.get_items_with_context', side_effect=fake_contexts):
+            items = run_hybrid_search('запрос', stats=stats)
+        self.assertEqual([item['item'][0] for item in items], ['b', 'a'])
+        self.assertIn('error', stats['branches']['fulltext'])
+
+    def test_disabled_branch_is_not_called(self):
+        branches = self._branches(fulltext=['a'], vector=RuntimeError("не должна вызываться"))
+        weights = {'fulltext': 1.0, 'vector': 0}
+        with patch.dict('hybrid_search.BRANCHES', branches, clear=True), \
+                patch.dict('hybrid_search.SEARCH_SETTINGS', {'hybrid_weights': weights}), \
+                patch('hybrid_search.get_items_with_context', side_effect=fake_contexts):
+            stats = {}
+            run_hybrid_search('запрос', stats=stats)
+        self.assertEqual(set(stats['branches']), {'fulltext'})
+
+
+if __name__ == '__main__':
+    unittest.main()
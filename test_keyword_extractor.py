@@ -0,0 +1,72 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+from keyword_extractor import KeywordExtractor, TermStats
+
+CORPUS = [
+    "Резервное копирование базы выполняется каждую ночь.",
+    "Резервное копирование настраивается администратором.",
+    "Резервное копирование проверяется раз в неделю.",
+    "База данных работает на сервере.",
+    "Сервер стоит в серверной.",
+    "Пропуск нужен для доступа в серверную.",
+    "Отпуск согласуется с руководителем.",
+    "Руководитель утверждает график отпусков.",
+]
+
+class TestKeywordExtractor(unittest.TestCase):
+    def setUp(self):
+        self.stats = TermStats.build(CORPUS, min_bigram_count=3)
+        self.extractor = KeywordExtractor(self.stats, max_df_ratio=0.5, min_collocation_count=3, min_pmi=0.5)
+
+    def test_build_stats(self):
+        self.assertEqual(self.stats.docs, len(CORPUS))
+        self.assertEqual(self.stats.df['сервер'], 2)
+        self.assertEqual(self.stats.bigrams, {'резервн копирован': 3})
+
+    def test_terms_ranked_by_idf(self):
+        # "где", "как" - стоп-слова, "получить" нет в корпусе; реже встречающиеся слова - первыми
+        self.assertEqual(self.extractor.extract('Где стоит сервер и как получить пропуск?'),
+                         ['стоит', 'пропуск', 'сервер'])
+
+    def test_collocation_becomes_phrase(self):
+        # PMI пары = ln(8 * 3 / (3 * 3)) ~ 0.98
+        self.assertEqual(self.extractor.extract('Когда выполняется резервное копирование базы?'),
+                         ['резервное копирование', 'выполняется', 'базы'])
+
+    def test_unknown_words_fallback(self):
+        self.assertEqual(self.extractor.extract('Покажи квантовые вычисления'), ['покажи', 'квантовые', 'вычисления'])
+
+    def test_save_load(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'stats.json')
+            self.stats.save(path)
+            loaded = TermStats.load(path)
+        self.assertEqual((loaded.docs, loaded.df, loaded.bigrams), (self.stats.docs, self.stats.df, self.stats.bigrams))
+
+    def test_generate_keywords_dispatch(self):
+        from keywords import generate_keywords_for_query
+        with patch('keyword_extractor.get_extractor', return_value=self.extractor), \
+                patch('keywords.generate_keywords_llm') as llm:
+            self.assertEqual(generate_keywords_for_query('пропуск в серверную', method='local'), ['пропуск', 'серверную'])
+            llm.assert_not_called()
+        with patch('keyword_extractor.get_extractor', side_effect=FileNotFoundError), \
+                patch('keywords.generate_keywords_llm', return_value=['llm']):
+            self.assertEqual(generate_keywords_for_query('пропуск', method='local'), ['llm'])
+
+    def test_corrupt_stats_fall_back_to_llm(self):
+        from keywords import generate_keywords_for_query
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'stats.json')
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write('{"docs": 8, "df": {')
+            for error in (lambda: TermStats.load(path), PermissionError):
+                with patch('keyword_extractor.get_extractor', side_effect=error), \
+                        patch('keywords.generate_keywords_llm', return_value=['llm']), \
+                        self.assertLogs('keywords', level='ERROR'):
+                    self.assertEqual(generate_keywords_for_query('пропуск', method='local'), ['llm'])
+
+
+if __name__ == '__main__':
+    unittest.main()
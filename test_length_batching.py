@@ -0,0 +1,52 @@
+import unittest
+from length_batching import (LengthBucketedReranker, head_tail_sizes, length_buckets, padded_tokens,
+                             token_offsets, truncate_head_tail)
+
+
+class FakeModel:
+    tokenizer = None
+
+    def __init__(self):
+        self.batches = []
+
+    def compute_score(self, pairs, batch_size=64):
+        self.batches.append(list(pairs))
+        scores = [float(len(text.split())) for _, text in pairs]
+        return scores[0] if len(scores) == 1 else scores
+
+
+class TestLengthBatching(unittest.TestCase):
+    def test_head_tail_truncation(self):
+        text = 'раз два три четыре пять шесть семь восемь'
+        offsets = token_offsets(None, [text])[0]
+        self.assertEqual(head_tail_sizes(8, 4, 0.75), (3, 1))
+        self.assertEqual(truncate_head_tail(text, offsets, 4, 0.75), ('раз два три\nвосемь', 4))
+        self.assertEqual(truncate_head_tail(text, offsets, 10, 0.75), (text, 8))
+        self.assertEqual(truncate_head_tail(text, offsets, 2, 0.0), ('семь восемь', 2))
+
+    def test_buckets_group_similar_lengths(self):
+        lengths = [100, 5, 90, 6, 7, 95]
+        buckets = length_buckets(lengths, max_batch_size=3)
+        self.assertEqual(buckets, [[1, 3, 4], [2, 5, 0]])
+        arrival = [[0, 1, 2], [3, 4, 5]]
+        self.assertLess(padded_tokens(lengths, buckets), padded_tokens(lengths, arrival))
+
+    def test_token_budget_splits_long_pairs(self):
+        lengths = [10, 10, 10, 10, 500, 500]
+        buckets = length_buckets(lengths, max_batch_size=64, max_batch_tokens=1000)
+        self.assertEqual(buckets, [[0, 1, 2, 3], [4, 5]])
+        self.assertEqual(length_buckets(lengths, 64, 600), [[0, 1, 2, 3], [4], [5]])
+
+    def test_scores_restored_to_original_order(self):
+        model = FakeModel()
+        reranker = LengthBucketedReranker(model, max_length=20, head_ratio=0.5, max_batch_tokens=10000)
+        texts = ['a ' * 30, 'b', 'c c c', 'd d']
+        scores = reranker.compute_score([['q', text] for text in texts], batch_size=2)
+        # Первый текст обрезан до 20 - 1 - 4 = 15 токенов
+        self.assertEqual(scores, [15.0, 1.0, 3.0, 2.0])
+        self.assertEqual([[text for _, text in batch] for batch in model.batches][0], ['b', 'd d'])
+        self.assertEqual(reranker.compute_score(['q', 'x y']), 2.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
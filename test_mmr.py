@@ -0,0 +1,49 @@
+import unittest
+from unittest.mock import patch
+import numpy as np
+from mmr import diversify, lexical_vectors, mmr_select, relevance_scores, similarity_matrix
+
+
+class TestMMR(unittest.TestCase):
+    def test_near_duplicate_is_skipped(self):
+        relevance = np.array([1.0, 0.95, 0.5])
+        similarity = np.array([
+            [1.0, 0.99, 0.1],
+            [0.99, 1.0, 0.1],
+            [0.1, 0.1, 1.0],
+        ])
+        self.assertEqual(mmr_select(relevance, similarity, 2, 0.5), [0, 2])
+        # При lambda = 1 остается чистый порядок по релевантности
+        self.assertEqual(mmr_select(relevance, similarity, 3, 1.0), [0, 1, 2])
+
+    def test_k_larger_than_candidates(self):
+        self.assertEqual(sorted(mmr_select(np.array([0.2, 0.1]), np.eye(2), 5, 0.5)), [0, 1])
+
+    def test_relevance_normalization(self):
+        items = [{'rerank_score': 4.0, 'similarity': 0.1}, {'rerank_score': 2.0}, {'rerank_score': 0.0}]
+        self.assertEqual(relevance_scores(items).tolist(), [1.0, 0.5, 0.0])
+        self.assertEqual(relevance_scores([{}, {}, {}]).tolist(), [1.0, 0.5, 0.0])
+
+    def test_lexical_similarity(self):
+        vectors = lexical_vectors(['настройка репликации базы', 'настройки репликации базы', 'рецепт борща'])
+        matrix = similarity_matrix(vectors)
+        self.assertAlmostEqual(matrix[0, 1], 1.0)
+        self.assertAlmostEqual(matrix[0, 2], 0.0)
+
+    def test_diversify_without_embeddings(self):
+        items = [
+            {'id': 'a', 'text': 'Настройка потоковой репликации PostgreSQL', 'rerank_score': 3.0},
+            {'id': 'b', 'text': 'Настройка потоковой репликации PostgreSQL', 'rerank_score': 2.9},
+            {'id': 'c', 'text': 'Резервное копирование', 'rerank_score': 2.0},
+        ]
+        with patch('db.get_item_embeddings', return_value={'a': [1.0, 0.0]}), \
+                patch('rag.num_tokens_from_string', side_effect=lambda text: len(text.split())):
+            stats = {}
+            selected = diversify(items, 2, lambda_mult=0.5, stats=stats)
+        self.assertEqual([item['id'] for item in selected], ['a', 'c'])
+        self.assertEqual(stats['vectors'], 'lexical')
+        self.assertEqual((stats['baseline_tokens'], stats['tokens']), (8, 6))
+
+
+if __name__ == '__main__':
+    unittest.main()
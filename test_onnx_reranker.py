@@ -0,0 +1,75 @@
+import os
+import unittest
+from types import SimpleNamespace
+import numpy as np
+from onnx_reranker import OnnxReranker
+
+# Допустимое отклонение логитов int8-модели от FlagReranker
+MAX_SCORE_DEVIATION = 0.5
+# Каталог с ONNX-экспортом bge-reranker-base для проверки на настоящей модели
+ONNX_MODEL_PATH = os.environ.get('TEST_RERANKER_ONNX_PATH')
+
+
+class FakeTokenizer:
+    def encode_batch(self, pairs):
+        # Длина "кодировки" зависит от текста, чтобы проверить выравнивание
+        return [SimpleNamespace(ids=[1] * (len(text) + 2), type_ids=[0] * (len(text) + 2)) for _, text in pairs]
+
+    def token_to_id(self, token):
+        return 1
+
+
+class FakeSession:
+    def __init__(self):
+        self.calls = []
+
+    def run(self, outputs, inputs):
+        self.calls.append(inputs)
+        # Логит = число значимых токенов
+        return [inputs['attention_mask'].sum(axis=1, keepdims=True).astype(np.float32)]
+
+
+def make_fake_reranker():
+    reranker = OnnxReranker.__new__(OnnxReranker)
+    reranker.tokenizer = FakeTokenizer()
+    reranker.session = FakeSession()
+    reranker.input_names = {'input_ids', 'attention_mask'}
+    return reranker
+
+
+class TestOnnxReranker(unittest.TestCase):
+    def test_scores_in_pair_order_across_batches(self):
+        reranker = make_fake_reranker()
+        scores = reranker.compute_score([['q', 'aaa'], ['q', 'a'], ['q', 'aa']], batch_size=2)
+        self.assertEqual(scores, [5.0, 3.0, 4.0])
+        self.assertEqual(len(reranker.session.calls), 2)
+        self.assertNotIn('token_type_ids', reranker.session.calls[0])
+
+    def test_single_pair_and_normalize(self):
+        reranker = make_fake_reranker()
+        self.assertEqual(reranker.compute_score(['q', 'a']), 3.0)
+        self.assertAlmostEqual(reranker.compute_score(['q', 'a'], normalize=True), 1 / (1 + np.exp(-3.0)))
+
+
+@unittest.skipUnless(ONNX_MODEL_PATH, 'TEST_RERANKER_ONNX_PATH не задан')
+class TestOnnxRerankerParity(unittest.TestCase):
+    """Сравнение с FlagReranker на настоящей модели"""
+    def test_scores_close_to_flag_reranker(self):
+        from FlagEmbedding import FlagReranker
+        pairs = [
+            ['что такое база данных', 'База данных - это организованный набор структурированной информации.'],
+            ['что такое база данных', 'Сегодня в городе солнечно и тепло.'],
+            ['как настроить репликацию', 'Для потоковой репликации укажите primary_conninfo на реплике.'],
+            ['как настроить репликацию', 'Рецепт борща: свекла, капуста, картофель.'],
+        ]
+        expected = FlagReranker(os.environ.get('TEST_RERANKER_MODEL', 'BAAI/bge-reranker-base'),
+                                use_fp16=False).compute_score(pairs)
+        actual = OnnxReranker(ONNX_MODEL_PATH, quantize=True).compute_score(pairs)
+        for flag_score, onnx_score in zip(expected, actual):
+            self.assertLess(abs(flag_score - onnx_score), MAX_SCORE_DEVIATION)
+        # Порядок релевантности сохраняется
+        self.assertEqual(np.argsort(expected).tolist(), np.argsort(actual).tolist())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import time
+import unittest
+from unittest.mock import patch
+from pipeline import Pipeline, search_pipeline
+from test_hybrid_search import fake_contexts
+
+
+class TestPipeline(unittest.TestCase):
+    def test_dependencies_and_errors(self):
+        pipeline = Pipeline()
+        pipeline.add('a', lambda: 2)
+        pipeline.add('b', lambda: 3)
+        pipeline.add('sum', lambda a, b: a + b, ['a', 'b'])
+        pipeline.add('broken', lambda: 1 / 0)
+        pipeline.add('after_broken', lambda value: value, ['broken'])
+        results = pipeline.run(timeout=5)
+        self.assertEqual(results, {'a': 2, 'b': 3, 'sum': 5})
+        self.assertEqual(set(pipeline.errors), {'broken', 'after_broken'})
+        self.assertGreaterEqual(pipeline.timings['sum'][0], max(pipeline.timings['a'][1], pipeline.timings['b'][1]))
+
+    def test_unknown_dependency(self):
+        with self.assertRaises(ValueError):
+            Pipeline().add('task', lambda value: value, ['missing'])
+
+    def test_timeout(self):
+        pipeline = Pipeline().add('slow', lambda: time.sleep(1)).add('fast', lambda: 1)
+        self.assertEqual(pipeline.run(timeout=0.1), {'fast': 1})
+        self.assertEqual(pipeline.errors, {'slow': 'timeout'})
+
+
+class TestSearchPipeline(unittest.TestCase):
+    def setUp(self):
+        self.calls = {}
+
+    def branch(self, name, ids, delay=0.0):
+        def run(query, keywords, limit, root_id):
+            time.sleep(delay)
+            self.calls[name] = list(keywords)
+            return list(ids)
+        return run
+
+    def run_pipeline(self, keywords, generate_delay=0.3, **kwargs):
+        branches = {
+            'fulltext': self.branch('fulltext', ['a'], 0.2),
+            'bm25': self.branch('bm25', ['b'], 0.2),
+            'vector': self.branch('vector', []),
+            'keywords': self.branch('keywords', ['c'], 0.1),
+        }
+
+        def generate(query, on_keywords):
+            time.sleep(generate_delay)
+            if on_keywords:
+                on_keywords(['слово'])
+            return ['слово']
+
+        def embed(query):
+            time.sleep(0.2)
+            return [1.0, 0.0]
+
+        with patch.dict('hybrid_search.BRANCHES', branches, clear=True), \
+                patch('hybrid_search.get_items_with_context', side_effect=fake_contexts), \
+                patch('hybrid_search.vector_search', return_value=['d']), \
+                patch('pipeline._generate_keywords', side_effect=generate), \
+                patch('pipeline._embed_query', side_effect=embed):
+            start = time.perf_counter()
+            items = search_pipeline('запрос', keywords, **kwargs)
+            return items, time.perf_counter() - start
+
+    def test_keyword_generation_overlaps_search(self):
+        generated = []
+        stats = {}
+        items, elapsed = self.run_pipeline(None, on_keywords=generated.append, stats=stats)
+        # Последовательно: 0.3 (LLM) + 0.2 (поиск); граф: max(0.3 + 0.1, 0.2)
+        self.assertLess(elapsed, 0.48)
+        self.assertEqual(sorted(item['item'][0] for item in items), ['a', 'b', 'c', 'd'])
+        self.assertEqual(generated, [['слово']])
+        self.assertEqual(stats['keywords'], ['слово'])
+        # Лексические ветви не ждут сгенерированных слов, ветвь ключевых слов получает их
+        self.assertEqual(self.calls['fulltext'], [])
+        self.assertEqual(self.calls['keywords'], ['слово'])
+
+    def test_user_keywords_are_used_by_all_branches(self):
+        stats = {}
+        self.run_pipeline(['бытие'], stats=stats)
+        self.assertEqual(self.calls['fulltext'], ['бытие'])
+        self.assertEqual(self.calls['keywords'], ['бытие'])
+        self.assertEqual(stats['keywords'], ['бытие'])
+        self.assertNotIn('generate_keywords', stats['errors'])
+
+
+if __name__ == '__main__':
+    unittest.main()
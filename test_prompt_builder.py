@@ -0,0 +1,57 @@
+import unittest
+from prompt_builder import PromptBuilder
+
+TEMPLATE = "Контекст:\n{context}\n\nВопрос: {query}\nОтвет:"
+
+class CharEncoder:
+    """Посимвольный энкодер: длина промпта точно равна сумме длин частей"""
+    def __init__(self):
+        self.encoded = []
+
+    def encode(self, text):
+        self.encoded.append(text)
+        return [ord(char) for char in text]
+
+    def decode(self, tokens):
+        return ''.join(chr(token) for token in tokens)
+
+
+class TestPromptBuilder(unittest.TestCase):
+    def setUp(self):
+        self.encoder = CharEncoder()
+        self.contexts = ['первый контекст', 'второй, более длинный контекст', 'третий']
+
+    def test_render_matches_template_and_counts_tokens(self):
+        builder = PromptBuilder(TEMPLATE, 'вопрос?', self.contexts, encoder=self.encoder)
+        prompt, tokens = builder.render()
+        context = "\n\n".join(f"Context {i}:\n{text}" for i, text in enumerate(self.contexts, 1))
+        self.assertEqual(prompt, TEMPLATE.format(context=context, query='вопрос?'))
+        self.assertEqual(tokens, len(prompt))
+        self.assertEqual(builder.last_stats['truncated'], 0)
+
+    def test_contexts_are_encoded_once(self):
+        builder = PromptBuilder(TEMPLATE, 'вопрос?', self.contexts, encoder=self.encoder)
+        for limit in (None, 80, 60, 40):
+            builder.render(limit)
+        for text in self.contexts:
+            self.assertEqual(self.encoder.encoded.count(text), 1)
+
+    def test_budget_truncates_contexts_but_keeps_question(self):
+        builder = PromptBuilder(TEMPLATE, 'вопрос?', self.contexts, encoder=self.encoder)
+        full_prompt, full_tokens = builder.render()
+        prompt, tokens = builder.render(full_tokens - 20)
+        self.assertEqual(tokens, len(prompt))
+        self.assertLessEqual(tokens, full_tokens - 20)
+        self.assertTrue(prompt.endswith("Вопрос: вопрос?\nОтвет:"))
+        self.assertLess(builder.last_stats['contexts'] + builder.last_stats['truncated'], 4)
+
+    def test_per_context_limit(self):
+        builder = PromptBuilder(TEMPLATE, 'q', self.contexts, max_context_tokens=6, encoder=self.encoder)
+        prompt, tokens = builder.render()
+        self.assertIn("Context 2:\nвторой\n\n", prompt)
+        self.assertEqual(tokens, len(prompt))
+        self.assertEqual(builder.last_stats['truncated'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import unittest
+from unittest.mock import patch, MagicMock
+from rerank_cache import RerankScoreCache, normalize_query, query_hash
+
+
+class TestRerankScoreCache(unittest.TestCase):
+    def test_query_normalization(self):
+        self.assertEqual(normalize_query('  Что   такое Ёж?\n'), 'что такое еж?')
+        self.assertEqual(query_hash('Что такое  ЁЖ?'), query_hash('что такое еж?'))
+        self.assertNotEqual(query_hash('что такое еж?'), query_hash('что такое уж?'))
+
+    def test_hits_and_misses(self):
+        cache = RerankScoreCache(max_size=10, persist=False)
+        cache.put_many({('q', 'a', 'm'): 0.5, ('q', 'b', 'm'): 0.0})
+        found = cache.get_many([('q', 'a', 'm'), ('q', 'b', 'm'), ('q', 'c', 'm'), ('q', 'a', 'other')])
+        self.assertEqual(found, {('q', 'a', 'm'): 0.5, ('q', 'b', 'm'): 0.0})
+        self.assertEqual((cache.hits, cache.misses), (2, 2))
+
+    def test_lru_eviction(self):
+        cache = RerankScoreCache(max_size=2, persist=False)
+        cache.put_many({('q', 'a', 'm'): 1.0, ('q', 'b', 'm'): 2.0})
+        cache.get_many([('q', 'a', 'm')])  # 'a' становится самым свежим
+        cache.put_many({('q', 'c', 'm'): 3.0})
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(set(cache.get_many([('q', 'a', 'm'), ('q', 'b', 'm'), ('q', 'c', 'm')])),
+                         {('q', 'a', 'm'), ('q', 'c', 'm')})
+
+    def test_persistent_lookup_only_for_memory_misses(self):
+        cache = RerankScoreCache(max_size=10, persist=True)
+        cache._remember({('q', 'a', 'm'): 1.0})
+        with patch.object(cache, '_load', return_value={('q', 'b', 'm'): 2.0}) as load:
+            found = cache.get_many([('q', 'a', 'm'), ('q', 'b', 'm')])
+        load.assert_called_once_with([('q', 'b', 'm')])
+        self.assertEqual(found, {('q', 'a', 'm'): 1.0, ('q', 'b', 'm'): 2.0})
+        # Прочитанное из БД оседает в памяти
+        self.assertEqual(cache.get_many([('q', 'b', 'm')]), {('q', 'b', 'm'): 2.0})
+
+    def test_table_marked_ready_only_after_commit(self):
+        cache = RerankScoreCache(max_size=10, persist=True)
+        conn = MagicMock()
+        conn.__enter__.return_value = conn
+        conn.__exit__.side_effect = [RuntimeError("commit failed"), None]
+        with patch('db.get_connection', return_value=conn) as get_connection:
+            with self.assertRaises(RuntimeError):
+                cache._ensure_table()
+            self.assertFalse(cache._table_ready)
+            cache._ensure_table()
+            self.assertTrue(cache._table_ready)
+            cache._ensure_table()
+        # Таблица создается на основном сервере; после успеха повторно не создается
+        self.assertEqual(get_connection.call_count, 2)
+        get_connection.assert_called_with()
+
+    def test_load_reads_from_replica_without_ddl(self):
+        cache = RerankScoreCache(max_size=10, persist=True)
+        conn = MagicMock()
+        conn.__enter__.return_value = conn
+        cur = conn.cursor.return_value.__enter__.return_value
+        cur.fetchall.return_value = [('a', 0.5)]
+        with patch('db.get_connection', return_value=conn) as get_connection:
+            self.assertEqual(cache._load([('q', 'a', 'm')]), {('q', 'a', 'm'): 0.5})
+        get_connection.assert_called_once_with(readonly=True)
+        self.assertNotIn('CREATE', ' '.join(call.args[0] for call in cur.execute.call_args_list))
+
+
+if __name__ == '__main__':
+    unittest.main()
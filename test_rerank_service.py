@@ -0,0 +1,68 @@
+import threading
+import unittest
+from rerank_service import RerankService
+
+
+class FakeModel:
+    def __init__(self, fail=False):
+        self.batches = []
+        self.fail = fail
+
+    def compute_score(self, pairs, batch_size=64):
+        if self.fail:
+            raise RuntimeError('model failure')
+        self.batches.append(list(pairs))
+        scores = [float(len(text)) for _, text in pairs]
+        return scores[0] if len(scores) == 1 else scores
+
+
+class TestRerankService(unittest.TestCase):
+    def make_service(self, model, **kwargs):
+        service = RerankService(lambda: model, **kwargs)
+        self.addCleanup(service.close)
+        return service
+
+    def test_concurrent_callers_share_batch(self):
+        model = FakeModel()
+        service = self.make_service(model, max_batch_size=64, max_wait_ms=200)
+        barrier = threading.Barrier(4)
+        results = {}
+
+        def call(n):
+            barrier.wait()
+            results[n] = service.score([['q', 'x' * (n + i)] for i in range(3)])
+
+        threads = [threading.Thread(target=call, args=(n,)) for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for n in range(4):
+            self.assertEqual(results[n], [float(n), float(n + 1), float(n + 2)])
+        self.assertLess(len(model.batches), 4)
+        self.assertEqual(sum(len(batch) for batch in model.batches), 12)
+
+    def test_batch_size_limit(self):
+        model = FakeModel()
+        service = self.make_service(model, max_batch_size=2, max_wait_ms=50)
+        futures = [service.submit([['q', 'a'], ['q', 'bb']]) for _ in range(3)]
+        self.assertEqual([future.result(5) for future in futures], [[1.0, 2.0]] * 3)
+        self.assertTrue(all(len(batch) <= 2 for batch in model.batches))
+
+    def test_single_pair_and_empty_request(self):
+        service = self.make_service(FakeModel(), max_wait_ms=0)
+        self.assertEqual(service.score([['q', 'abc']], timeout=5), [3.0])
+        self.assertEqual(service.score([], timeout=5), [])
+
+    def test_model_error_reaches_caller(self):
+        service = self.make_service(FakeModel(fail=True), max_wait_ms=0)
+        with self.assertRaises(RuntimeError):
+            service.score([['q', 'a']], timeout=5)
+        # Рабочий поток продолжает работу после ошибки
+        with self.assertRaises(RuntimeError):
+            service.score([['q', 'b']], timeout=5)
+
+
+if __name__ == '__main__':
+    unittest.main()
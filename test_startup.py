@@ -0,0 +1,44 @@
+import unittest
+from import_report import measure_imports, parse_importtime, total_time_us
+
+# Бюджет времени импорта main для режимов, работающих только с БД (-i, -s, -v)
+IMPORT_BUDGET_MS = 1000
+# Тяжелые зависимости, которые должны загружаться только при первом использовании
+HEAVY_MODULES = {'FlagEmbedding', 'torch', 'transformers', 'onnxruntime', 'openai', 'tiktoken',
+                 'numpy', 'pandas', 'matplotlib', 'rank_bm25', 'asyncpg'}
+# Модули проекта, которые тянут тяжелые зависимости
+LAZY_PROJECT_MODULES = {'retrieval', 'rag', 'keywords', 'embeddings', 'hybrid_search', 'db_analyzer',
+                        'openai_api_models'}
+
+
+class TestImportReport(unittest.TestCase):
+    def test_parse_importtime(self):
+        output = '\n'.join([
+            'import time: self [us] | cumulative | imported package',
+            'import time:       181 |        181 |   _io',
+            'import time:        50 |         50 |     encodings.aliases',
+            'import time:       900 |        950 |   encodings',
+        ])
+        records = parse_importtime(output)
+        self.assertEqual([(r.module, r.self_us, r.cumulative_us, r.depth) for r in records],
+                         [('_io', 181, 181, 0), ('encodings.aliases', 50, 50, 1), ('encodings', 900, 950, 0)])
+        self.assertEqual(total_time_us(records), 1131)
+
+
+class TestStartupImports(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.records = measure_imports('main')
+        cls.modules = {record.module for record in cls.records}
+
+    def test_heavy_dependencies_not_imported(self):
+        packages = {module.split('.')[0] for module in self.modules}
+        self.assertEqual(packages & HEAVY_MODULES, set())
+        self.assertEqual(self.modules & LAZY_PROJECT_MODULES, set())
+
+    def test_import_time_budget(self):
+        self.assertLess(total_time_us(self.records) / 1000, IMPORT_BUDGET_MS)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import io
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+from openai_api_models import iter_chat_completion, stream_chat_completion
+from utils import StreamPrinter
+
+
+def chunk(text):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))])
+
+
+class FakeCompletions:
+    def __init__(self, parts):
+        self.parts = parts
+        self.kwargs = None
+
+    def create(self, **kwargs):
+        self.kwargs = kwargs
+        # Первый фрагмент с ролью без текста, последний - пустой, как у API
+        return iter([chunk(None)] + [chunk(part) for part in self.parts] + [SimpleNamespace(choices=[])])
+
+
+def fake_client(parts):
+    completions = FakeCompletions(parts)
+    return SimpleNamespace(chat=SimpleNamespace(completions=completions)), completions
+
+
+class TestStreaming(unittest.TestCase):
+    def test_iter_yields_parts_and_records_stats(self):
+        api_client, completions = fake_client(['Бытие', ' и', ' сознание'])
+        stats = {}
+        parts = list(iter_chat_completion([{'role': 'user', 'content': 'q'}], model='m', stats=stats,
+                                          api_client=api_client, temperature=0.3))
+        self.assertEqual(parts, ['Бытие', ' и', ' сознание'])
+        self.assertTrue(completions.kwargs['stream'])
+        self.assertEqual(completions.kwargs['temperature'], 0.3)
+        self.assertEqual(stats['tokens'], 3)
+        self.assertIsNotNone(stats['ttft'])
+        self.assertGreaterEqual(stats['total_time'], stats['ttft'])
+
+    def test_stream_returns_full_text_and_prints_incrementally(self):
+        api_client, _ = fake_client(['Ответ', ' готов'])
+        printer = StreamPrinter('Ответ: ')
+        with patch('sys.stdout', new_callable=io.StringIO) as stdout:
+            answer = stream_chat_completion([{'role': 'user', 'content': 'q'}], on_token=printer,
+                                            api_client=api_client, model='m')
+            printer.finish()
+        self.assertEqual(answer, 'Ответ готов')
+        self.assertEqual(stdout.getvalue(), 'Ответ: Ответ готов\n')
+
+    def test_printer_silent_without_tokens(self):
+        printer = StreamPrinter('Ответ: ')
+        with patch('sys.stdout', new_callable=io.StringIO) as stdout:
+            printer.finish()
+        self.assertFalse(printer.started)
+        self.assertEqual(stdout.getvalue(), '')
+
+    def test_interrupted_stream_is_not_returned_as_answer(self):
+        # standalone_search при импорте настраивает логирование в файл
+        with patch('logging.FileHandler'), patch('logging.basicConfig'):
+            from standalone_search import query_ai
+
+        def broken_stream(messages, on_token=None, stats=None, **kwargs):
+            on_token('Частичный')
+            raise ConnectionError("соединение разорвано")
+
+        printer = StreamPrinter('Ответ: ')
+        stats = {}
+        with patch('standalone_search.stream_chat_completion', side_effect=broken_stream), \
+                patch('sys.stdout', new_callable=io.StringIO) as stdout:
+            answer = query_ai([('id1', 'текст')], 'вопрос', on_token=printer, stats=stats)
+            printer.finish(interrupted=True)
+        self.assertIsNone(answer)
+        self.assertEqual(stats['error'], 'соединение разорвано')
+        self.assertEqual(stdout.getvalue(), 'Ответ: Частичный [ответ прерван]\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,32 @@
+import threading
+import unittest
+from warmup import Warmup, READY, FAILED
+
+
+class TestWarmup(unittest.TestCase):
+    def test_tasks_run_in_background_and_report_state(self):
+        release = threading.Event()
+        calls = []
+
+        def slow():
+            release.wait(5)
+            calls.append('slow')
+
+        def broken():
+            raise RuntimeError('нет подключения')
+
+        warmup = Warmup({'slow': slow, 'fast': lambda: calls.append('fast'), 'broken': broken}).start()
+        self.assertTrue(warmup.wait(5, names=['fast', 'broken']))
+        self.assertFalse(warmup.is_ready('slow'))
+        self.assertFalse(warmup.is_ready())
+        self.assertFalse(warmup.wait(0.05))
+
+        release.set()
+        self.assertTrue(warmup.wait(5))
+        self.assertEqual(warmup.status(), {'slow': READY, 'fast': READY, 'broken': FAILED})
+        self.assertEqual(warmup.errors, {'broken': 'нет подключения'})
+        self.assertEqual(sorted(calls), ['fast', 'slow'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+"""
+Токенизация текстов для лексического поиска (BM25)
+
+Текст приводится к нижнему регистру, ё заменяется на е, стоп-слова
+отбрасываются, а слова сводятся к основе стеммером Snowball: русскому
+для кириллицы и английскому для латиницы.
+"""
+import re
+from functools import lru_cache
+from typing import List, Tuple
+
+import snowballstemmer
+
+_TOKEN_RE = re.compile(r'[0-9a-zа-я]+')
+_CYRILLIC_RE = re.compile(r'[а-я]')
+
+_russian_stemmer = snowballstemmer.stemmer('russian')
+_english_stemmer = snowballstemmer.stemmer('english')
+
+RUSSIAN_STOPWORDS = frozenset("""
+а без более бы был была были было быть в вам вас весь во вот все всего всех вы где да даже для до
+его ее ей ему если есть еще же за здесь и из или им их к как ко когда кто ли либо между меня мне
+может мы на над надо наш не него нее нет ни них но ну о об однако он она они оно от очень по под
+после при про с со так также такой там те тем то того тоже той только том ты у уже хотя чего чей
+чем что чтобы чье чья эта эти это этого этой этом этот я
+""".split())
+
+ENGLISH_STOPWORDS = frozenset("""
+a an and are as at be by for from has have in is it its of on or that the this to was were will with
+""".split())
+
+STOPWORDS = RUSSIAN_STOPWORDS | ENGLISH_STOPWORDS
+
+@lru_cache(maxsize=200000)
+def stem(word: str) -> str:
+    """Возвращает основу слова (слово уже в нижнем регистре)"""
+    if _CYRILLIC_RE.search(word):
+        return _russian_stemmer.stemWord(word)
+    return _english_stemmer.stemWord(word)
+
+def tokenize(text: str, min_length: int = 2) -> List[str]:
+    """
+    Разбивает текст на основы слов без стоп-слов
+
+    Args:
+        text: Исходный текст
+        min_length: Минимальная длина слова до стемминга
+
+    Returns:
+        Список основ в порядке следования в тексте (с повторами)
+    """
+    return [term for _, term in tokenize_words(text, min_length)]
+
+def tokenize_words(text: str, min_length: int = 2) -> List[Tuple[str, str]]:
+    """Как tokenize, но возвращает пары (слово в нижнем регистре, основа)"""
+    if not text:
+        return []
+    words = _TOKEN_RE.findall(text.lower().replace('ё', 'е'))
+    return [(word, stem(word)) for word in words if len(word) >= min_length and word not in STOPWORDS]
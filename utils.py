@@ -53,6 +53,29 @@ class ProgressIndicator:
         if self.thread:
             self.thread.join()
 
+class StreamPrinter:
+    """Печатает фрагменты потокового ответа по мере поступления, с заголовком перед первым"""
+    def __init__(self, header: str = ""):
+        self.header = header
+        self.started = False
+
+    def __call__(self, text: str):
+        if not self.started:
+            self.started = True
+            sys.stdout.write(self.header)
+        sys.stdout.write(text)
+        sys.stdout.flush()
+
+    def finish(self, interrupted: bool = False):
+        """
+        Завершает строку ответа, если что-то было напечатано
+
+        interrupted: поток оборвался - после напечатанной части ставится пометка
+        """
+        if self.started:
+            sys.stdout.write(' [ответ прерван]\n' if interrupted else '\n')
+            sys.stdout.flush()
+
 def extract_text(item):
     """
     Извлекает и возвращает текст из переданного элемента.
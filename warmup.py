@@ -0,0 +1,150 @@
+"""
+Фоновый прогрев при запуске
+
+Первый вопрос в сессии последовательно платит за загрузку реранжировщика,
+загрузку BPE-словаря tiktoken, TLS-соединение с OpenAI и подключение к БД.
+Прогрев запускает все это в фоновых потоках, пока пользователь набирает
+вопрос в input(), и делает пробный прогон (реранжирование пары, кодирование
+строки), чтобы выделение памяти и инициализация ядер произошли заранее.
+Каждая задача прогревает те же кэши, которыми потом пользуется обработка
+запроса, поэтому результат прогрева отдельно нигде не хранится.
+
+Состояние каждой задачи: pending -> running -> ready | failed.
+"""
+import logging
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from config import WARMUP_SETTINGS, MODELS, RERANKER_SETTINGS
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+RUNNING = 'running'
+READY = 'ready'
+FAILED = 'failed'
+
+def _warm_db():
+    from db import get_connection
+    with get_connection(readonly=True) as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+            cur.fetchone()
+
+def _warm_reranker():
+    from retrieval import _get_reranker
+    from length_batching import bucketed
+    from rerank_service import get_rerank_service
+    model_name = 'bge-reranker-base'  # Модель по умолчанию rerank_with_cross_encoder
+    pairs = [['прогрев модели', 'Пробный текст для прогрева реранжировщика.']]
+    # Пробный прогон тем же путем, что и compute_rerank_scores, но мимо кэша оценок
+    if RERANKER_SETTINGS.get('service_enabled', False):
+        get_rerank_service(lambda: bucketed(_get_reranker(model_name))).score(pairs)
+    else:
+        bucketed(_get_reranker(model_name)).compute_score(pairs)
+
+def _warm_tokenizer():
+    from rag import num_tokens_from_string
+    from embeddings import count_tokens
+    num_tokens_from_string('Пробная строка для прогрева токенизатора')
+    count_tokens('Пробная строка для прогрева токенизатора', MODELS['embedding']['name'])
+
+def _warm_openai():
+    from openai import APIStatusError
+    from openai_api_models import client
+    # Легкий запрос: устанавливает TLS-соединение, которое остается в пуле клиента
+    try:
+        client.models.retrieve(MODELS['generation']['name'])
+    except APIStatusError:
+        # Сервер ответил (например, 404 для псевдонима модели) - соединение уже установлено
+        pass
+
+def _warm_bm25():
+    from bm25_index import get_index
+    get_index()
+
+def _warm_keywords():
+    from keyword_extractor import get_extractor
+    try:
+        get_extractor()
+    except FileNotFoundError:
+        # Статистика не построена - generate_keywords_for_query использует LLM
+        pass
+
+# Задачи прогрева: имя -> функция
+TASKS: Dict[str, Callable[[], None]] = {
+    'db': _warm_db,
+    'reranker': _warm_reranker,
+    'tokenizer': _warm_tokenizer,
+    'openai': _warm_openai,
+    'bm25': _warm_bm25,
+    'keywords': _warm_keywords,
+}
+
+class Warmup:
+    """Набор задач прогрева, выполняемых в фоновых потоках"""
+    def __init__(self, tasks: Dict[str, Callable[[], None]]):
+        self.tasks = tasks
+        self.state: Dict[str, str] = {name: PENDING for name in tasks}
+        self.errors: Dict[str, str] = {}
+        self.timings: Dict[str, float] = {}
+        self._events = {name: threading.Event() for name in tasks}
+        self._lock = threading.Lock()
+
+    def start(self) -> 'Warmup':
+        for name in self.tasks:
+            threading.Thread(target=self._run, args=(name,), name=f'warmup-{name}', daemon=True).start()
+        return self
+
+    def _run(self, name: str):
+        with self._lock:
+            self.state[name] = RUNNING
+        start = time.perf_counter()
+        try:
+            self.tasks[name]()
+            state = READY
+        except Exception as e:
+            logger.warning(f"Прогрев {name} не удался: {str(e)}")
+            self.errors[name] = str(e)
+            state = FAILED
+        with self._lock:
+            self.state[name] = state
+            self.timings[name] = time.perf_counter() - start
+        logger.debug(f"Прогрев {name}: {state} за {self.timings[name]:.2f} с")
+        self._events[name].set()
+
+    def is_ready(self, name: str = None) -> bool:
+        """Завершена ли задача (или все задачи); неудачная задача тоже считается завершенной"""
+        names = [name] if name else list(self.tasks)
+        return all(self._events[task].is_set() for task in names)
+
+    def wait(self, timeout: float = None, names: List[str] = None) -> bool:
+        """Ждет завершения задач не дольше timeout секунд в сумме; возвращает is_ready"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for name in names or list(self.tasks):
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            self._events[name].wait(remaining)
+        return all(self.is_ready(name) for name in names or self.tasks)
+
+    def status(self) -> Dict[str, str]:
+        with self._lock:
+            return dict(self.state)
+
+_warmup: Optional[Warmup] = None
+
+def start_warmup(names: List[str] = None) -> Optional[Warmup]:
+    """
+    Запускает прогрев, если он включен в WARMUP_SETTINGS; повторный вызов
+    возвращает уже запущенный прогрев
+    """
+    global _warmup
+    if _warmup is None and WARMUP_SETTINGS.get('enabled', True):
+        names = names or WARMUP_SETTINGS.get('tasks', list(TASKS))
+        _warmup = Warmup({name: TASKS[name] for name in names if name in TASKS}).start()
+        logger.debug(f"Запущен прогрев: {', '.join(_warmup.tasks)}")
+    return _warmup
+
+def get_warmup() -> Optional[Warmup]:
+    """Возвращает запущенный прогрев или None"""
+    return _warmup